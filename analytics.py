@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Daily sales rollups for the admin analytics page.
+
+Every order is folded into one sales_daily document per calendar day holding
+the day's orders, units and revenue plus per-size, per-category and
+per-product breakdowns. Checkout and order status changes $inc the bucket of
+the order's day, so a year of charts reads at most 366 small documents instead
+of unwinding every order. Cancelled orders are moved out of the sales figures
+into a separate cancelled count.
+
+Rebuild the rollups from the orders collection (e.g. after a backfill) with:
+    python analytics.py rebuild [--since YYYY-MM-DD]
+"""
+
+import argparse
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from pymongo import ReplaceOne
+
+SALES_DAILY = 'sales_daily'
+DIMENSIONS = ('sizes', 'categories', 'products')
+NON_SALE_STATUSES = ('cancelled',)
+ORDER_PROJECTION = {'created_at': 1, 'items': 1, 'total_amount': 1, 'status': 1}
+
+
+def get_timezone(name):
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return timezone.utc
+
+
+def sales_day(created_at, tz):
+    """Calendar day (YYYY-MM-DD in tz) an order is reported under"""
+    if created_at.tzinfo is None:
+        # Mongo returns naive UTC datetimes
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return created_at.astimezone(tz).strftime('%Y-%m-%d')
+
+
+def _item_line(item, products=None):
+    """(size, category key, product key, units, revenue) for one order item"""
+    units = int(item.get('quantity') or 0)
+    price = item.get('price')
+    category_id = item.get('category_id')
+    if (price is None or category_id is None) and products is not None:
+        # Orders placed before item snapshots were recorded fall back to the current product
+        product = products.get(str(item.get('product_id'))) or {}
+        price = product.get('price') if price is None else price
+        category_id = product.get('category_id') if category_id is None else category_id
+    revenue = round(float(price or 0) * units, 2)
+    category = str(category_id) if category_id is not None else 'uncategorized'
+    return item.get('size') or 'unknown', category, str(item.get('product_id')), units, revenue
+
+
+def order_increments(order, sign=1, products=None):
+    """$inc fields that add (sign=1) or remove (sign=-1) an order from its day bucket"""
+    if order.get('status') in NON_SALE_STATUSES:
+        return {'cancelled': sign}
+    inc = {
+        'orders': sign,
+        'revenue': round(float(order.get('total_amount') or 0), 2) * sign,
+    }
+
+    def add(field, value):
+        inc[field] = inc.get(field, 0) + value * sign
+
+    for item in order.get('items') or []:
+        size, category, product, units, revenue = _item_line(item, products)
+        add('units', units)
+        for dimension, key in (('sizes', size), ('categories', category), ('products', product)):
+            add(f'{dimension}.{key}.units', units)
+            add(f'{dimension}.{key}.revenue', revenue)
+    return inc
+
+
+def _apply(db, day, inc):
+    inc = {field: value for field, value in inc.items() if value}
+    if inc:
+        db[SALES_DAILY].update_one(
+            {'_id': day},
+            {'$inc': inc, '$setOnInsert': {'date': datetime.strptime(day, '%Y-%m-%d')}},
+            upsert=True
+        )
+
+
+def record_order(db, order, tz):
+    _apply(db, sales_day(order['created_at'], tz), order_increments(order))
+
+
+def record_status_change(db, order, new_status, tz):
+    """order is the document as it was before the status update"""
+    was_sale = order.get('status') not in NON_SALE_STATUSES
+    if was_sale == (new_status not in NON_SALE_STATUSES):
+        return
+    inc = order_increments(order, sign=-1)
+    for field, value in order_increments(dict(order, status=new_status)).items():
+        inc[field] = inc.get(field, 0) + value
+    _apply(db, sales_day(order['created_at'], tz), inc)
+
+
+def rebuild(db, tz, since=None, batch_size=1000):
+    """Recompute the day buckets from the orders collection; returns (days, orders)"""
+    products = {str(p['_id']): p for p in db.products.find({}, {'price': 1, 'category_id': 1})}
+    query = {}
+    if since:
+        # Start a day early so the whole first local day is covered, then drop the extra day
+        query['created_at'] = {'$gte': datetime.strptime(since, '%Y-%m-%d') - timedelta(days=1)}
+    buckets = {}
+    count = 0
+    for order in db.orders.find(query, ORDER_PROJECTION).batch_size(batch_size):
+        if not order.get('created_at'):
+            continue
+        day = sales_day(order['created_at'], tz)
+        if since and day < since:
+            continue
+        bucket = buckets.setdefault(day, {})
+        for field, value in order_increments(order, products=products).items():
+            bucket[field] = bucket.get(field, 0) + value
+        count += 1
+
+    stale = {'$nin': list(buckets)}
+    if since:
+        stale['$gte'] = since
+    db[SALES_DAILY].delete_many({'_id': stale})
+    ops = [ReplaceOne({'_id': day}, _expand(day, fields), upsert=True) for day, fields in buckets.items()]
+    for start in range(0, len(ops), batch_size):
+        db[SALES_DAILY].bulk_write(ops[start:start + batch_size], ordered=False)
+    return len(buckets), count
+
+
+def _expand(day, fields):
+    """Turn dotted $inc paths back into a nested day document"""
+    doc = {'_id': day, 'date': datetime.strptime(day, '%Y-%m-%d')}
+    for path, value in fields.items():
+        target = doc
+        *parents, leaf = path.split('.')
+        for part in parents:
+            target = target.setdefault(part, {})
+        target[leaf] = round(value, 2) if isinstance(value, float) else value
+    return doc
+
+
+def sales_series(db, start, end, dimension=None):
+    """Day-by-day totals from start to end (YYYY-MM-DD, inclusive), zero-filled.
+
+    With a dimension ('sizes', 'categories' or 'products') the per-key units and
+    revenue series are included as well.
+    """
+    projection = {'orders': 1, 'units': 1, 'revenue': 1, 'cancelled': 1}
+    if dimension:
+        projection[dimension] = 1
+    docs = {doc['_id']: doc for doc in
+            db[SALES_DAILY].find({'_id': {'$gte': start, '$lte': end}}, projection)}
+
+    days = []
+    day = datetime.strptime(start, '%Y-%m-%d')
+    last = datetime.strptime(end, '%Y-%m-%d')
+    while day <= last:
+        days.append(day.strftime('%Y-%m-%d'))
+        day += timedelta(days=1)
+
+    series = {'days': days}
+    for field in ('orders', 'units', 'revenue', 'cancelled'):
+        series[field] = [docs.get(d, {}).get(field, 0) for d in days]
+    if dimension:
+        keys = sorted({key for doc in docs.values() for key in doc.get(dimension, {})})
+        series[dimension] = {
+            key: {
+                field: [docs.get(d, {}).get(dimension, {}).get(key, {}).get(field, 0) for d in days]
+                for field in ('units', 'revenue')
+            }
+            for key in keys
+        }
+    return series
+
+
+def main():
+    from pymongo import MongoClient
+    from config import Config
+
+    parser = argparse.ArgumentParser(description='Daily sales rollups')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    rebuild_cmd = subcommands.add_parser('rebuild', help='recompute the rollups from orders')
+    rebuild_cmd.add_argument('--since', help='only rebuild days from YYYY-MM-DD onwards')
+    args = parser.parse_args()
+
+    client = MongoClient(Config.MONGODB_URI)
+    try:
+        started = time.perf_counter()
+        days, orders = rebuild(client.get_database(), get_timezone(Config.ANALYTICS_TIMEZONE), args.since)
+        print(f"✅ Rebuilt {days} days from {orders} orders in {time.perf_counter() - started:.1f}s")
+    finally:
+        client.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
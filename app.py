@@ -1,19 +1,42 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, send_file
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, g, Response, make_response
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
-from pymongo import MongoClient
-from bson import ObjectId
-from PIL import Image
+from werkzeug.datastructures import ContentRange
+from werkzeug.http import is_resource_modified
+from werkzeug.wsgi import ClosingIterator
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from bson import ObjectId, json_util
 import os
-import io
+import base64
+import hashlib
+import tempfile
+import hmac
+import threading
+import time
 import bcrypt
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+from functools import wraps
 from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 from config import Config
-from email.message import EmailMessage
-import smtplib
-from flask import render_template_string
+from cache import create_cache, MemoryBackend, PageCache
+from catalog_index import CatalogIndex, INDEX_PROJECTION
+import typeahead
+from images import ImagePipeline, apply_derivatives, derivative_paths, ingest_upload
+from mailer import email_enabled, enqueue_email
+from stock import reserve_stock, release_stock, StockReservationError, adjust_stock, applied_product_ids, read_adjustments
+from stats import bump_stats, get_dashboard_stats, record_order_placed, record_order_status_change
+import analytics
+import carts
+from indexes import ensure_indexes_in_background, explain_report
+from instrumentation import MongoCommandRecorder, RouteReport, server_timing
+from metrics import Metrics
+from exports import EXPORTS, FORMATS, export_filename, parse_timestamp, stream_export
+from catalog_import import CatalogImporter, ImageSource, detect_format, read_rows
+from mongo_profiles import create_clients, load_profiles
+from flask import has_request_context
+from jinja2 import FileSystemLoader, FileSystemBytecodeCache, TemplateNotFound
 
 app = Flask(__name__)
 app.config.from_object(Config)
@@ -23,6 +46,8 @@ try:
 except ZoneInfoNotFoundError:
     IST_TZ = None
 
+ANALYTICS_TZ = analytics.get_timezone(app.config['ANALYTICS_TIMEZONE'])
+
 # Jinja filters
 @app.template_filter('inr')
 def inr_filter(value):
@@ -60,20 +85,195 @@ def ist_datetime_filter(dt):
         return str(dt)
 
 # MongoDB setup
-client = MongoClient(app.config['MONGODB_URI'])
+# Commands issued while handling a request are recorded per route; see instrumentation.py
+mongo_recorder = MongoCommandRecorder()
+mongo_report = RouteReport(app.config['MONGO_N_PLUS_ONE_THRESHOLD'])
+# One client per read profile, each with its own pool; see mongo_profiles.py.
+# db is the primary (every write, orders, stock, carts, auth); catalog_db and
+# reports_db may lag it by up to their profile's maxStalenessSeconds.
+mongo_clients = create_clients(app.config['MONGODB_URI'], load_profiles(app.config['MONGO_PROFILES']),
+                               [mongo_recorder] if app.config['MONGO_INSTRUMENTATION'] else [])
+client = mongo_clients['transactional']
 db = client.get_database()
+catalog_db = mongo_clients['catalog'].get_database()
+reports_db = mongo_clients['admin-reports'].get_database()
+
+@app.before_request
+def start_mongo_trace():
+    if app.config['MONGO_INSTRUMENTATION']:
+        g.mongo_trace_token = mongo_recorder.begin()
+
+def record_mongo_trace(trace, endpoint):
+    """Add a finished request's commands to the route report and metrics"""
+    elapsed = time.perf_counter() - trace.started
+    repeated = mongo_report.record(endpoint or 'unknown', trace, elapsed)
+    if trace.commands:
+        label = endpoint or 'unmatched'
+        metrics.inc('mongo_commands_total', len(trace.commands), endpoint=label)
+        metrics.inc('mongo_command_seconds_total', trace.mongo_ms / 1000, endpoint=label)
+    # Also listed under n_plus_one in /admin/mongo; surfaced in the log while developing
+    if app.debug:
+        for collection, shape, n in repeated:
+            app.logger.warning('N+1 query in %s: %dx %s %s', endpoint, n, collection, shape)
+
+@app.after_request
+def finish_mongo_trace(response):
+    trace = mongo_recorder.current()
+    if trace is None:
+        return response
+    if response.is_streamed:
+        # GridFS chunks and export cursors are read while the body is sent, after
+        # teardown; the trace stays open until the server closes the body. Wrapping
+        # the body rather than call_on_close, which direct_passthrough skips
+        token, endpoint = g.pop('mongo_trace_token', None), request.endpoint
+        def close_trace():
+            record_mongo_trace(trace, endpoint)
+            if token is not None:
+                mongo_recorder.end(token)
+        response.response = ClosingIterator(response.response, close_trace)
+        return response
+    if app.config['SERVER_TIMING_HEADER']:
+        response.headers.add('Server-Timing', server_timing(trace, time.perf_counter() - trace.started))
+    record_mongo_trace(trace, request.endpoint)
+    return response
+
+@app.teardown_request
+def end_mongo_trace(error):
+    token = g.pop('mongo_trace_token', None)
+    if token is not None:
+        mongo_recorder.end(token)
+
+# Prometheus metrics, merged across worker processes through METRICS_DIR; see metrics.py
+metrics = Metrics(app.config['METRICS_DIR'], app.config['METRICS_FLUSH_INTERVAL'])
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    metrics.gauge_add('http_requests_in_flight', 1)
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.endpoint or 'unmatched'
+    metrics.inc('http_requests_total', endpoint=endpoint, method=request.method, status=response.status_code)
+    metrics.observe('http_request_duration_seconds', time.perf_counter() - g.request_started, endpoint=endpoint)
+    if response.content_length is not None:
+        metrics.observe('http_response_size_bytes', response.content_length, endpoint=endpoint)
+    return response
+
+@app.teardown_request
+def end_request_metrics(error):
+    if g.pop('request_started', None) is not None:
+        metrics.gauge_add('http_requests_in_flight', -1)
+
+# Build any missing indexes without holding up startup; see indexes.py
+if app.config['INDEXES_ON_STARTUP']:
+    ensure_indexes_in_background(db)
+
+# Read-through cache for catalog queries; see cache.py
+query_cache = create_cache(app.config)
+
+# Query cache fills read the primary: they follow invalidations and are kept for
+# CACHE_DEFAULT_TTL, so a lagging secondary would pin the old data that long
+def get_categories():
+    """All categories, served from the query cache"""
+    return query_cache.get_or_set('categories:all', lambda: list(db.categories.find()), tags=['categories'])
+
+def get_featured_products():
+    """Featured products for the home page, served from the query cache"""
+    return query_cache.get_or_set('products:featured',
+                                  lambda: list(db.products.find({'featured': True}).limit(8)),
+                                  tags=['products'])
+
+# Whole pages for anonymous visitors, in the same backend; see PageCache
+page_cache = PageCache(query_cache, ttl=app.config['PAGE_CACHE_TTL'], stale_ttl=app.config['PAGE_CACHE_STALE_TTL'])
+
+def page_cacheable():
+    # Pending flash messages and carts can show up in the page, so those visitors get it rendered
+    return (app.config['PAGE_CACHE_ENABLED'] and request.method == 'GET'
+            and not current_user.is_authenticated and '_flashes' not in session and 'cart_id' not in session)
+
+def store_page(key, response, versions):
+    """Cache a rendered response if it is a plain 200 HTML page; returns the cached page or None"""
+    if response.status_code != 200 or response.mimetype != 'text/html' or session.modified:
+        return None
+    body = response.get_data()
+    page = {'body': body, 'etag': hashlib.sha256(body).hexdigest()[:32], 'content_type': response.content_type}
+    page_cache.store(key, page, versions)
+    return page
+
+def refresh_page(key, view, view_args, tags, path, base_url):
+    try:
+        with app.test_request_context(path, base_url=base_url):
+            # Read before rendering, so a write landing mid-render leaves the page stale rather than wrong
+            versions = page_cache.versions(tags)
+            store_page(key, make_response(view(**view_args)), versions)
+    except Exception as e:
+        print(f"Page refresh failed for {path}: {e}")
+    finally:
+        page_cache.release_refresh(key)
+
+def page_response(page, state):
+    if request.if_none_match.contains(page['etag']):
+        response = Response(status=304)
+    else:
+        response = Response(page['body'], content_type=page['content_type'])
+    response.set_etag(page['etag'])
+    # Browsers revalidate every time; unchanged pages cost a 304
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Page-Cache'] = state
+    return response
+
+def cached_page(*tags):
+    """Serve a view from the page cache for anonymous GETs, keyed by path and query string"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**view_args):
+            if not page_cacheable():
+                return view(**view_args)
+            key = f'page:{request.full_path}'
+            page, stale, versions = page_cache.lookup(key, tags)
+            if page is None:
+                response = make_response(view(**view_args))
+                page = store_page(key, response, versions)
+                return page_response(page, 'MISS') if page else response
+            if stale and page_cache.claim_refresh(key):
+                threading.Thread(target=refresh_page, name='page-refresh', daemon=True,
+                                 args=(key, view, view_args, tags, request.full_path, request.url_root)).start()
+            return page_response(page, 'STALE' if stale else 'HIT')
+        return wrapper
+    return decorator
 
 # Flask-Login setup
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
+# Fields User needs, cached per process. Every change to a user document bumps its
+# auth_version (admin profile, reset_admin.py), so a cached copy is reused only while
+# a projection-only read of that stamp still matches; any process's change shows up
+# on the next request.
+USER_FIELDS = {'username': 1, 'email': 1, 'role': 1, 'auth_version': 1}
+user_cache = MemoryBackend(app.config['USER_CACHE_SIZE'])
+
 @login_manager.user_loader
-def load_user(user_id):
-    user_data = db.users.find_one({'_id': ObjectId(user_id)})
-    if user_data:
-        return User(user_data)
-    return None
+def load_user(session_id):
+    # Session ids are "<user id>:<auth_version>"; older sessions carry just the id
+    user_id = session_id.partition(':')[0]
+    cached = user_cache.get(user_id)
+    if cached is not None:
+        stamp = db.users.find_one({'_id': ObjectId(user_id)}, {'_id': 0, 'auth_version': 1})
+        if stamp is not None and stamp.get('auth_version', 0) == cached.get('auth_version', 0):
+            return User(cached)
+    user_data = db.users.find_one({'_id': ObjectId(user_id)}, USER_FIELDS)
+    if not user_data:
+        user_cache.delete(user_id)
+        return None
+    user_cache.set(user_id, user_data, app.config['USER_CACHE_TTL'])
+    return User(user_data)
+
+def invalidate_user(user_id):
+    """Drop this process's cached copy of a user after changing the user document"""
+    user_cache.delete(str(user_id))
 
 class User:
     def __init__(self, user_data):
@@ -82,79 +282,348 @@ class User:
         self.username = user_data.get('username') or user_data.get('email') or 'user'
         self.email = user_data.get('email', '')
         self.role = user_data.get('role', 'user')
+        self.auth_version = user_data.get('auth_version', 0)
         self.is_authenticated = True
         self.is_active = True
         self.is_anonymous = False
     
     def get_id(self):
-        return self.id
+        return f"{self.id}:{self.auth_version}"
 
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
-def optimize_image(image_file, filename):
-    """Optimize and save image to local folder"""
+# Derivatives are rendered by a process pool after the admin request returns; see images.py
+image_pipeline = ImagePipeline(app.config['UPLOAD_FOLDER'], app.config['IMAGE_DERIVATIVES'],
+                               app.config['IMAGE_PUBLIC_PREFIX'], workers=app.config['IMAGE_WORKERS'])
+
+def store_product_image(image):
+    """Stream an upload into GridFS and a spool file for the derivative pipeline, returning (entry, spool_path)"""
+    filename = secure_filename(image.filename)
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    filename = f"{timestamp}_{filename}"
+    
+    gridfs_id, spool_path = ingest_upload(db, image.stream, filename, image.content_type,
+                                          spool_dir=app.config['IMAGE_SPOOL_DIR'],
+                                          chunk_size=app.config['GRIDFS_CHUNK_SIZE'])
+    
+    # Served from GridFS until the derivatives are ready
+    entry = {
+        'filename': filename,
+        'gridfs_id': gridfs_id,
+        'local_path': None,
+        'public_url': f'/image/{gridfs_id}',
+        'status': 'processing'
+    }
+    return entry, spool_path
+
+def record_image_derivatives(gridfs_id, result, error, invalidate=True):
+    """Store a rendered image's derivatives; invalidate=False leaves cache invalidation to the caller"""
+    metrics.inc('image_renders_total', outcome='failed' if error else 'ok')
+    if error:
+        print(f"Error processing image {gridfs_id}: {error}")
+        db.products.update_one({'images.gridfs_id': gridfs_id}, {'$set': {'images.$.status': 'failed'}})
+        return
+    metrics.observe('image_render_seconds', result['seconds'])
+    product_id = apply_derivatives(db, gridfs_id, result)
+    if product_id and invalidate:
+        invalidate_products(product_id)
+
+def process_product_images(pending):
+    """Queue spooled uploads for derivative rendering once their product is saved"""
+    for gridfs_id, spool_path in pending:
+        image_pipeline.submit(gridfs_id, spool_path, lambda result, error, gridfs_id=gridfs_id:
+                              record_image_derivatives(gridfs_id, result, error))
+
+def load_cart_products(cart_items):
+    """Fetch every product referenced by the cart in one query, memoized per request"""
+    loaded = carts.load_products(db, [item['product_id'] for item in cart_items],
+                                 carts.CART_PRODUCT_PROJECTION, g.setdefault('cart_products', {}))
+    return {item['product_id']: loaded[item['product_id']] for item in cart_items}
+
+def load_visitor_cart():
+    """The signed-in user's cart, else the one the session names"""
+    if current_user.is_authenticated:
+        # Looked up by user: a session cart id may be one checked out on another device
+        return carts.load_user_cart(db, ObjectId(current_user.id))
+    return carts.load_cart(db, carts.parse_cart_id(session.get('cart_id')))
+
+def current_cart_id():
+    cart = load_visitor_cart()
+    return cart['_id'] if cart else None
+
+def add_cart_lines(lines):
+    """Add lines to the visitor's cart, allocating a session cart for anonymous visitors"""
+    if current_user.is_authenticated:
+        carts.add_user_lines(db, ObjectId(current_user.id), lines)
+        return
+    cart_id = carts.parse_cart_id(session.get('cart_id'))
+    if not cart_id:
+        cart_id = ObjectId()
+        session['cart_id'] = str(cart_id)
+    carts.add_lines(db, cart_id, lines)
+
+def get_cart_items():
+    """Lines of the visitor's cart as [{'product_id', 'size', 'quantity'}]"""
+    legacy = session.pop('cart', None)
+    if legacy:
+        # Carts stored in the cookie before the server-side store move over on first visit
+        try:
+            add_cart_lines([(item['product_id'], item['size'], int(item['quantity'])) for item in legacy])
+        except (KeyError, TypeError, ValueError):
+            pass
+    return carts.cart_items(load_visitor_cart())
+
+def build_cart_lines(cart_items):
+    """Join cart items with their products, returning (lines, total)"""
+    products_by_id = load_cart_products(cart_items)
+    lines = []
+    total = 0
+    for item in cart_items:
+        product = products_by_id.get(item['product_id'])
+        if product:
+            # Copy so several lines of the same product keep their own size/quantity
+            line = dict(product)
+            line['quantity'] = item['quantity']
+            line['size'] = item['size']
+            line['subtotal'] = product['price'] * item['quantity']
+            lines.append(line)
+            total += line['subtotal']
+    return lines, total
+
+# Keyset pagination: a cursor is the sort key values of the last row on the page
+def encode_cursor(doc, sort):
+    values = [doc.get(field) for field, _ in sort]
+    return base64.urlsafe_b64encode(json_util.dumps(values).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor, sort):
+    """Return the sort key values stored in cursor, or None if it is missing or malformed"""
+    if not cursor:
+        return None
     try:
-        img = Image.open(image_file)
-        # Convert to RGB if necessary
-        if img.mode in ('RGBA', 'LA', 'P'):
-            img = img.convert('RGB')
-        
-        # Resize if too large (max 800x800)
-        if img.width > 800 or img.height > 800:
-            img.thumbnail((800, 800), Image.Resampling.LANCZOS)
-        
-        # Save optimized image
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        img.save(filepath, 'JPEG', quality=85, optimize=True)
-        return filepath
-    except Exception as e:
-        print(f"Error optimizing image: {e}")
+        values = json_util.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception:
+        return None
+    if not isinstance(values, list) or len(values) != len(sort):
+        return None
+    return values
+
+def keyset_filter(sort, values):
+    """Match rows strictly after values in the given [(field, direction), ...] order"""
+    clauses = []
+    for i, (field, direction) in enumerate(sort):
+        clause = {prev_field: values[j] for j, (prev_field, _) in enumerate(sort[:i])}
+        clause[field] = {'$gt' if direction == 1 else '$lt': values[i]}
+        clauses.append(clause)
+    return {'$or': clauses}
+
+# Fields the product listing renders; descriptions and extra images stay in Mongo
+PRODUCT_LISTING_FIELDS = ['name', 'price', 'category_id', 'colors', 'stock', 'featured', 'created_at']
+PRODUCT_LISTING_PROJECTION = dict({field: 1 for field in PRODUCT_LISTING_FIELDS}, images={'$slice': 1})
+
+# Listing sort orders, always ending on _id so the keyset is unique
+PRODUCT_SORTS = {
+    'newest': [('created_at', -1), ('_id', -1)],
+    'price_asc': [('price', 1), ('_id', 1)],
+    'price_desc': [('price', -1), ('_id', -1)],
+    'relevance': [('score', -1), ('_id', -1)],
+}
+
+def fetch_product_page(filter_query, sort, cursor, page_size):
+    """Fetch one keyset page of products, returning (products, next_cursor)"""
+    after = decode_cursor(cursor, sort)
+    if sort[0][0] == 'score':
+        # textScore can only be filtered on after it is materialized, so page through an aggregation
+        projection = {field: 1 for field in PRODUCT_LISTING_FIELDS}
+        projection.update(images={'$slice': ['$images', 1]}, score=1)
+        pipeline = [
+            {'$match': filter_query},
+            {'$addFields': {'score': {'$meta': 'textScore'}}},
+        ]
+        if after is not None:
+            pipeline.append({'$match': keyset_filter(sort, after)})
+        pipeline += [
+            {'$sort': dict(sort)},
+            {'$limit': page_size + 1},
+            {'$project': projection},
+        ]
+        rows = list(catalog_db.products.aggregate(pipeline))
+    else:
+        query = dict(filter_query)
+        if after is not None:
+            query.update(keyset_filter(sort, after))
+        rows = list(catalog_db.products.find(query, PRODUCT_LISTING_PROJECTION).sort(sort).limit(page_size + 1))
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(rows[-1], sort)
+    return rows, next_cursor
+
+# In-process faceted index for filtered listings; see catalog_index.py
+catalog_index = CatalogIndex()
+_catalog_index_build_lock = threading.Lock()
+
+def products_cache_version():
+    return query_cache.backend.tag_versions(('products',))[0]
+
+def build_catalog_index():
+    """Rebuild the catalog index from Mongo in a background thread"""
+    if not _catalog_index_build_lock.acquire(blocking=False):
+        return
+    def run():
+        try:
+            version = products_cache_version()
+            catalog_index.build(db.products.find({}, INDEX_PROJECTION).batch_size(5000), version)
+        except Exception as e:
+            print(f"Catalog index build failed: {e}")
+        finally:
+            _catalog_index_build_lock.release()
+    threading.Thread(target=run, daemon=True).start()
+
+def get_catalog_index():
+    """The catalog index if it reflects the current catalog, otherwise None while it rebuilds"""
+    if not app.config['CATALOG_INDEX_ENABLED']:
+        return None
+    if not catalog_index.ready or catalog_index.version != products_cache_version():
+        build_catalog_index()
+        return None
+    # Stock sold by other workers only reaches this process through periodic rebuilds
+    if (datetime.utcnow() - catalog_index.built_at).total_seconds() > app.config['CATALOG_INDEX_MAX_AGE']:
+        build_catalog_index()
+    return catalog_index
+
+def sync_catalog_index(product_ids):
+    """Re-read the given products into the catalog index"""
+    if not catalog_index.ready:
+        return
+    product_ids = list(product_ids)
+    found = set()
+    for product in db.products.find({'_id': {'$in': product_ids}}, INDEX_PROJECTION):
+        catalog_index.upsert(product)
+        found.add(product['_id'])
+    for product_id in product_ids:
+        if product_id not in found:
+            catalog_index.remove(product_id)
+
+def invalidate_products(*product_ids):
+    """Expire cached product queries and apply the write to this process's catalog and typeahead indexes"""
+    expected = catalog_index.version
+    before = catalog_versions()
+    query_cache.invalidate('products')
+    if catalog_index.ready and expected == products_cache_version() - 1:
+        sync_catalog_index(product_ids)
+        catalog_index.version = products_cache_version()
+    sync_typeahead(before, product_ids=product_ids)
+
+def invalidate_categories(*category_ids):
+    """Expire cached category queries and apply the write to this process's typeahead index"""
+    before = catalog_versions()
+    query_cache.invalidate('categories')
+    sync_typeahead(before, category_ids=category_ids)
+
+# In-process prefix index for search suggestions; see typeahead.py
+typeahead_index = typeahead.TypeaheadIndex()
+_typeahead_build_lock = threading.Lock()
+
+def catalog_versions():
+    return query_cache.backend.tag_versions(('products', 'categories'))
+
+def build_typeahead_index():
+    """Rebuild the typeahead index from Mongo in a background thread"""
+    if not _typeahead_build_lock.acquire(blocking=False):
+        return
+    def run():
+        try:
+            version = catalog_versions()
+            typeahead_index.build(db.products.find({}, typeahead.PRODUCT_FIELDS).batch_size(5000),
+                                  db.categories.find({}, {'name': 1}),
+                                  typeahead.load_popularity(db, app.config['TYPEAHEAD_POPULARITY_DAYS']),
+                                  version)
+        except Exception as e:
+            print(f"Typeahead index build failed: {e}")
+        finally:
+            _typeahead_build_lock.release()
+    threading.Thread(target=run, daemon=True).start()
+
+def get_typeahead_index():
+    """The typeahead index, or None until its first build; a stale index answers while it rebuilds"""
+    if not app.config['TYPEAHEAD_ENABLED']:
         return None
+    if not typeahead_index.ready:
+        build_typeahead_index()
+        return None
+    # Other workers' writes and new sales figures arrive through rebuilds
+    if (typeahead_index.version != catalog_versions()
+            or (datetime.utcnow() - typeahead_index.built_at).total_seconds() > app.config['TYPEAHEAD_MAX_AGE']):
+        build_typeahead_index()
+    return typeahead_index
+
+def sync_typeahead(before, product_ids=(), category_ids=()):
+    """Re-read written products and categories into the typeahead index if it was current before the write"""
+    after = catalog_versions()
+    # Any bump besides this process's own write is left to a rebuild
+    if not typeahead_index.ready or typeahead_index.version != before or sum(after) != sum(before) + 1:
+        return
+    product_ids, category_ids = list(product_ids), list(category_ids)
+    found = set()
+    for product in db.products.find({'_id': {'$in': product_ids}}, typeahead.PRODUCT_FIELDS):
+        typeahead_index.upsert_product(product)
+        found.add(product['_id'])
+    for category in db.categories.find({'_id': {'$in': category_ids}}, {'name': 1}):
+        typeahead_index.upsert_category(category)
+        found.add(category['_id'])
+    for product_id in product_ids:
+        if product_id not in found:
+            typeahead_index.remove_product(product_id)
+    for category_id in category_ids:
+        if category_id not in found:
+            typeahead_index.remove_category(category_id)
+    typeahead_index.version = after
+
+# Email templates compile once per process and recompile when their file's mtime changes
+email_bytecode_cache = None
+if app.config['EMAIL_TEMPLATE_BYTECODE_CACHE_DIR']:
+    os.makedirs(app.config['EMAIL_TEMPLATE_BYTECODE_CACHE_DIR'], exist_ok=True)
+    email_bytecode_cache = FileSystemBytecodeCache(app.config['EMAIL_TEMPLATE_BYTECODE_CACHE_DIR'])
+
+email_jinja_env = app.jinja_env.overlay(
+    loader=FileSystemLoader(os.path.join(app.root_path, 'templates', 'emails')),
+    auto_reload=True,
+    cache_size=app.config['EMAIL_TEMPLATE_CACHE_SIZE'],
+    bytecode_cache=email_bytecode_cache,
+)
 
 def render_email_template(template_name, **kwargs):
     """Render email template with given context"""
     try:
-        with open(f'templates/emails/{template_name}.html', 'r', encoding='utf-8') as f:
-            template_content = f.read()
-        return render_template_string(template_content, **kwargs)
-    except FileNotFoundError:
+        template = email_jinja_env.get_template(f'{template_name}.html')
+    except TemplateNotFound:
         # Fallback to simple text if template not found
         return f"Email content for {template_name} with context: {kwargs}"
+    context = dict(kwargs)
+    if has_request_context():
+        app.update_template_context(context)
+    return template.render(context)
 
 def send_email(subject: str, to_email: str, html_body: str, text_body: str | None = None) -> bool:
-    if not app.config.get('SMTP_HOST') or not app.config.get('SMTP_USER'):
+    """Queue an email in the outbox; delivery happens in the mailer.py workers"""
+    if not email_enabled(app.config):
         return False
-    msg = EmailMessage()
-    msg['Subject'] = subject
-    msg['From'] = app.config.get('SMTP_FROM') or app.config.get('SMTP_USER')
-    msg['To'] = to_email
-    if text_body:
-        msg.set_content(text_body)
-        msg.add_alternative(html_body, subtype='html')
-    else:
-        msg.set_content(html_body, subtype='html')
     try:
-        if app.config.get('SMTP_USE_TLS', True):
-            with smtplib.SMTP(app.config['SMTP_HOST'], app.config['SMTP_PORT']) as server:
-                server.starttls()
-                server.login(app.config['SMTP_USER'], app.config['SMTP_PASSWORD'])
-                server.send_message(msg)
-        else:
-            with smtplib.SMTP_SSL(app.config['SMTP_HOST'], app.config['SMTP_PORT']) as server:
-                server.login(app.config['SMTP_USER'], app.config['SMTP_PASSWORD'])
-                server.send_message(msg)
+        enqueue_email(db, subject, to_email, html_body, text_body)
         return True
     except Exception as e:
-        print(f"Email send failed: {e}")
+        print(f"Email enqueue failed: {e}")
         return False
 
 # Routes
 @app.route('/')
+@cached_page('products', 'categories')
 def home():
-    categories = list(db.categories.find())
-    featured_products = list(db.products.find({'featured': True}).limit(8))
+    categories = get_categories()
+    featured_products = get_featured_products()
     return render_template('home.html', categories=categories, featured_products=featured_products)
 
 @app.route('/products')
@@ -184,25 +653,84 @@ def products():
     if color:
         filter_query['colors'] = color
     
-    products = list(db.products.find(filter_query))
-    categories = list(db.categories.find())
+    # Relevance only exists for text searches; fall back to newest first
+    sort_key = request.args.get('sort') or ('relevance' if search else 'newest')
+    if sort_key not in PRODUCT_SORTS or (sort_key == 'relevance' and not search):
+        sort_key = 'newest'
+    sort = PRODUCT_SORTS[sort_key]
+    page_size = app.config['PRODUCTS_PER_PAGE']
+    
+    # Filters without a text search are answered by the in-process index
+    index = None if search else get_catalog_index()
+    facets = None
+    if index is not None:
+        ids, facets = index.search(sort_key, decode_cursor(request.args.get('cursor'), sort), page_size + 1,
+                                   category=category, color=color, size=size,
+                                   min_price=min_price, max_price=max_price)
+        by_id = {p['_id']: p for p in catalog_db.products.find({'_id': {'$in': ids}}, PRODUCT_LISTING_PROJECTION)}
+        products = [by_id[product_id] for product_id in ids if product_id in by_id]
+        next_cursor = None
+        if len(products) > page_size:
+            products = products[:page_size]
+            next_cursor = encode_cursor(products[-1], sort)
+    else:
+        products, next_cursor = fetch_product_page(filter_query, sort, request.args.get('cursor'), page_size)
+    categories = get_categories()
     
-    return render_template('products.html', products=products, categories=categories)
+    return render_template('products.html', products=products, categories=categories,
+                           sort=sort_key, next_cursor=next_cursor, facets=facets)
+
+@app.route('/api/suggest')
+def suggest():
+    """Search-box suggestions for a typed prefix"""
+    query = request.args.get('q', '')[:100]
+    limit = request.args.get('limit', 8, type=int)
+    index = get_typeahead_index()
+    suggestions = index.suggest(query, limit) if index is not None else []
+    for suggestion in suggestions:
+        if suggestion['type'] == 'product':
+            suggestion['url'] = url_for('product_detail', product_id=suggestion['id'])
+        else:
+            suggestion['url'] = url_for('products', category=suggestion['id'])
+    response = jsonify({'query': query, 'suggestions': suggestions})
+    response.headers['Cache-Control'] = 'public, max-age=60'
+    return response
 
 @app.route('/product/<product_id>')
+@cached_page('products')
 def product_detail(product_id):
-    product = db.products.find_one({'_id': ObjectId(product_id)})
+    # A render headed for the page cache reads the primary: a lagging secondary's copy
+    # would be stored under the current tag version and outlive the write it missed
+    source = db if page_cacheable() else catalog_db
+    product = source.products.find_one({'_id': ObjectId(product_id)})
+    if not product and source is not db:
+        # Products created moments ago may not have reached the secondary yet
+        product = db.products.find_one({'_id': ObjectId(product_id)})
     if not product:
         flash('Product not found', 'error')
         return redirect(url_for('products'))
     
-    related_products = list(db.products.find({
-        'category_id': product['category_id'],
-        '_id': {'$ne': ObjectId(product_id)}
-    }).limit(4))
+    related_products = load_related_products(source, product)
     
     return render_template('product_detail.html', product=product, related_products=related_products)
 
+def load_related_products(source, product, limit=4):
+    """Frequently bought together picks (see recommendations.py), topped up from the product's category"""
+    related = []
+    for recommendation in source.recommendations.aggregate([
+        {'$match': {'_id': product['_id']}},
+        {'$lookup': {'from': 'products', 'localField': 'products', 'foreignField': '_id', 'as': 'found'}},
+    ]):
+        # $lookup returns matches in no particular order; keep the ranking, skip deleted products
+        by_id = {p['_id']: p for p in recommendation['found']}
+        related = [by_id[product_id] for product_id in recommendation['products'] if product_id in by_id][:limit]
+    if len(related) < limit:
+        related += list(source.products.find({
+            'category_id': product.get('category_id'),
+            '_id': {'$nin': [product['_id']] + [p['_id'] for p in related]}
+        }).limit(limit - len(related)))
+    return related
+
 @app.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
@@ -218,14 +746,19 @@ def register():
         # Hash password
         hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
         
-        # Create user
-        user_id = db.users.insert_one({
-            'username': username,
-            'email': email,
-            'password_hash': hashed_password,
-            'role': 'user',
-            'created_at': datetime.utcnow()
-        }).inserted_id
+        # Create user; the unique indexes catch a concurrent registration of the same name
+        try:
+            user_id = db.users.insert_one({
+                'username': username,
+                'email': email,
+                'password_hash': hashed_password,
+                'role': 'user',
+                'created_at': datetime.utcnow()
+            }).inserted_id
+        except DuplicateKeyError:
+            flash('Username or email already exists', 'error')
+            return render_template('register.html')
+        bump_stats(db, users=1)
         
         flash('Registration successful! Please login.', 'success')
         return redirect(url_for('login'))
@@ -268,6 +801,7 @@ def login():
         if user_data and password_ok:
             user = User(user_data)
             login_user(user)
+            carts.merge_on_login(db, carts.parse_cart_id(session.pop('cart_id', None)), user_data['_id'])
             flash('Login successful!', 'success')
             return redirect(url_for('home'))
         else:
@@ -279,23 +813,15 @@ def login():
 @login_required
 def logout():
     logout_user()
+    # The cart stays with the account; the next visitor on this browser starts empty
+    session.pop('cart_id', None)
     flash('You have been logged out', 'info')
     return redirect(url_for('home'))
 
 @app.route('/cart')
 def cart():
-    cart_items = session.get('cart', [])
-    products = []
-    total = 0
-    
-    for item in cart_items:
-        product = db.products.find_one({'_id': ObjectId(item['product_id'])})
-        if product:
-            product['quantity'] = item['quantity']
-            product['size'] = item['size']
-            product['subtotal'] = product['price'] * item['quantity']
-            products.append(product)
-            total += product['subtotal']
+    cart_items = get_cart_items()
+    products, total = build_cart_lines(cart_items)
     
     return render_template('cart.html', cart_items=products, total=total)
 
@@ -305,30 +831,21 @@ def add_to_cart():
     size = request.form['size']
     quantity = int(request.form['quantity'])
     
-    if 'cart' not in session:
-        session['cart'] = []
-    
-    # Check if item already in cart
-    for item in session['cart']:
-        if item['product_id'] == product_id and item['size'] == size:
-            item['quantity'] += quantity
-            break
-    else:
-        session['cart'].append({
-            'product_id': product_id,
-            'size': size,
-            'quantity': quantity
-        })
+    # Same product and size adds up on one line
+    try:
+        add_cart_lines([(product_id, size, quantity)])
+    except ValueError:
+        flash('Please choose a valid size and quantity', 'error')
+        return redirect(request.referrer or url_for('products'))
     
-    session.modified = True
     flash('Product added to cart!', 'success')
     return redirect(url_for('cart'))
 
 @app.route('/remove_from_cart/<int:index>')
 def remove_from_cart(index):
-    if 'cart' in session and 0 <= index < len(session['cart']):
-        session['cart'].pop(index)
-        session.modified = True
+    cart_items = get_cart_items()
+    if 0 <= index < len(cart_items):
+        carts.remove_line(db, current_cart_id(), cart_items[index]['product_id'], cart_items[index]['size'])
         flash('Item removed from cart', 'info')
     return redirect(url_for('cart'))
 
@@ -336,12 +853,12 @@ def remove_from_cart(index):
 @login_required
 def checkout():
     if request.method == 'POST':
-        cart_items = session.get('cart', [])
+        cart_items = get_cart_items()
         if not cart_items:
             flash('Your cart is empty', 'error')
             return redirect(url_for('cart'))
         
-        # Create order
+        # Build order
         order_data = {
             'user_id': ObjectId(current_user.id),
             'items': cart_items,
@@ -358,19 +875,42 @@ def checkout():
             'created_at': datetime.utcnow()
         }
         
-        order_id = db.orders.insert_one(order_data).inserted_id
+        # Reserve stock for every line before the order exists
+        products_by_id = load_cart_products(cart_items)
+        # Snapshot what was sold so reports don't depend on later catalog edits
+        order_data['items'] = [
+            dict(item,
+                 name=products_by_id[item['product_id']].get('name'),
+                 price=products_by_id[item['product_id']].get('price'),
+                 category_id=products_by_id[item['product_id']].get('category_id'))
+            if products_by_id.get(item['product_id']) else item
+            for item in cart_items
+        ]
+        stock_lines = [
+            (ObjectId(item['product_id']), item['size'], int(item['quantity']))
+            for item in cart_items if products_by_id.get(item['product_id'])
+        ]
+        try:
+            stock_lines = reserve_stock(db, stock_lines)
+        except StockReservationError as e:
+            product = products_by_id.get(str(e.product_id)) or {}
+            flash(f"Sorry, {product.get('name', 'an item')} (size {e.size}) doesn't have enough stock left", 'error')
+            return redirect(url_for('cart'))
         
-        # Update stock
-        for item in cart_items:
-            product = db.products.find_one({'_id': ObjectId(item['product_id'])})
-            if product and f'stock.{item["size"]}' in product:
-                db.products.update_one(
-                    {'_id': ObjectId(item['product_id'])},
-                    {'$inc': {f'stock.{item["size"]}': -item['quantity']}}
-                )
+        # Create order
+        try:
+            order_id = db.orders.insert_one(order_data).inserted_id
+        except Exception:
+            release_stock(db, stock_lines)
+            raise
+        record_order_placed(db, order_data)
+        analytics.record_order(db, order_data, ANALYTICS_TZ)
+        # Sold-out sizes must leave cached product pages, not just the catalog index
+        invalidate_products(*{product_id for product_id, _, _ in stock_lines})
         
         # Clear cart
-        session.pop('cart', None)
+        carts.delete_cart(db, current_cart_id())
+        session.pop('cart_id', None)
         
         # Send order confirmation email if configured
         user_doc = db.users.find_one({'_id': ObjectId(current_user.id)})
@@ -395,22 +935,12 @@ def checkout():
         flash('Order placed successfully!', 'success')
         return redirect(url_for('order_confirmation', order_id=str(order_id)))
     
-    cart_items = session.get('cart', [])
+    cart_items = get_cart_items()
     if not cart_items:
         flash('Your cart is empty', 'error')
         return redirect(url_for('cart'))
     
-    products = []
-    total = 0
-    
-    for item in cart_items:
-        product = db.products.find_one({'_id': ObjectId(item['product_id'])})
-        if product:
-            product['quantity'] = item['quantity']
-            product['size'] = item['size']
-            product['subtotal'] = product['price'] * item['quantity']
-            products.append(product)
-            total += product['subtotal']
+    products, total = build_cart_lines(cart_items)
     
     return render_template('checkout.html', cart_items=products, total=total)
 
@@ -438,15 +968,15 @@ def admin_dashboard():
         flash('Access denied', 'error')
         return redirect(url_for('home'))
     
-    total_products = db.products.count_documents({})
-    total_orders = db.orders.count_documents({})
-    total_users = db.users.count_documents({'role': 'user'})
+    stats = get_dashboard_stats(db)
     recent_orders = list(db.orders.find().sort('created_at', -1).limit(5))
     
     return render_template('admin/dashboard.html', 
-                         total_products=total_products,
-                         total_orders=total_orders,
-                         total_users=total_users,
+                         total_products=stats.get('products', 0),
+                         total_orders=stats.get('orders', 0),
+                         total_users=stats.get('users', 0),
+                         total_revenue=stats.get('revenue', 0),
+                         orders_by_status=stats.get('orders_by_status', {}),
                          recent_orders=recent_orders)
 
 @app.route('/admin/profile', methods=['GET', 'POST'], endpoint='admin_profile')
@@ -513,10 +1043,19 @@ def admin_profile():
 
             update_fields['password_hash'] = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt())
 
-        db.users.update_one({'_id': user_doc['_id']}, {'$set': update_fields})
+        # The version bump tells every worker's user cache to reload this user
+        try:
+            refreshed = db.users.find_one_and_update(
+                {'_id': user_doc['_id']},
+                {'$set': update_fields, '$inc': {'auth_version': 1}},
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            flash('Username or email already in use', 'error')
+            return render_template('admin/profile.html', user=user_doc)
+        invalidate_user(user_doc['_id'])
 
         # Refresh session user
-        refreshed = db.users.find_one({'_id': user_doc['_id']})
         login_user(User(refreshed))
         flash('Profile updated successfully', 'success')
         return redirect(url_for('admin_profile'))
@@ -531,7 +1070,7 @@ def admin_products():
         return redirect(url_for('home'))
     
     products = list(db.products.find())
-    categories = list(db.categories.find())
+    categories = get_categories()
     return render_template('admin/products.html', products=products, categories=categories)
 
 @app.route('/admin/product/new', methods=['GET', 'POST'])
@@ -557,37 +1096,13 @@ def admin_new_product():
         # Handle image uploads
         images = request.files.getlist('images')
         image_data = []
+        pending_images = []
         
         for image in images:
             if image and allowed_file(image.filename):
-                filename = secure_filename(image.filename)
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                filename = f"{timestamp}_{filename}"
-                
-                # Save to GridFS
-                gridfs_id = db.fs.files.insert_one({
-                    'filename': filename,
-                    'content_type': image.content_type,
-                    'upload_date': datetime.utcnow()
-                }).inserted_id
-                
-                # Save file content to GridFS
-                db.fs.chunks.insert_one({
-                    'files_id': gridfs_id,
-                    'n': 0,
-                    'data': image.read()
-                })
-                
-                # Optimize and save to local folder
-                image.seek(0)  # Reset file pointer
-                local_path = optimize_image(image, filename)
-                
-                image_data.append({
-                    'filename': filename,
-                    'gridfs_id': gridfs_id,
-                    'local_path': local_path,
-                    'public_url': f'/static/images/products/{filename}'
-                })
+                entry, spool_path = store_product_image(image)
+                image_data.append(entry)
+                pending_images.append((entry['gridfs_id'], spool_path))
         
         # Create product
         product_id = db.products.insert_one({
@@ -601,13 +1116,63 @@ def admin_new_product():
             'featured': request.form.get('featured') == 'on',
             'created_at': datetime.utcnow()
         }).inserted_id
+        bump_stats(db, products=1)
+        invalidate_products(product_id)
+        process_product_images(pending_images)
         
         flash('Product created successfully!', 'success')
         return redirect(url_for('admin_products'))
     
-    categories = list(db.categories.find())
+    categories = get_categories()
     return render_template('admin/product_form.html', categories=categories)
 
+@app.route('/admin/products/import', methods=['POST'])
+@login_required
+def admin_import_products():
+    if current_user.role != 'admin':
+        flash('Access denied', 'error')
+        return redirect(url_for('home'))
+    
+    catalog = request.files.get('catalog')
+    if not catalog or not catalog.filename:
+        return jsonify({'error': 'Upload a CSV or JSON catalog as "catalog"'}), 400
+    
+    # The image archive is spooled to disk so it can be read member by member
+    archive_path = None
+    archive = request.files.get('images')
+    if archive and archive.filename:
+        fd, archive_path = tempfile.mkstemp(dir=app.config['IMAGE_SPOOL_DIR'], suffix='.zip')
+        with os.fdopen(fd, 'wb') as f:
+            archive.save(f)
+    try:
+        image_source = ImageSource(archive_path)
+    except ValueError:
+        os.remove(archive_path)
+        return jsonify({'error': 'images must be a zip archive'}), 400
+    
+    importer = CatalogImporter(db, image_pipeline, batch_size=app.config['IMPORT_BATCH_SIZE'],
+                               spool_dir=app.config['IMAGE_SPOOL_DIR'],
+                               chunk_size=app.config['GRIDFS_CHUNK_SIZE'],
+                               on_image_done=lambda gridfs_id, result, error:
+                                   record_image_derivatives(gridfs_id, result, error, invalidate=False),
+                               # One bump per write batch: every bump also rebuilds each worker's catalog indexes
+                               on_batch_rendered=lambda: query_cache.invalidate('products'))
+    try:
+        report = importer.run(read_rows(catalog.stream, detect_format(catalog.filename)), image_source,
+                              create_categories=request.form.get('create_categories') == 'on')
+    except (ValueError, UnicodeDecodeError) as e:
+        return jsonify({'error': f'Could not read the catalog: {e}'}), 400
+    finally:
+        image_source.close()
+        if archive_path:
+            os.remove(archive_path)
+    
+    bump_stats(db, products=report['inserted'])
+    # Too many products to sync one by one; the in-process indexes see the new versions and rebuild
+    query_cache.invalidate('products', 'categories')
+    # Derivatives keep rendering in the pool after the response
+    return jsonify(report)
+
 @app.route('/admin/product/edit/<product_id>', methods=['GET', 'POST'])
 @login_required
 def admin_edit_product(product_id):
@@ -640,48 +1205,27 @@ def admin_edit_product(product_id):
         
         # Handle new image uploads
         new_images = request.files.getlist('images')
+        new_image_data = []
+        pending_images = []
         if new_images and new_images[0].filename:
             for image in new_images:
                 if image and allowed_file(image.filename):
-                    filename = secure_filename(image.filename)
-                    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                    filename = f"{timestamp}_{filename}"
-                    
-                    # Save to GridFS
-                    gridfs_id = db.fs.files.insert_one({
-                        'filename': filename,
-                        'content_type': image.content_type,
-                        'upload_date': datetime.utcnow()
-                    }).inserted_id
-                    
-                    # Save file content to GridFS
-                    db.fs.chunks.insert_one({
-                        'files_id': gridfs_id,
-                        'n': 0,
-                        'data': image.read()
-                    })
-                    
-                    # Optimize and save to local folder
-                    image.seek(0)
-                    local_path = optimize_image(image, filename)
-                    
-                    product['images'].append({
-                        'filename': filename,
-                        'gridfs_id': gridfs_id,
-                        'local_path': local_path,
-                        'public_url': f'/static/images/products/{filename}'
-                    })
+                    entry, spool_path = store_product_image(image)
+                    new_image_data.append(entry)
+                    pending_images.append((entry['gridfs_id'], spool_path))
         
         # Update product
         db.products.update_one(
             {'_id': ObjectId(product_id)},
-            {'$set': update_data}
+            {'$set': update_data, '$push': {'images': {'$each': new_image_data}}}
         )
+        invalidate_products(ObjectId(product_id))
+        process_product_images(pending_images)
         
         flash('Product updated successfully!', 'success')
         return redirect(url_for('admin_products'))
     
-    categories = list(db.categories.find())
+    categories = get_categories()
     return render_template('admin/product_form.html', product=product, categories=categories)
 
 @app.route('/admin/product/delete/<product_id>')
@@ -695,14 +1239,40 @@ def admin_delete_product(product_id):
     product = db.products.find_one({'_id': ObjectId(product_id)})
     if product and 'images' in product:
         for image in product['images']:
-            if 'local_path' in image and os.path.exists(image['local_path']):
-                os.remove(image['local_path'])
+            for path in derivative_paths(image):
+                if os.path.exists(path):
+                    os.remove(path)
     
     # Delete from database
-    db.products.delete_one({'_id': ObjectId(product_id)})
+    if db.products.delete_one({'_id': ObjectId(product_id)}).deleted_count:
+        bump_stats(db, products=-1)
+    invalidate_products(ObjectId(product_id))
     flash('Product deleted successfully!', 'success')
     return redirect(url_for('admin_products'))
 
+ORDER_STATUSES = ('pending', 'processing', 'shipped', 'delivered', 'cancelled')
+ORDER_SORT = [('created_at', -1), ('_id', -1)]
+# Columns of the admin order list; items and the full address stay on the detail page
+ORDER_LIST_PROJECTION = {'user_id': 1, 'shipping_address.name': 1, 'payment_method': 1,
+                         'total_amount': 1, 'status': 1, 'created_at': 1}
+
+def store_day_start(day):
+    """Naive UTC datetime at which a YYYY-MM-DD day starts in the store's timezone"""
+    local = datetime.strptime(day, '%Y-%m-%d').replace(tzinfo=ANALYTICS_TZ)
+    return local.astimezone(timezone.utc).replace(tzinfo=None)
+
+def fetch_order_page(query, cursor, page_size):
+    """One newest-first keyset page of orders, returning (orders, next_cursor)"""
+    after = decode_cursor(cursor, ORDER_SORT)
+    if after is not None:
+        query = {'$and': [query, keyset_filter(ORDER_SORT, after)]}
+    rows = list(reports_db.orders.find(query, ORDER_LIST_PROJECTION).sort(ORDER_SORT).limit(page_size + 1))
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(rows[-1], ORDER_SORT)
+    return rows, next_cursor
+
 @app.route('/admin/orders')
 @login_required
 def admin_orders():
@@ -710,8 +1280,67 @@ def admin_orders():
         flash('Access denied', 'error')
         return redirect(url_for('home'))
     
-    orders = list(db.orders.find().sort('created_at', -1))
-    return render_template('admin/orders.html', orders=orders)
+    filters = {
+        'status': request.args.get('status', '').strip(),
+        'customer': request.args.get('customer', '').strip(),
+        'start': request.args.get('start', '').strip(),
+        'end': request.args.get('end', '').strip(),
+    }
+    query = {}
+    if filters['status'] in ORDER_STATUSES:
+        query['status'] = filters['status']
+    if filters['customer']:
+        # Exact user id, username or email; each resolves through a unique index
+        if ObjectId.is_valid(filters['customer']):
+            user_ids = [ObjectId(filters['customer'])]
+        else:
+            user_ids = [u['_id'] for u in db.users.find(
+                {'$or': [{'username': filters['customer']}, {'email': filters['customer']}]}, {'_id': 1})]
+        query['user_id'] = {'$in': user_ids}
+    created = {}
+    try:
+        # Dates are picked in the store's timezone, created_at is stored in UTC
+        if filters['start']:
+            created['$gte'] = store_day_start(filters['start'])
+        if filters['end']:
+            created['$lt'] = store_day_start(filters['end']) + timedelta(days=1)
+    except ValueError:
+        flash('Dates must be in YYYY-MM-DD format', 'error')
+        created = {}
+    if created:
+        query['created_at'] = created
+    
+    orders, next_cursor = fetch_order_page(query, request.args.get('cursor'), app.config['ADMIN_ORDERS_PER_PAGE'])
+    return render_template('admin/orders.html', orders=orders, next_cursor=next_cursor,
+                           filters=filters, statuses=ORDER_STATUSES)
+
+@app.route('/admin/export/<collection>')
+@login_required
+def admin_export(collection):
+    if current_user.role != 'admin':
+        flash('Access denied', 'error')
+        return redirect(url_for('home'))
+    
+    fmt = request.args.get('format', 'csv')
+    if collection not in EXPORTS or fmt not in FORMATS:
+        flash('Unknown export', 'error')
+        return redirect(url_for('admin_dashboard'))
+    try:
+        since = parse_timestamp(request.args.get('since'))
+        until = parse_timestamp(request.args.get('until'))
+    except ValueError:
+        flash('Dates must be YYYY-MM-DD or ISO 8601', 'error')
+        return redirect(url_for('admin_dashboard'))
+    gzip = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+    
+    # Rows are generated while the response streams; nothing is collected in memory
+    body = stream_export(reports_db, collection, fmt, since, until, gzip=gzip,
+                         batch_size=app.config['EXPORT_BATCH_SIZE'])
+    mimetype = 'application/gzip' if gzip else ('text/csv' if fmt == 'csv' else 'application/x-ndjson')
+    response = Response(body, mimetype=mimetype, direct_passthrough=True)
+    response.headers['Content-Disposition'] = f'attachment; filename="{export_filename(collection, fmt, gzip)}"'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
 
 @app.route('/admin/order/<order_id>')
 @login_required
@@ -735,13 +1364,17 @@ def admin_update_order_status(order_id):
         return redirect(url_for('home'))
     
     new_status = request.form['status']
-    db.orders.update_one(
+    # The previous status is needed to move the order between the status counters
+    order = db.orders.find_one_and_update(
         {'_id': ObjectId(order_id)},
-        {'$set': {'status': new_status}}
+        {'$set': {'status': new_status}},
+        return_document=ReturnDocument.BEFORE
     )
+    if order:
+        record_order_status_change(db, order, new_status)
+        analytics.record_status_change(db, order, new_status, ANALYTICS_TZ)
 
     # Notify user via email, if possible
-    order = db.orders.find_one({'_id': ObjectId(order_id)})
     if order and order.get('user_id'):
         user_doc = db.users.find_one({'_id': order['user_id']})
         if user_doc and user_doc.get('email'):
@@ -771,7 +1404,7 @@ def admin_categories():
         flash('Access denied', 'error')
         return redirect(url_for('home'))
     
-    categories = list(db.categories.find())
+    categories = get_categories()
     return render_template('admin/categories.html', categories=categories)
 
 @app.route('/admin/category/new', methods=['POST'])
@@ -784,11 +1417,12 @@ def admin_new_category():
     name = request.form['name']
     description = request.form['description']
     
-    db.categories.insert_one({
+    category_id = db.categories.insert_one({
         'name': name,
         'description': description,
         'created_at': datetime.utcnow()
-    })
+    }).inserted_id
+    invalidate_categories(category_id)
     
     flash('Category created successfully!', 'success')
     return redirect(url_for('admin_categories'))
@@ -806,6 +1440,7 @@ def admin_delete_category(category_id):
         return redirect(url_for('admin_categories'))
     
     db.categories.delete_one({'_id': ObjectId(category_id)})
+    invalidate_categories(ObjectId(category_id))
     flash('Category deleted successfully!', 'success')
     return redirect(url_for('admin_categories'))
 
@@ -816,78 +1451,229 @@ def admin_users():
         flash('Access denied', 'error')
         return redirect(url_for('home'))
     
-    users = list(db.users.find({'role': 'user'}))
+    users = list(reports_db.users.find({'role': 'user'}))
     return render_template('admin/users.html', users=users)
 
-# QUICK STOCK UPDATE ENDPOINT
-@app.route('/admin/product/update_stock/<product_id>', methods=['POST'])
+@app.route('/admin/cache')
 @login_required
-def admin_update_stock(product_id):
+def admin_cache_stats():
     if current_user.role != 'admin':
         flash('Access denied', 'error')
         return redirect(url_for('home'))
     
-    size = request.form.get('size')
-    action = request.form.get('action', 'set')  # set | inc | dec
-    value_raw = request.form.get('value', '0')
+    return jsonify(dict(query_cache.stats(), pages=page_cache.stats()))
+
+@app.route('/metrics')
+def metrics_endpoint():
+    # Scrapers authenticate with a bearer token; admins can also look from the browser
+    token = app.config['METRICS_TOKEN']
+    authorized = bool(token) and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+    if not authorized and not (current_user.is_authenticated and current_user.role == 'admin'):
+        return Response('Forbidden\n', status=403, mimetype='text/plain')
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/admin/mongo')
+@login_required
+def admin_mongo_report():
+    if current_user.role != 'admin':
+        flash('Access denied', 'error')
+        return redirect(url_for('home'))
+    
+    report = mongo_report.snapshot()
+    if request.args.get('reset'):
+        mongo_report.reset()
+    return jsonify({'n_plus_one_threshold': mongo_report.n_plus_one_threshold, 'routes': report})
 
-    if size not in ['S', 'M', 'L', 'XL']:
-        flash('Invalid size', 'error')
-        return redirect(url_for('admin_products'))
+@app.route('/admin/indexes')
+@login_required
+def admin_index_report():
+    if current_user.role != 'admin':
+        flash('Access denied', 'error')
+        return redirect(url_for('home'))
+    
+    return jsonify(explain_report(db))
 
+def analytics_range():
+    """(start, end) day strings from the request, defaulting to the last 30 days"""
+    today = datetime.now(timezone.utc).astimezone(ANALYTICS_TZ).date()
     try:
-        value = int(value_raw)
+        end = datetime.strptime(request.args['end'], '%Y-%m-%d').date() if request.args.get('end') else today
+        start = (datetime.strptime(request.args['start'], '%Y-%m-%d').date() if request.args.get('start')
+                 else end - timedelta(days=29))
     except ValueError:
-        flash('Invalid value', 'error')
-        return redirect(url_for('admin_products'))
+        end, start = today, today - timedelta(days=29)
+    # Keep a single request to a few years of day buckets
+    start = max(start, end - timedelta(days=3 * 366))
+    if start > end:
+        start = end
+    return start.isoformat(), end.isoformat()
+
+@app.route('/admin/analytics')
+@login_required
+def admin_analytics():
+    if current_user.role != 'admin':
+        flash('Access denied', 'error')
+        return redirect(url_for('home'))
 
-    product = db.products.find_one({'_id': ObjectId(product_id)})
-    if not product:
-        flash('Product not found', 'error')
-        return redirect(url_for('admin_products'))
+    start, end = analytics_range()
+    return render_template('admin/analytics.html', start=start, end=end,
+                           dimensions=analytics.DIMENSIONS)
 
-    field = f'stock.{size}'
-    if action == 'set':
-        if value < 0:
-            flash('Stock cannot be negative', 'error')
-            return redirect(url_for('admin_products'))
-        db.products.update_one({'_id': ObjectId(product_id)}, {'$set': {field: value}})
-        flash(f'Stock for size {size} set to {value}', 'success')
-    elif action in ['inc', 'dec']:
-        inc_value = value if action == 'inc' else -value
-        # Prevent resulting negative stock
-        current_qty = int(product.get('stock', {}).get(size, 0))
-        new_qty = current_qty + inc_value
-        if new_qty < 0:
-            flash('Resulting stock would be negative', 'error')
-            return redirect(url_for('admin_products'))
-        db.products.update_one({'_id': ObjectId(product_id)}, {'$inc': {field: inc_value}})
-        flash(f'Stock for size {size} updated to {new_qty}', 'success')
+@app.route('/admin/analytics/data')
+@login_required
+def admin_analytics_data():
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Access denied'}), 403
+
+    start, end = analytics_range()
+    dimension = request.args.get('dimension')
+    if dimension not in analytics.DIMENSIONS:
+        dimension = None
+    series = analytics.sales_series(reports_db, start, end, dimension)
+
+    # Human-readable names for the breakdown keys
+    if dimension == 'categories':
+        names = {str(c['_id']): c['name'] for c in get_categories()}
+        series['labels'] = {key: names.get(key, key) for key in series[dimension]}
+    elif dimension == 'products':
+        ids = [ObjectId(key) for key in series[dimension] if ObjectId.is_valid(key)]
+        names = {str(p['_id']): p['name'] for p in reports_db.products.find({'_id': {'$in': ids}}, {'name': 1})}
+        series['labels'] = {key: names.get(key, key) for key in series[dimension]}
+    return jsonify(series)
+
+# QUICK STOCK UPDATE ENDPOINT
+@app.route('/admin/product/update_stock/<product_id>', methods=['POST'])
+@login_required
+def admin_update_stock(product_id):
+    if current_user.role != 'admin':
+        flash('Access denied', 'error')
+        return redirect(url_for('home'))
+    
+    # Same guarded path as the batch endpoint, so concurrent checkouts can't drive stock negative
+    result = adjust_stock(db, [{
+        'product_id': product_id,
+        'size': request.form.get('size'),
+        'action': request.form.get('action', 'set'),  # set | inc | dec
+        'value': request.form.get('value', '0'),
+    }])[0]
+    if result['status'] == 'applied':
+        invalidate_products(ObjectId(product_id))
+        flash(f"Stock for size {result['size']} {'set' if result['action'] == 'set' else 'updated'} to {result['stock']}", 'success')
+    elif result['status'] == 'insufficient':
+        flash('Resulting stock would be negative', 'error')
+    elif result['status'] == 'not_found':
+        flash('Product not found', 'error')
     else:
-        flash('Invalid action', 'error')
+        flash(result['error'].capitalize(), 'error')
     return redirect(url_for('admin_products'))
 
+# BATCH STOCK ADJUSTMENTS
+@app.route('/admin/stock/adjust', methods=['POST'])
+@login_required
+def admin_adjust_stock():
+    if current_user.role != 'admin':
+        flash('Access denied', 'error')
+        return redirect(url_for('home'))
+    
+    # A JSON body {"rows": [...]} or an uploaded CSV file
+    upload = request.files.get('file')
+    if upload and upload.filename:
+        try:
+            rows = read_adjustments(upload.stream)
+        except UnicodeDecodeError:
+            return jsonify({'error': 'The file is not UTF-8 CSV'}), 400
+    else:
+        payload = request.get_json(silent=True) or {}
+        rows = payload.get('rows') if isinstance(payload, dict) else None
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            return jsonify({'error': 'Send {"rows": [{"product_id" or "sku", "size", "action", "value"}, ...]} '
+                                     'or a CSV file as "file"'}), 400
+    
+    results = adjust_stock(db, rows)
+    touched = applied_product_ids(results)
+    if touched:
+        invalidate_products(*touched)
+    applied = sum(1 for result in results if result['status'] == 'applied')
+    return jsonify({'applied': applied, 'failed': len(results) - applied, 'results': results})
+
 # GridFS image streaming route
+def iter_gridfs_range(file_id, chunk_size, start, stop):
+    """Yield bytes [start, stop) of a GridFS file, reading only the chunks that cover them"""
+    first, last = start // chunk_size, (stop - 1) // chunk_size
+    chunks = db.fs.chunks.find(
+        {'files_id': file_id, 'n': {'$gte': first, '$lte': last}},
+        {'n': 1, 'data': 1}
+    ).sort('n', 1).batch_size(4)
+    for chunk in chunks:
+        data = chunk['data']
+        offset = chunk['n'] * chunk_size
+        lo = max(start - offset, 0)
+        hi = min(stop - offset, len(data))
+        yield data if lo == 0 and hi == len(data) else data[lo:hi]
+
 @app.route('/image/<gridfs_id>')
 def stream_image(gridfs_id):
     try:
-        file_data = db.fs.files.find_one({'_id': ObjectId(gridfs_id)})
-        if file_data:
-            chunk_data = db.fs.chunks.find_one({'files_id': ObjectId(gridfs_id)})
-            if chunk_data:
-                return send_file(
-                    io.BytesIO(chunk_data['data']),
-                    mimetype=file_data['content_type']
-                )
-    except:
-        pass
+        file_id = ObjectId(gridfs_id)
+    except Exception:
+        return 'Image not found', 404
+    
+    file_data = db.fs.files.find_one({'_id': file_id})
+    if not file_data:
+        return 'Image not found', 404
+    
+    length = file_data.get('length')
+    chunk_size = file_data.get('chunkSize')
+    legacy_chunk = None
+    if length is None or not chunk_size:
+        # Older uploads stored the whole file as chunk 0 without GridFS length metadata
+        legacy_chunk = db.fs.chunks.find_one({'files_id': file_id, 'n': 0}, {'data': 1})
+        if not legacy_chunk:
+            return 'Image not found', 404
+        length = chunk_size = len(legacy_chunk['data'])
+    
+    # Stored files never change, so their id is a valid fallback validator
+    etag = file_data.get('sha256') or file_data.get('md5') or str(file_id)
+    last_modified = file_data.get('uploadDate') or file_data.get('upload_date')
+    if last_modified is not None and last_modified.tzinfo is None:
+        last_modified = last_modified.replace(tzinfo=timezone.utc)
     
-    return 'Image not found', 404
+    response = Response(mimetype=file_data.get('content_type') or file_data.get('contentType')
+                        or 'application/octet-stream')
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.headers['Cache-Control'] = f"public, max-age={app.config['IMAGE_CACHE_MAX_AGE']}, immutable"
+    response.accept_ranges = 'bytes'
+    
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response.status_code = 304
+        return response
+    
+    start, stop = 0, length
+    # A Range only applies while If-Range (if sent) still names this representation. Multiple
+    # ranges are not supported; RFC 9110 lets the server ignore them and send the whole file
+    if (request.range and len(request.range.ranges) == 1
+            and ('If-Range' not in request.headers or request.if_range.etag == etag)):
+        byte_range = request.range.range_for_length(length)
+        if byte_range is None:
+            response.status_code = 416
+            response.headers['Content-Range'] = f'bytes */{length}'
+            return response
+        start, stop = byte_range
+        response.status_code = 206
+        response.content_range = ContentRange('bytes', start, stop, length)
+    
+    if legacy_chunk is not None:
+        response.response = [legacy_chunk['data'][start:stop]]
+    else:
+        response.response = iter_gridfs_range(file_id, chunk_size, start, stop)
+    response.content_length = stop - start
+    response.direct_passthrough = True
+    return response
 
 # Initialize database with sample data
 def init_db():
-    # Create text index for search
-    db.products.create_index([('name', 'text'), ('description', 'text')])
+    # Indexes, including the search text index, come from the manifest in indexes.py
     
     # Create sample categories if none exist
     if db.categories.count_documents({}) == 0:
@@ -952,13 +1738,17 @@ def create_admin():
         
         # Create admin user
         password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-        db.users.insert_one({
-            'username': (email.split('@')[0] if email else 'admin'),
-            'email': email,
-            'password_hash': password_hash,
-            'role': 'admin',
-            'created_at': datetime.utcnow()
-        })
+        try:
+            db.users.insert_one({
+                'username': (email.split('@')[0] if email else 'admin'),
+                'email': email,
+                'password_hash': password_hash,
+                'role': 'admin',
+                'created_at': datetime.utcnow()
+            })
+        except DuplicateKeyError:
+            flash('A user with this email or username already exists', 'error')
+            return render_template('create_admin.html')
         
         flash(f'Admin user {email} created successfully!', 'success')
         return redirect(url_for('login'))
@@ -0,0 +1,40 @@
+"""
+Benchmarks for the storefront's hot paths, one module per path, run from the
+repository root as `python -m benchmarks.<module>`. Those that need MongoDB
+work in a scratch database next to MONGODB_URI's, named <name>_bench, and
+drop it when they finish.
+"""
+
+import time
+from contextlib import contextmanager
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def elapsed_ms(started):
+    return (time.perf_counter() - started) * 1000
+
+
+def summarize(timings, digits=2):
+    """{kind: {'p50_ms', 'p99_ms'}} for {kind: [milliseconds]}"""
+    return {kind: {'p50_ms': round(percentile(values, 0.5), digits),
+                   'p99_ms': round(percentile(values, 0.99), digits)}
+            for kind, values in timings.items()}
+
+
+@contextmanager
+def scratch_database(**client_options):
+    """A database next to MONGODB_URI's, named <name>_bench and dropped on exit"""
+    from pymongo import MongoClient
+    from config import Config
+
+    client = MongoClient(Config.MONGODB_URI, **client_options)
+    name = f'{client.get_database().name}_bench'
+    try:
+        yield client[name]
+    finally:
+        client.drop_database(name)
+        client.close()
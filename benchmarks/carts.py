@@ -0,0 +1,140 @@
+"""
+Cart page, add-to-cart and checkout latency by cart size.
+
+Builds carts of each size for a signed-in user and times each request's cart
+work two ways. Server-side carts (carts.py) read the cart document by user_id
+plus one $in query for its products, and add lines with one $inc upsert.
+Cookie carts, as before, carry the lines in the signed session cookie, so
+every request verifies and decodes them and adding a line re-signs the whole
+cookie. Both also verify the session cookie, and report its size. Checkout
+(the reads plus the stock reservation) and the old one find_one per line are
+timed too, with the commands each variant issues.
+
+    python -m benchmarks.carts --lines 1 10 50 200 [--rounds 50]
+"""
+
+import argparse
+import sys
+import time
+
+from bson import ObjectId
+from flask import Flask
+from flask.sessions import SecureCookieSessionInterface
+
+from benchmarks import elapsed_ms, scratch_database, summarize
+from carts import CART_PRODUCT_PROJECTION, SIZES, add_user_lines, cart_items, load_products, load_user_cart
+from config import Config
+from instrumentation import MongoCommandRecorder
+from stock import release_stock, reserve_stock
+
+
+def session_serializer():
+    """The serializer Flask signs the session cookie with"""
+    app = Flask(__name__)
+    app.secret_key = Config.SECRET_KEY
+    return SecureCookieSessionInterface().get_signing_serializer(app)
+
+
+def bench(db, line_counts, rounds=50, recorder=None):
+    """Per cart size, cookie sizes, p50/p99 of each request's cart work, and command counts
+
+    The command counts need the MongoCommandRecorder the client was created with.
+    """
+    serializer = session_serializer()
+    product_ids = db.products.insert_many([
+        {'name': f'Bench product {i}', 'price': 10.0 + i, 'images': [], 'category_id': None,
+         'stock': {size: 1000000 for size in SIZES}}
+        for i in range(max(line_counts) + 1)
+    ]).inserted_ids
+    extra = str(product_ids[-1])
+    report = {}
+    for count in line_counts:
+        user_id = ObjectId()
+        # What Flask-Login keeps in the session of a signed-in user
+        signed_in = {'_fresh': True, '_id': '0' * 128, '_user_id': f'{user_id}:0'}
+        cookie_cart = [{'product_id': str(product_ids[i]), 'size': 'M', 'quantity': 1} for i in range(count)]
+        cookies = {'server': serializer.dumps(signed_in),
+                   'cookie': serializer.dumps({**signed_in, 'cart': cookie_cart})}
+        add_user_lines(db, user_id, [(str(product_ids[i]), 'M', 1) for i in range(count)])
+        timings = {'cart': [], 'cookie_cart': [], 'add': [], 'cookie_add': [], 'checkout': [], 'per_line': []}
+        commands = {}
+        for round_number in range(rounds):
+            token = recorder.begin() if recorder is not None and round_number == 0 else None
+            started = time.perf_counter()
+            serializer.loads(cookies['server'])
+            items = cart_items(load_user_cart(db, user_id))
+            load_products(db, [item['product_id'] for item in items], CART_PRODUCT_PROJECTION, {})
+            timings['cart'].append(elapsed_ms(started))
+            if token is not None:
+                commands['cart'] = len(recorder.current().commands)
+                recorder.end(token)
+
+            started = time.perf_counter()
+            items = serializer.loads(cookies['cookie'])['cart']
+            load_products(db, [item['product_id'] for item in items], CART_PRODUCT_PROJECTION, {})
+            timings['cookie_cart'].append(elapsed_ms(started))
+
+            # Adding a line that is already in the cart keeps the cart size steady
+            started = time.perf_counter()
+            serializer.loads(cookies['server'])
+            add_user_lines(db, user_id, [(extra, 'S', 1)])
+            timings['add'].append(elapsed_ms(started))
+
+            started = time.perf_counter()
+            session = serializer.loads(cookies['cookie'])
+            session['cart'] = [*session['cart'][:count], {'product_id': extra, 'size': 'S', 'quantity': 1}]
+            serializer.dumps(session)
+            timings['cookie_add'].append(elapsed_ms(started))
+
+            started = time.perf_counter()
+            items = cart_items(load_user_cart(db, user_id))
+            products = load_products(db, [item['product_id'] for item in items], CART_PRODUCT_PROJECTION, {})
+            lines = reserve_stock(db, [(products[item['product_id']]['_id'], item['size'], item['quantity'])
+                                       for item in items])
+            timings['checkout'].append(elapsed_ms(started))
+            release_stock(db, lines)
+
+            # How the cart was loaded before: one find_one per line
+            token = recorder.begin() if token is not None else None
+            started = time.perf_counter()
+            items = cart_items(load_user_cart(db, user_id))
+            for item in items:
+                db.products.find_one({'_id': ObjectId(item['product_id'])}, CART_PRODUCT_PROJECTION)
+            timings['per_line'].append(elapsed_ms(started))
+            if token is not None:
+                commands['per_line'] = len(recorder.current().commands)
+                recorder.end(token)
+        cookie_bytes = {kind: len(f'session={cookie}') for kind, cookie in cookies.items()}
+        report[count] = {'commands': commands, 'cookie_bytes': cookie_bytes, **summarize(timings)}
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cart page, add-to-cart and checkout latency by cart size')
+    parser.add_argument('--lines', type=int, nargs='+', default=[1, 10, 50, 200])
+    parser.add_argument('--rounds', type=int, default=50)
+    args = parser.parse_args()
+
+    recorder = MongoCommandRecorder()
+    with scratch_database(event_listeners=[recorder]) as db:
+        report = bench(db, args.lines, args.rounds, recorder)
+
+    def timing(figures, kind):
+        return f"{figures[kind]['p50_ms']:>7} / {figures[kind]['p99_ms']:<6}"
+
+    print(f"✅ {args.rounds} rounds per cart size (p50 / p99 ms), server-side cart vs cookie cart")
+    print(f"   {'lines':>5}  {'cookie bytes':>13}  {'cart page':>15}  {'cookie cart page':>16}"
+          f"  {'add line':>15}  {'cookie add line':>15}")
+    for count, figures in report.items():
+        print(f"   {count:>5}  {figures['cookie_bytes']['server']:>5} / {figures['cookie_bytes']['cookie']:<5}"
+              f"  {timing(figures, 'cart')}  {timing(figures, 'cookie_cart'):>16}"
+              f"  {timing(figures, 'add')}  {timing(figures, 'cookie_add')}")
+    print(f"   {'lines':>5}  {'checkout':>15}  {'one query per line':>19}  commands")
+    for count, figures in report.items():
+        print(f"   {count:>5}  {timing(figures, 'checkout')}  {timing(figures, 'per_line'):>19}"
+              f"  {figures['commands'].get('cart')} vs {figures['commands'].get('per_line')}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
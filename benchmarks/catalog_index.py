@@ -0,0 +1,147 @@
+"""
+Filtered listing pages with facet counts from the catalog index.
+
+Builds a CatalogIndex over synthetic products and times search() for random
+filter combinations. With --mongo the same products are loaded into the
+scratch database with the manifest's product indexes, and the equivalent find
+page and a $facet aggregation for the counts are timed too.
+
+    python -m benchmarks.catalog_index --products 100000 [--mongo]
+"""
+
+import argparse
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from benchmarks import elapsed_ms, scratch_database, summarize
+from catalog_index import INDEX_PROJECTION, SIZES, CatalogIndex
+
+COLORS = ('black', 'white', 'blue', 'red', 'green', 'beige', 'navy', 'olive', 'grey', 'pink', 'yellow', 'brown')
+# Listing sort orders as the products route sends them to Mongo
+MONGO_SORTS = {
+    'newest': [('created_at', -1), ('_id', -1)],
+    'price_asc': [('price', 1), ('_id', 1)],
+    'price_desc': [('price', -1), ('_id', -1)],
+}
+
+
+def synthetic_products(count, categories, rng):
+    start = datetime(2024, 1, 1)
+    return [{
+        '_id': ObjectId(),
+        'category_id': rng.choice(categories),
+        'colors': rng.sample(COLORS, rng.randint(1, 3)),
+        'stock': {size: rng.choice((0, 0, 1, 5, 20)) for size in SIZES},
+        'price': round(rng.uniform(5, 300), 2),
+        'created_at': start + timedelta(minutes=rng.randrange(1000000)),
+    } for _ in range(count)]
+
+
+def mongo_filter(category=None, color=None, size=None, min_price=None, max_price=None):
+    query = {}
+    if category:
+        query['category_id'] = category
+    if min_price is not None or max_price is not None:
+        query['price'] = {key: value for key, value in (('$gte', min_price), ('$lte', max_price))
+                          if value is not None}
+    if size:
+        query[f'stock.{size}'] = {'$gt': 0}
+    if color:
+        query['colors'] = color
+    return query
+
+
+def mongo_facets(collection, filters):
+    """Facet counts the way Mongo would compute them: one $facet stage per request"""
+    stages = {}
+    for dimension, field in (('category', '$category_id'), ('color', '$colors'), ('size', None)):
+        match = mongo_filter(**{key: value for key, value in filters.items() if key != dimension})
+        if field is None:
+            stages[dimension] = [{'$match': match},
+                                 {'$project': {'sizes': {'$filter': {
+                                     'input': {'$objectToArray': '$stock'}, 'cond': {'$gt': ['$$this.v', 0]}}}}},
+                                 {'$unwind': '$sizes'}, {'$group': {'_id': '$sizes.k', 'n': {'$sum': 1}}}]
+        else:
+            stages[dimension] = [{'$match': match}, {'$unwind': field},
+                                 {'$group': {'_id': field, 'n': {'$sum': 1}}}]
+    return list(collection.aggregate([{'$facet': stages}]))
+
+
+def random_requests(queries, categories, rng):
+    requests = []
+    for _ in range(queries):
+        filters = {}
+        if rng.random() < 0.5:
+            filters['category'] = rng.choice(categories)
+        if rng.random() < 0.3:
+            filters['color'] = rng.choice(COLORS)
+        if rng.random() < 0.3:
+            filters['size'] = rng.choice(SIZES)
+        if rng.random() < 0.3:
+            low = rng.uniform(5, 250)
+            filters['min_price'], filters['max_price'] = low, low + rng.uniform(10, 100)
+        requests.append((rng.choice(tuple(MONGO_SORTS)), filters))
+    return requests
+
+
+def bench(products, queries, db=None, seed=1):
+    """Time filtered listing pages with facet counts from the index, and from Mongo when db is given"""
+    rng = random.Random(seed)
+    categories = [ObjectId() for _ in range(20)]
+    docs = synthetic_products(products, categories, rng)
+    index = CatalogIndex()
+    started = time.perf_counter()
+    index.build(docs)
+    build_seconds = time.perf_counter() - started
+
+    requests = random_requests(queries, categories, rng)
+    timings = {'index': []}
+    for sort, filters in requests:
+        index_filters = dict(filters, category=str(filters['category']) if 'category' in filters else None)
+        started = time.perf_counter()
+        index.search(sort, None, 25, **index_filters)
+        timings['index'].append(elapsed_ms(started))
+
+    if db is not None:
+        from indexes import INDEXES, ensure_indexes
+
+        ensure_indexes(db, {'products': INDEXES['products']}, verbose=False)
+        for i in range(0, len(docs), 10000):
+            db.products.insert_many(docs[i:i + 10000])
+        timings['mongo page'], timings['mongo page + facets'] = [], []
+        for sort, filters in requests:
+            started = time.perf_counter()
+            list(db.products.find(mongo_filter(**filters), INDEX_PROJECTION).sort(MONGO_SORTS[sort]).limit(25))
+            page_ms = elapsed_ms(started)
+            mongo_facets(db.products, filters)
+            timings['mongo page'].append(page_ms)
+            timings['mongo page + facets'].append(elapsed_ms(started))
+
+    return {'products': products, 'queries': queries, 'build_seconds': round(build_seconds, 2),
+            'timings': summarize(timings, digits=3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Faceted catalog index')
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--mongo', action='store_true', help='also time the same requests against MongoDB')
+    args = parser.parse_args()
+
+    if args.mongo:
+        with scratch_database() as db:
+            report = bench(args.products, args.queries, db)
+    else:
+        report = bench(args.products, args.queries)
+    print(f"✅ {report['products']} products indexed in {report['build_seconds']}s, {report['queries']} listing requests")
+    for kind, figures in report['timings'].items():
+        print(f"   {kind:20} p50 {figures['p50_ms']}ms  p99 {figures['p99_ms']}ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,120 @@
+"""
+Email delivery throughput, pooled vs one connection per message.
+
+Queues messages in the scratch database's outbox and drains it through
+OutboxWorker, then sends the same messages from one thread, once over a
+reused connection and once with a connection per message (connect, TLS/AUTH
+when configured, send, quit). --local-smtp starts an aiosmtpd stand-in
+in-process (requirements-dev.txt) and checks every message arrived; otherwise
+the configured SMTP server receives them.
+
+    python -m benchmarks.mailer --messages 2000 --local-smtp
+"""
+
+import argparse
+import socket
+import sys
+import time
+from datetime import datetime
+
+from benchmarks import scratch_database
+from mailer import OUTBOX, OutboxWorker, SMTPConnectionPool, build_message, email_enabled
+
+
+def bench(db, config, messages=1000, unpooled=200):
+    """Drain an outbox of messages through OutboxWorker, then compare one sender thread pooled and unpooled"""
+    body = '<p>Your order has been placed.</p>' * 20
+    for start in range(0, messages, 1000):
+        now = datetime.utcnow()
+        db[OUTBOX].insert_many([{
+            'to': f'customer{i}@example.com', 'subject': f'Order #{i}', 'html_body': body, 'text_body': None,
+            'status': 'pending', 'attempts': 0, 'next_attempt_at': now, 'created_at': now,
+        } for i in range(start, min(messages, start + 1000))])
+    worker = OutboxWorker(db, config)
+    started = time.perf_counter()
+    while worker.process_batch():
+        pass
+    pooled_seconds = time.perf_counter() - started
+    worker._senders.shutdown()
+    worker.pool.close()
+    statuses = {doc['_id']: doc['n'] for doc in db[OUTBOX].aggregate(
+        [{'$group': {'_id': '$status', 'n': {'$sum': 1}}}])}
+
+    rates = {}
+    for kind, size in (('direct_pooled', 1), ('unpooled', 0)):
+        pool = SMTPConnectionPool(config, size=size)
+        started = time.perf_counter()
+        for i in range(unpooled):
+            pool.send(build_message(config, {'to': f'customer{i}@example.com', 'subject': f'Order #{i}',
+                                             'html_body': body}))
+        seconds = time.perf_counter() - started
+        pool.close()
+        rates[f'{kind}_per_second'] = round(unpooled / seconds, 1) if seconds else 0.0
+    return {
+        'messages': messages, 'statuses': statuses, 'connects': worker.pool.connects,
+        'outbox_per_second': round(messages / pooled_seconds, 1) if pooled_seconds else 0.0,
+        'unpooled': unpooled, **rates,
+    }
+
+
+def local_smtp(config):
+    """Start an aiosmtpd stand-in on a free port; returns (controller, received messages list)"""
+    from aiosmtpd.controller import Controller
+
+    received = []
+
+    class Handler:
+        async def handle_DATA(self, server, session, envelope):
+            received.append(envelope.rcpt_tos[0])
+            return '250 OK'
+
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    controller = Controller(Handler(), hostname='127.0.0.1', port=port)
+    controller.start()
+    config.update(SMTP_HOST='127.0.0.1', SMTP_PORT=port, SMTP_SECURITY='plain', SMTP_USER='', SMTP_PASSWORD='',
+                  SMTP_FROM=config.get('SMTP_FROM') or 'store@example.com')
+    return controller, received
+
+
+def main():
+    from config import Config
+
+    parser = argparse.ArgumentParser(description='Email delivery throughput, pooled vs unpooled')
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--unpooled', type=int, default=200, help='messages sent one connection each')
+    parser.add_argument('--pool-size', type=int, default=None)
+    parser.add_argument('--local-smtp', action='store_true', help='deliver to an in-process aiosmtpd stand-in')
+    args = parser.parse_args()
+
+    config = {key: getattr(Config, key) for key in dir(Config) if key.isupper()}
+    controller = received = None
+    if args.local_smtp:
+        controller, received = local_smtp(config)
+    elif not email_enabled(config):
+        print("❌ SMTP_HOST is not configured (or pass --local-smtp)")
+        return 1
+    if args.pool_size:
+        config['SMTP_POOL_SIZE'] = args.pool_size
+    try:
+        with scratch_database() as db:
+            report = bench(db, config, args.messages, min(args.unpooled, args.messages))
+    finally:
+        if controller is not None:
+            controller.stop()
+    print(f"✅ {report['messages']} queued messages: {report['statuses']}, "
+          f"{report['outbox_per_second']} msg/s through the outbox over {report['connects']} pooled connections")
+    print(f"   one sender, {report['unpooled']} messages: {report['direct_pooled_per_second']} msg/s "
+          f"on one connection, {report['unpooled_per_second']} msg/s with a connection per message")
+    if received is not None:
+        expected = report['messages'] + 2 * report['unpooled']
+        if len(received) != expected or report['statuses'] != {'sent': report['messages']}:
+            print(f"❌ the stand-in received {len(received)} of {expected} messages")
+            return 1
+        print(f"   the stand-in received all {expected} messages")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
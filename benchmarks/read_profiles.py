@@ -0,0 +1,101 @@
+"""
+Mixed load through the read profiles, all on the primary vs routed.
+
+Runs storefront catalog reads, admin report scans and order writes
+concurrently for a fixed time, first with every kind on the transactional
+client and then each on its own profile's client, and reports ops/s and
+p50/p99 per kind. Order writes go to a bench_orders collection that is dropped
+afterwards. A single-host replica set (mongod --replSet rs0, then
+rs.initiate()) is enough to exercise the routing.
+
+    python -m benchmarks.read_profiles --seconds 10
+"""
+
+import argparse
+import sys
+import threading
+import time
+
+from benchmarks import elapsed_ms, percentile
+from mongo_profiles import create_clients, load_profiles
+
+
+def bench(catalog, reports, transactional, seconds=10, readers=16, reporters=2, writers=4):
+    """Run storefront reads, report scans and order writes concurrently; returns per-kind throughput"""
+    scratch = transactional.get_database()['bench_orders']
+    deadline = time.perf_counter() + seconds
+    results = {'catalog reads': [], 'report scans': [], 'order writes': []}
+    errors = []
+    lock = threading.Lock()
+
+    def catalog_read():
+        list(catalog.get_database().products.find({}, {'name': 1, 'price': 1})
+             .sort([('created_at', -1), ('_id', -1)]).limit(24))
+
+    def report_scan():
+        list(reports.get_database().orders.find({}, {'status': 1, 'total_amount': 1})
+             .sort([('created_at', -1), ('_id', -1)]).limit(500))
+
+    def order_write():
+        scratch.insert_one({'status': 'pending', 'total_amount': 1.0, 'created_at': time.time()})
+
+    def worker(kind, operation):
+        timings = []
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                operation()
+            except Exception as e:
+                with lock:
+                    errors.append(f"{kind}: {e}")
+                continue
+            timings.append(elapsed_ms(started))
+        with lock:
+            results[kind].extend(timings)
+
+    threads = ([threading.Thread(target=worker, args=('catalog reads', catalog_read)) for _ in range(readers)]
+               + [threading.Thread(target=worker, args=('report scans', report_scan)) for _ in range(reporters)]
+               + [threading.Thread(target=worker, args=('order writes', order_write)) for _ in range(writers)])
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    scratch.drop()
+    report = {kind: {'ops_per_second': round(len(timings) / seconds, 1),
+                     'p50_ms': round(percentile(timings, 0.5), 2),
+                     'p99_ms': round(percentile(timings, 0.99), 2)}
+              for kind, timings in results.items()}
+    return report, errors[:5]
+
+
+def main():
+    from config import Config
+
+    parser = argparse.ArgumentParser(description='Mixed load through the read profiles')
+    parser.add_argument('--seconds', type=int, default=10)
+    parser.add_argument('--readers', type=int, default=16)
+    parser.add_argument('--reporters', type=int, default=2)
+    parser.add_argument('--writers', type=int, default=4)
+    args = parser.parse_args()
+
+    clients = create_clients(Config.MONGODB_URI, load_profiles(Config.MONGO_PROFILES))
+    try:
+        for label, routed in (('all on primary', False), ('routed by profile', True)):
+            primary = clients['transactional']
+            report, errors = bench(clients['catalog'] if routed else primary,
+                                   clients['admin-reports'] if routed else primary, primary,
+                                   args.seconds, args.readers, args.reporters, args.writers)
+            print(f"✅ {label}")
+            for kind, figures in report.items():
+                print(f"   {kind:14} {figures['ops_per_second']:>9} ops/s  p50 {figures['p50_ms']}ms  "
+                      f"p99 {figures['p99_ms']}ms")
+            for error in errors:
+                print(f"❌ {error}")
+        return 0
+    finally:
+        for client in clients.values():
+            client.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
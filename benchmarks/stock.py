@@ -0,0 +1,145 @@
+"""
+Concurrent checkouts on one hot size, optionally racing adjustment sheets.
+
+Threads place two-line orders through reserve_stock until a hot size in the
+scratch database sells out. Each order takes a unit of a second product
+first, so every order rejected on the hot size has to release that line
+again. Adjuster threads meanwhile apply two-row sheets through adjust_stock:
+a dec of the hot size and an inc of the second product, and every row must
+be applied or rejected on its own. Exits non-zero on any oversell, lost
+update or wrong row result.
+
+    python -m benchmarks.stock --threads 32 --stock 2000 [--adjusters 4]
+"""
+
+import argparse
+import sys
+import threading
+import time
+
+from benchmarks import scratch_database
+from stock import StockReservationError, adjust_stock, reserve_stock
+
+
+def bench(db, threads=32, stock=2000, quantity=1, adjusters=0, adjust_by=2):
+    """Reserve one hot size from many threads until it sells out; returns the figures and any violations
+
+    Each order also takes one unit of a second product first, so every order
+    that fails on the hot size has to release that line again. Adjuster
+    threads meanwhile apply two-row sheets through adjust_stock: a dec of
+    adjust_by on the hot size and an inc of 1 on the second product. Each row
+    must be applied or rejected on its own.
+    """
+    cold_stock = (stock + 1) * (threads + adjusters)
+    hot, cold = db.products.insert_many([
+        {'name': 'Bench hot product', 'stock': {'M': stock}},
+        {'name': 'Bench cold product', 'stock': {'L': cold_stock}},
+    ]).inserted_ids
+    lock = threading.Lock()
+    counts = {'reserved': 0, 'orders': 0, 'rejected': 0, 'sheets': 0, 'adjusted': 0, 'restocked': 0}
+    errors = []
+
+    def checkout():
+        orders = rejected = 0
+        while True:
+            try:
+                reserve_stock(db, [(cold, 'L', 1), (hot, 'M', quantity)])
+                orders += 1
+            except StockReservationError:
+                # Stock only goes down here, so a rejected quantity stays rejected
+                rejected += 1
+                break
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+                break
+        with lock:
+            counts['orders'] += orders
+            counts['reserved'] += orders * quantity
+            counts['rejected'] += rejected
+
+    def adjust():
+        sheets = adjusted = restocked = 0
+        while True:
+            results = adjust_stock(db, [
+                {'product_id': str(hot), 'size': 'M', 'action': 'dec', 'value': adjust_by},
+                {'product_id': str(cold), 'size': 'L', 'action': 'inc', 'value': 1},
+            ])
+            sheets += 1
+            dec, inc = results
+            if inc['status'] != 'applied':
+                with lock:
+                    errors.append(f"inc row got {inc['status']}: {inc.get('error')}")
+                break
+            restocked += 1
+            if dec['status'] == 'applied':
+                adjusted += adjust_by
+                if dec['stock'] is None or dec['stock'] < 0:
+                    with lock:
+                        errors.append(f"dec row reported stock {dec['stock']}")
+                    break
+                continue
+            if dec['status'] != 'insufficient':
+                with lock:
+                    errors.append(f"dec row got {dec['status']}: {dec.get('error')}")
+            break
+        with lock:
+            counts['sheets'] += sheets
+            counts['adjusted'] += adjusted
+            counts['restocked'] += restocked
+
+    workers = [threading.Thread(target=checkout) for _ in range(threads)]
+    # Spread the adjusters among the checkouts so they start while the size is still selling
+    for i in range(adjusters):
+        workers.insert(i * len(workers) // adjusters, threading.Thread(target=adjust))
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    seconds = time.perf_counter() - started
+    final = {product['_id']: product['stock'] for product in db.products.find({'_id': {'$in': [hot, cold]}})}
+    hot_left, cold_left = final[hot]['M'], final[cold]['L']
+
+    violations = list(errors)
+    if hot_left < 0:
+        violations.append(f"hot stock went negative: {hot_left}")
+    removed = counts['reserved'] + counts['adjusted']
+    if removed > stock:
+        violations.append(f"oversold: {counts['reserved']} reserved and {counts['adjusted']} adjusted of {stock}")
+    if removed != stock - hot_left:
+        violations.append(f"lost updates: {removed} reserved or adjusted but stock fell by {stock - hot_left}")
+    if cold_left != cold_stock - counts['orders'] + counts['restocked']:
+        violations.append(f"second product: {cold_left} left, expected {cold_stock} - {counts['orders']} orders "
+                          f"+ {counts['restocked']} restocks")
+    return {'threads': threads, 'stock': stock, 'quantity': quantity, 'orders': counts['orders'],
+            'reserved': counts['reserved'], 'rejected': counts['rejected'], 'left': hot_left,
+            'adjusters': adjusters, 'sheets': counts['sheets'], 'adjusted': counts['adjusted'],
+            'seconds': round(seconds, 2),
+            'orders_per_second': round(counts['orders'] / seconds, 1) if seconds else 0.0}, violations
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent checkouts on one hot size')
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--stock', type=int, default=2000)
+    parser.add_argument('--quantity', type=int, default=1, help='units of the hot size per order')
+    parser.add_argument('--adjusters', type=int, default=0, help='threads applying dec/inc adjustment sheets')
+    parser.add_argument('--adjust-by', type=int, default=2, help='units each dec row removes')
+    args = parser.parse_args()
+
+    with scratch_database(maxPoolSize=args.threads + args.adjusters) as db:
+        report, violations = bench(db, args.threads, args.stock, args.quantity, args.adjusters, args.adjust_by)
+    print(f"{'❌' if violations else '✅'} {report['threads']} threads sold {report['reserved']} of "
+          f"{report['stock']} in {report['orders']} orders ({report['orders_per_second']} orders/s), "
+          f"{report['left']} left, {report['rejected']} rejected")
+    if report['adjusters']:
+        print(f"   {report['adjusters']} adjusters applied {report['sheets']} sheets, "
+              f"removing {report['adjusted']} units")
+    for violation in violations:
+        print(f"❌ {violation}")
+    return 1 if violations else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""
+Search suggestion lookups on synthetic products.
+
+Builds a TypeaheadIndex over synthetic product and category names and times
+suggest() on prefixes the way a search box sends them while someone types:
+each prefix once, then all of them again, and a product rename.
+
+    python -m benchmarks.typeahead --products 100000
+"""
+
+import argparse
+import random
+import re
+import sys
+import time
+
+from benchmarks import elapsed_ms, percentile
+from typeahead import TypeaheadIndex, normalize
+
+WORDS = ('classic', 'slim', 'fit', 'cotton', 'linen', 'denim', 'summer', 'winter', 'casual', 'formal',
+         'striped', 'printed', 'oversized', 'cropped', 'relaxed', 'vintage', 'premium', 'basic', 'blue',
+         'black', 'white', 'red', 'green', 'olive', 'navy', 'beige', 'pastel', 'floral', 'checked', 'ribbed')
+ITEMS = ('shirt', 'tshirt', 'jeans', 'chinos', 'dress', 'skirt', 'hoodie', 'jacket', 'blazer', 'kurta',
+         'shorts', 'sweater', 'cardigan', 'polo', 'top', 'trousers', 'joggers', 'coat', 'vest', 'saree')
+
+
+def bench(products, queries, seed=1):
+    """Build an index of synthetic products and time suggest() on typed prefixes"""
+    rng = random.Random(seed)
+    categories = [{'_id': f'c{i}', 'name': f'{item.title()} Collection'} for i, item in enumerate(ITEMS)]
+    docs = []
+    for i in range(products):
+        name = ' '.join(rng.sample(WORDS, rng.randint(1, 3)) + [rng.choice(ITEMS)] + [f'{i:x}'])
+        docs.append({'_id': f'p{i}', 'name': name.title(), 'category_id': rng.choice(categories)['_id']})
+    popularity = {doc['_id']: int(rng.paretovariate(1.2)) for doc in docs}
+
+    index = TypeaheadIndex()
+    started = time.perf_counter()
+    index.build(docs, categories, popularity)
+    build_seconds = time.perf_counter() - started
+
+    # What a search box sends while someone types a name
+    typed = []
+    for _ in range(queries):
+        name = normalize(rng.choice(docs)['name'])
+        start = rng.choice([0] + [m.end() for m in re.finditer(' ', name)])
+        typed.append(name[start:start + rng.randint(1, 12)])
+    cold, warm = [], []
+    for timings in (cold, warm):
+        for prefix in typed:
+            started = time.perf_counter()
+            index.suggest(prefix, 8)
+            timings.append(elapsed_ms(started))
+
+    started = time.perf_counter()
+    for i in range(1000):
+        index.upsert_product({'_id': f'p{i}', 'name': f'Renamed {rng.choice(ITEMS)} {i}', 'category_id': 'c0'})
+    update_ms = time.perf_counter() - started  # seconds for 1000 renames = ms per rename
+    return {
+        'products': products, 'terms': len(index._terms), 'build_seconds': round(build_seconds, 2),
+        'queries': queries,
+        'first_p50_ms': round(percentile(cold, 0.5), 4), 'first_p99_ms': round(percentile(cold, 0.99), 4),
+        'first_max_ms': round(max(cold), 2),
+        'p50_ms': round(percentile(warm, 0.5), 4), 'p99_ms': round(percentile(warm, 0.99), 4),
+        'max_ms': round(max(warm), 2),
+        'update_ms': round(update_ms, 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Search suggestion lookups on synthetic products')
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=20000)
+    args = parser.parse_args()
+
+    report = bench(args.products, args.queries)
+    print(f"✅ {report['products']} products, {report['terms']} terms, built in {report['build_seconds']}s")
+    print(f"   first lookup of each prefix: p50 {report['first_p50_ms']}ms, p99 {report['first_p99_ms']}ms, "
+          f"max {report['first_max_ms']}ms")
+    print(f"   repeated lookups:            p50 {report['p50_ms']}ms, p99 {report['p99_ms']}ms, max {report['max_ms']}ms")
+    print(f"   product rename: {report['update_ms']}ms each")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,370 @@
+"""
+Read-through query cache with TTL, LRU bounds and tag-based invalidation.
+
+Entries remember the version of every tag they depend on. Invalidating a tag
+only bumps its version, so every entry tagged with it becomes a miss on its
+next read without having to find and delete them.
+
+Backends:
+- MemoryBackend: per-process OrderedDict, fastest, invalidation is local
+- SQLiteBackend: one file shared by all worker processes on the host
+- NullBackend: caching disabled (every read goes to the loader); tag versions
+  are still counted per process, as the catalog indexes track them
+
+Only the max_tags most recently bumped tags are kept. A dropped tag reads as
+the highest version dropped so far, so its version never goes back to one it
+had before and entries stored under an older one still miss.
+
+PageCache keeps whole rendered pages in the same backends, serving them stale
+for a while after they expire so one request can refresh them in the
+background.
+"""
+
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+
+class TagVersions:
+    """Per-process tag versions, bounded to the max_tags most recently bumped"""
+
+    def __init__(self, max_tags=10000):
+        self.max_tags = max_tags
+        self._versions = OrderedDict()
+        self._floor = 0
+        self._lock = threading.Lock()
+
+    def get(self, tags):
+        with self._lock:
+            return tuple(self._versions.get(tag, self._floor) for tag in tags)
+
+    def bump(self, tags):
+        with self._lock:
+            for tag in tags:
+                self._versions[tag] = self._versions.get(tag, self._floor) + 1
+                self._versions.move_to_end(tag)
+            while len(self._versions) > self.max_tags:
+                _, version = self._versions.popitem(last=False)
+                self._floor = max(self._floor, version)
+
+    def __len__(self):
+        return len(self._versions)
+
+
+class NullBackend:
+    name = 'none'
+
+    def __init__(self, max_tags=10000):
+        self._tags = TagVersions(max_tags)
+
+    def get(self, key):
+        return None
+
+    def set(self, key, entry, ttl):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def tag_versions(self, tags):
+        return self._tags.get(tags)
+
+    def bump_tags(self, tags):
+        self._tags.bump(tags)
+
+    def __len__(self):
+        return 0
+
+
+class MemoryBackend:
+    """In-process LRU store. Cached values are shared, treat them as read-only."""
+    name = 'memory'
+
+    def __init__(self, max_entries=1024, max_tags=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._tags = TagVersions(max_tags)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            entry, expires_at = item
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry, ttl):
+        with self._lock:
+            self._entries[key] = (entry, time.time() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def tag_versions(self, tags):
+        return self._tags.get(tags)
+
+    def bump_tags(self, tags):
+        self._tags.bump(tags)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteBackend:
+    """Store shared between processes through a WAL-mode SQLite file"""
+    name = 'sqlite'
+
+    def __init__(self, path, max_entries=1024, max_tags=10000):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_tags = max_tags
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        conn = self._conn()
+        conn.execute('CREATE TABLE IF NOT EXISTS cache_entries ('
+                     'key TEXT PRIMARY KEY, value BLOB, expires_at REAL, accessed_at REAL)')
+        conn.execute('CREATE INDEX IF NOT EXISTS cache_entries_accessed ON cache_entries (accessed_at)')
+        conn.execute('CREATE TABLE IF NOT EXISTS cache_tags (tag TEXT PRIMARY KEY, version INTEGER, bumped_at REAL)')
+        # Files created before tags were bounded lack bumped_at
+        if 'bumped_at' not in {row[1] for row in conn.execute('PRAGMA table_info(cache_tags)')}:
+            conn.execute('ALTER TABLE cache_tags ADD COLUMN bumped_at REAL DEFAULT 0')
+        conn.execute('CREATE INDEX IF NOT EXISTS cache_tags_bumped ON cache_tags (bumped_at)')
+        conn.execute('CREATE TABLE IF NOT EXISTS cache_meta (name TEXT PRIMARY KEY, value INTEGER)')
+
+    def _conn(self):
+        # Connections are per thread and must not survive a fork into a worker
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute('SELECT value, expires_at FROM cache_entries WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        if row[1] <= now:
+            conn.execute('DELETE FROM cache_entries WHERE key = ?', (key,))
+            return None
+        conn.execute('UPDATE cache_entries SET accessed_at = ? WHERE key = ?', (now, key))
+        return pickle.loads(row[0])
+
+    def set(self, key, entry, ttl):
+        now = time.time()
+        conn = self._conn()
+        conn.execute('INSERT OR REPLACE INTO cache_entries (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)',
+                     (key, pickle.dumps(entry, pickle.HIGHEST_PROTOCOL), now + ttl, now))
+        # Trim least recently used entries beyond the bound
+        conn.execute('DELETE FROM cache_entries WHERE key IN ('
+                     'SELECT key FROM cache_entries ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)',
+                     (self.max_entries,))
+
+    def delete(self, key):
+        self._conn().execute('DELETE FROM cache_entries WHERE key = ?', (key,))
+
+    def tag_versions(self, tags):
+        if not tags:
+            return ()
+        placeholders = ','.join('?' for _ in tags)
+        # The NULL row carries the version of dropped tags
+        rows = self._conn().execute(f'SELECT tag, version FROM cache_tags WHERE tag IN ({placeholders}) '
+                                    "UNION ALL SELECT NULL, value FROM cache_meta WHERE name = 'tag_floor'",
+                                    tuple(tags)).fetchall()
+        versions = dict(rows)
+        floor = versions.pop(None, 0)
+        return tuple(versions.get(tag, floor) for tag in tags)
+
+    def bump_tags(self, tags):
+        now = time.time()
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute("SELECT value FROM cache_meta WHERE name = 'tag_floor'").fetchone()
+            floor = row[0] if row else 0
+            for tag in tags:
+                conn.execute('INSERT INTO cache_tags (tag, version, bumped_at) VALUES (?, ?, ?) '
+                             'ON CONFLICT(tag) DO UPDATE SET version = version + 1, bumped_at = excluded.bumped_at',
+                             (tag, floor + 1, now))
+            # Drop the least recently bumped tags beyond the bound, raising the floor past their versions
+            dropped = conn.execute('SELECT tag, version FROM cache_tags ORDER BY bumped_at DESC LIMIT -1 OFFSET ?',
+                                   (self.max_tags,)).fetchall()
+            if dropped:
+                conn.executemany('DELETE FROM cache_tags WHERE tag = ?', [(tag,) for tag, _ in dropped])
+                conn.execute("INSERT INTO cache_meta (name, value) VALUES ('tag_floor', ?) "
+                             'ON CONFLICT(name) DO UPDATE SET value = MAX(value, excluded.value)',
+                             (max(floor, *(version for _, version in dropped)),))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def __len__(self):
+        return self._conn().execute('SELECT COUNT(*) FROM cache_entries').fetchone()[0]
+
+
+class QueryCache:
+    def __init__(self, backend, default_ttl=300):
+        self.backend = backend
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get_or_set(self, key, loader, tags=(), ttl=None):
+        """Return the cached value for key, calling loader() to fill it on a miss"""
+        tags = tuple(tags)
+        try:
+            versions = self.backend.tag_versions(tags)
+            entry = self.backend.get(key)
+        except Exception as e:
+            print(f"Cache read failed: {e}")
+            return loader()
+        if entry is not None and entry[1] == versions:
+            self.hits += 1
+            return entry[0]
+
+        self.misses += 1
+        value = loader()
+        try:
+            self.backend.set(key, (value, versions), ttl or self.default_ttl)
+        except Exception as e:
+            print(f"Cache write failed: {e}")
+        return value
+
+    def cached(self, key, tags=(), ttl=None):
+        """Decorator form of get_or_set; key may be a string or a callable of the arguments"""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                cache_key = key(*args, **kwargs) if callable(key) else key
+                return self.get_or_set(cache_key, lambda: func(*args, **kwargs), tags=tags, ttl=ttl)
+            return wrapper
+        return decorator
+
+    def invalidate(self, *tags):
+        """Expire every entry that depends on any of the given tags"""
+        try:
+            self.backend.bump_tags(tags)
+            self.invalidations += 1
+        except Exception as e:
+            print(f"Cache invalidation failed: {e}")
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'backend': self.backend.name,
+            'entries': len(self.backend),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            'invalidations': self.invalidations,
+        }
+
+
+class PageCache:
+    """Rendered pages, fresh for ttl seconds and then served stale for up to stale_ttl more
+
+    A tag invalidation evicts a page at once; only expiry by age is served stale.
+    """
+
+    def __init__(self, query_cache, ttl=60, stale_ttl=300):
+        self.backend = query_cache.backend
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def lookup(self, key, tags):
+        """(page or None, is stale, tag versions to store a re-rendered page under)"""
+        tags = tuple(tags)
+        try:
+            versions = self.backend.tag_versions(tags)
+            entry = self.backend.get(key)
+        except Exception as e:
+            print(f"Page cache read failed: {e}")
+            return None, False, None
+        if entry is None or entry[1] != versions:
+            self.misses += 1
+            return None, False, versions
+        page = entry[0]
+        stale = time.time() - page['stored_at'] > self.ttl
+        if stale:
+            self.stale_hits += 1
+        else:
+            self.hits += 1
+        return page, stale, versions
+
+    def versions(self, tags):
+        try:
+            return self.backend.tag_versions(tuple(tags))
+        except Exception as e:
+            print(f"Page cache read failed: {e}")
+            return None
+
+    def store(self, key, page, versions):
+        """Cache page (a dict) under the tag versions read before it was rendered"""
+        if versions is None:
+            return
+        page['stored_at'] = time.time()
+        try:
+            self.backend.set(key, (page, versions), self.ttl + self.stale_ttl)
+        except Exception as e:
+            print(f"Page cache write failed: {e}")
+
+    def claim_refresh(self, key):
+        """True for the one caller in this process that should re-render a stale page"""
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            return True
+
+    def release_refresh(self, key):
+        with self._lock:
+            self._refreshing.discard(key)
+
+    def stats(self):
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'hit_ratio': round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+
+def create_cache(config):
+    """Build the QueryCache described by the CACHE_* settings"""
+    backend_name = config.get('CACHE_BACKEND', 'memory')
+    max_entries = config.get('CACHE_MAX_ENTRIES', 1024)
+    max_tags = config.get('CACHE_MAX_TAGS', 10000)
+    if backend_name == 'sqlite':
+        backend = SQLiteBackend(config['CACHE_SQLITE_PATH'], max_entries=max_entries, max_tags=max_tags)
+    elif backend_name == 'none':
+        backend = NullBackend(max_tags=max_tags)
+    else:
+        backend = MemoryBackend(max_entries=max_entries, max_tags=max_tags)
+    return QueryCache(backend, default_ttl=config.get('CACHE_DEFAULT_TTL', 300))
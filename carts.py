@@ -0,0 +1,128 @@
+"""
+Server-side shopping carts.
+
+The session cookie only carries an opaque cart id. Lines live in the carts
+collection as {"<product_id>:<size>": quantity}, so adding an item is one
+upsert with $inc and the lines keep the order they were added in. Carts of
+signed-in users also carry user_id; the anonymous cart is merged into the
+user's cart on login. A TTL index on updated_at removes abandoned carts.
+
+The products of a cart are fetched in one $in query whatever its size, so the
+cart page and checkout cost the same round trips for 1 line or 200.
+"""
+
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+CARTS = 'carts'
+SIZES = ('S', 'M', 'L', 'XL')
+# Fields the cart, checkout and stock reservation steps read from a product
+CART_PRODUCT_PROJECTION = {'name': 1, 'price': 1, 'images': {'$slice': 1}, 'stock': 1, 'category_id': 1}
+
+
+def line_key(product_id, size):
+    return f'{product_id}:{size}'
+
+
+def parse_cart_id(value):
+    return ObjectId(value) if value and ObjectId.is_valid(value) else None
+
+
+def cart_items(cart):
+    """Lines of a cart document as [{'product_id', 'size', 'quantity'}]"""
+    items = []
+    for key, quantity in ((cart or {}).get('lines') or {}).items():
+        product_id, _, size = key.partition(':')
+        items.append({'product_id': product_id, 'size': size, 'quantity': quantity})
+    return items
+
+
+def load_products(db, product_ids, projection, loaded):
+    """Fetch the products of hex ids not yet in loaded with one query; unknown ids map to None"""
+    missing = set()
+    for product_id in product_ids:
+        if product_id not in loaded:
+            if ObjectId.is_valid(product_id):
+                missing.add(ObjectId(product_id))
+            else:
+                loaded[product_id] = None
+    if missing:
+        for product in db.products.find({'_id': {'$in': list(missing)}}, projection):
+            loaded[str(product['_id'])] = product
+        for product_id in missing:
+            loaded.setdefault(str(product_id), None)
+    return loaded
+
+
+def load_cart(db, cart_id):
+    return db[CARTS].find_one({'_id': cart_id}, {'lines': 1}) if cart_id else None
+
+
+def load_user_cart(db, user_id):
+    return db[CARTS].find_one({'user_id': user_id}, {'lines': 1})
+
+
+def _increments(lines):
+    increments = {}
+    for product_id, size, quantity in lines:
+        if size not in SIZES or quantity <= 0 or not ObjectId.is_valid(str(product_id)):
+            raise ValueError(f"Invalid cart line {product_id} {size} x{quantity}")
+        field = f'lines.{line_key(product_id, size)}'
+        increments[field] = increments.get(field, 0) + quantity
+    return increments
+
+
+def _lines_update(lines):
+    update = {'$set': {'updated_at': datetime.utcnow()}}
+    increments = _increments(lines)
+    if increments:
+        update['$inc'] = increments
+    return update
+
+
+def add_lines(db, cart_id, lines):
+    """Add (product_id, size, quantity) lines, creating the cart if it expired or never existed"""
+    db[CARTS].update_one({'_id': cart_id}, _lines_update(lines), upsert=True)
+
+
+def add_user_lines(db, user_id, lines):
+    """Add lines to the user's cart, whichever device created it, creating it if they have none"""
+    update = _lines_update(lines)
+    try:
+        db[CARTS].update_one({'user_id': user_id}, update, upsert=True)
+    except DuplicateKeyError:
+        # A concurrent request created the user's cart first; user_id_unique keeps it the only one
+        db[CARTS].update_one({'user_id': user_id}, update)
+
+
+def remove_line(db, cart_id, product_id, size):
+    db[CARTS].update_one({'_id': cart_id}, {'$unset': {f'lines.{line_key(product_id, size)}': ''},
+                                            '$set': {'updated_at': datetime.utcnow()}})
+
+
+def delete_cart(db, cart_id):
+    if cart_id:
+        db[CARTS].delete_one({'_id': cart_id})
+
+
+def merge_on_login(db, cart_id, user_id):
+    """Fold the anonymous cart into the user's cart; returns the user's cart id, or None if they have no cart"""
+    anonymous = None
+    if cart_id:
+        anonymous = db[CARTS].find_one({'_id': cart_id, 'user_id': {'$exists': False}}, {'lines': 1})
+    items = cart_items(anonymous)
+    if not items:
+        existing = db[CARTS].find_one({'user_id': user_id}, {'_id': 1})
+        if anonymous:
+            delete_cart(db, anonymous['_id'])
+        return existing['_id'] if existing else None
+    cart = db[CARTS].find_one_and_update(
+        {'user_id': user_id},
+        {'$inc': _increments((item['product_id'], item['size'], item['quantity']) for item in items),
+         '$set': {'updated_at': datetime.utcnow()}},
+        projection={'_id': 1}, upsert=True, return_document=ReturnDocument.AFTER)
+    delete_cart(db, anonymous['_id'])
+    return cart['_id']
@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+"""
+Bulk catalog import from CSV or JSON.
+
+Rows are validated, categories resolved by name and products written in
+batches of unordered bulk_write upserts keyed on sku, so re-running an import
+updates products instead of duplicating them. Images named in a row are read
+from a directory or zip archive, streamed into GridFS and rendered by the
+image pipeline's process pool. Every rejected row is reported with its line
+number and reason.
+
+CSV columns: sku, name, description, price, category, colors, stock_S,
+stock_M, stock_L, stock_XL, featured, images (colors and images separated by
+'|'). JSON: a list of objects with the same keys; colors and images may be
+lists and stock may be an object keyed by size.
+
+    python catalog_import.py catalog.csv --images photos.zip [--create-categories]
+"""
+
+import argparse
+import csv
+import io
+import json
+import math
+import os
+import sys
+import threading
+import time
+import zipfile
+from datetime import datetime
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from images import GRIDFS_CHUNK_SIZE, ImagePipeline, apply_derivatives, ingest_upload
+
+SIZES = ('S', 'M', 'L', 'XL')
+MAX_ERRORS_REPORTED = 1000
+IMAGE_TYPES = {'.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.png': 'image/png',
+               '.gif': 'image/gif', '.webp': 'image/webp'}
+TRUE_VALUES = ('1', 'true', 'yes', 'y', 'on')
+
+
+class RowError(ValueError):
+    pass
+
+
+class ImageSource:
+    """Image files named by import rows, from a directory or a zip archive"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self._zip = None
+        self._members = {}
+        if path and zipfile.is_zipfile(path):
+            self._zip = zipfile.ZipFile(path)
+            for info in self._zip.infolist():
+                if not info.is_dir():
+                    # Rows may name images by their path in the archive or just the file name
+                    self._members[info.filename] = info
+                    self._members.setdefault(os.path.basename(info.filename), info)
+        elif path and not os.path.isdir(path):
+            raise ValueError(f"{path} is neither a directory nor a zip file")
+
+    def _file_path(self, name):
+        root = os.path.realpath(self.path)
+        full = os.path.realpath(os.path.join(root, name))
+        # Names must not escape the image directory
+        if os.path.commonpath([root, full]) != root or not os.path.isfile(full):
+            return None
+        return full
+
+    def exists(self, name):
+        if self._zip is not None:
+            return name in self._members
+        return bool(self.path) and self._file_path(name) is not None
+
+    def open(self, name):
+        if self._zip is not None:
+            return self._zip.open(self._members[name])
+        return open(self._file_path(name), 'rb')
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+
+
+def read_rows(stream, fmt):
+    """Yield (line number, raw row dict) from a binary CSV or JSON stream"""
+    if fmt == 'json':
+        data = json.load(stream)
+        if isinstance(data, dict):
+            data = data.get('products', [])
+        if not isinstance(data, list):
+            raise ValueError("a JSON catalog must be a list of products or {\"products\": [...]}")
+        for number, row in enumerate(data, start=1):
+            yield number, row
+        return
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    for row in reader:
+        yield reader.line_num, row
+
+
+def _split(value):
+    if value is None or value == '':
+        return []
+    if isinstance(value, list):
+        return [str(item).strip() for item in value if str(item).strip()]
+    return [part.strip() for part in str(value).split('|') if part.strip()]
+
+
+def _number(row, key, cast, required=True):
+    value = row.get(key)
+    if value is None or str(value).strip() == '':
+        if required:
+            raise RowError(f"{key} is required")
+        return cast(0)
+    try:
+        number = cast(str(value).strip())
+    except (TypeError, ValueError):
+        raise RowError(f"{key} must be a number, got {value!r}")
+    if not math.isfinite(number):
+        raise RowError(f"{key} must be a finite number, got {value!r}")
+    if number < 0:
+        raise RowError(f"{key} must not be negative")
+    return number
+
+
+def validate_row(row, categories, image_source):
+    """Return (product fields, image names) for a raw row, or raise RowError"""
+    if not isinstance(row, dict):
+        raise RowError(f"row must be an object, got {type(row).__name__}")
+    sku = str(row.get('sku') or '').strip()
+    if not sku:
+        raise RowError("sku is required")
+    name = str(row.get('name') or '').strip()
+    if not name:
+        raise RowError("name is required")
+    category = str(row.get('category') or '').strip()
+    if not category:
+        raise RowError("category is required")
+    category_id = categories.get(category.lower())
+    if category_id is None:
+        raise RowError(f"unknown category {category!r}")
+
+    stock = {}
+    for size in SIZES:
+        if isinstance(row.get('stock'), dict):
+            stock[size] = _number(row['stock'], size, int, required=False)
+        else:
+            stock[size] = _number(row, f'stock_{size}', int, required=False)
+
+    images = _split(row.get('images'))
+    missing = [image for image in images if not image_source.exists(image)]
+    if missing:
+        raise RowError(f"image not found: {', '.join(missing)}")
+    unsupported = [image for image in images if os.path.splitext(image)[1].lower() not in IMAGE_TYPES]
+    if unsupported:
+        raise RowError(f"unsupported image type: {', '.join(unsupported)}")
+
+    fields = {
+        'sku': sku,
+        'name': name,
+        'description': str(row.get('description') or '').strip(),
+        'price': _number(row, 'price', float),
+        'category_id': category_id,
+        'colors': _split(row.get('colors')),
+        'stock': stock,
+        'featured': str(row.get('featured') or '').strip().lower() in TRUE_VALUES,
+    }
+    return fields, images
+
+
+def load_categories(db, names=(), create=False):
+    """{lowercased name: _id}, optionally creating categories named by the import"""
+    categories = {c['name'].lower(): c['_id'] for c in db.categories.find({}, {'name': 1})}
+    if create:
+        # Names differing only in case are one category, created under the first spelling seen
+        missing = {}
+        for name in names:
+            name = name.strip()
+            if name and name.lower() not in categories:
+                missing.setdefault(name.lower(), name)
+        now = datetime.utcnow()
+        for key, name in sorted(missing.items()):
+            categories[key] = db.categories.insert_one(
+                {'name': name, 'description': '', 'created_at': now}).inserted_id
+    return categories
+
+
+class CatalogImporter:
+    def __init__(self, db, pipeline=None, batch_size=500, spool_dir=None,
+                 chunk_size=GRIDFS_CHUNK_SIZE, on_image_done=None, on_batch_rendered=None):
+        self.db = db
+        self.pipeline = pipeline
+        self.batch_size = batch_size
+        self.spool_dir = spool_dir
+        self.chunk_size = chunk_size
+        # Called as on_image_done(gridfs_id, result, error) from the pipeline; defaults to recording derivatives
+        self.on_image_done = on_image_done or self._record_derivatives
+        # Called once all images of a write batch are recorded, so caches are invalidated per batch, not per image
+        self.on_batch_rendered = on_batch_rendered
+        self.futures = []
+        self._lock = threading.Lock()
+        self.report = {
+            'rows': 0, 'inserted': 0, 'updated': 0, 'failed': 0,
+            'images': 0, 'images_rejected': 0, 'images_rendered': 0, 'images_failed': 0,
+            'errors': [], 'seconds': 0.0, 'rows_per_second': 0.0,
+        }
+
+    def _error(self, line, sku, message, counter='failed'):
+        self.report[counter] += 1
+        if len(self.report['errors']) < MAX_ERRORS_REPORTED:
+            self.report['errors'].append({'line': line, 'sku': sku, 'error': message})
+
+    def _record_derivatives(self, gridfs_id, result, error):
+        with self._lock:
+            self.report['images_failed' if error else 'images_rendered'] += 1
+        if error:
+            print(f"❌ Image {gridfs_id}: {error}")
+            self.db.products.update_one({'images.gridfs_id': gridfs_id}, {'$set': {'images.$.status': 'failed'}})
+        else:
+            apply_derivatives(self.db, gridfs_id, result)
+
+    def run(self, rows, image_source, create_categories=False):
+        """Import (line, raw row) pairs; returns the report"""
+        started = time.perf_counter()
+        rows = list(rows) if create_categories else rows
+        names = ([str(row.get('category') or '') for _, row in rows if isinstance(row, dict)]
+                 if create_categories else ())
+        categories = load_categories(self.db, names, create=create_categories)
+        seen = set()
+        batch = []
+        for line, raw in rows:
+            self.report['rows'] += 1
+            try:
+                fields, images = validate_row(raw, categories, image_source)
+            except RowError as e:
+                sku = str(raw.get('sku') or '') if isinstance(raw, dict) else ''
+                self._error(line, sku or None, str(e))
+                continue
+            if fields['sku'] in seen:
+                self._error(line, fields['sku'], "duplicate sku in this file")
+                continue
+            seen.add(fields['sku'])
+            batch.append((line, fields, images))
+            if len(batch) >= self.batch_size:
+                self._write_batch(batch, image_source)
+                batch = []
+        if batch:
+            self._write_batch(batch, image_source)
+
+        elapsed = time.perf_counter() - started
+        self.report['seconds'] = round(elapsed, 2)
+        self.report['rows_per_second'] = round(self.report['rows'] / elapsed, 1) if elapsed else 0.0
+        return self.report
+
+    def _write_batch(self, batch, image_source):
+        now = datetime.utcnow()
+        ops = [UpdateOne({'sku': fields['sku']},
+                         {'$set': dict(fields, updated_at=now),
+                          '$setOnInsert': {'images': [], 'created_at': now}},
+                         upsert=True)
+               for _, fields, _ in batch]
+        failed = set()
+        try:
+            result = self.db.products.bulk_write(ops, ordered=False)
+            details = result.bulk_api_result
+        except BulkWriteError as e:
+            details = e.details
+            for write_error in details['writeErrors']:
+                line, fields, _ = batch[write_error['index']]
+                failed.add(write_error['index'])
+                self._error(line, fields['sku'], write_error.get('errmsg', 'write failed'))
+        upserted = {upsert['index'] for upsert in details.get('upserted', [])}
+        self.report['inserted'] += len(upserted)
+        self.report['updated'] += len(batch) - len(upserted) - len(failed)
+
+        with_images = [(line, fields, images) for i, (line, fields, images) in enumerate(batch)
+                       if images and i not in failed]
+        if with_images:
+            self._import_images(with_images, image_source)
+
+    def _import_images(self, batch, image_source):
+        products = {p['sku']: p for p in self.db.products.find(
+            {'sku': {'$in': [fields['sku'] for _, fields, _ in batch]}},
+            {'sku': 1, 'images.source_name': 1})}
+        pushes = []
+        pending = []
+        for line, fields, images in batch:
+            product = products.get(fields['sku'])
+            if product is None:
+                continue
+            # Images already imported for this product under the same name are kept, not duplicated
+            existing = {image.get('source_name') for image in product.get('images', [])}
+            entries = []
+            for name in images:
+                if name in existing:
+                    continue
+                try:
+                    with image_source.open(name) as stream:
+                        gridfs_id, spool_path = ingest_upload(
+                            self.db, stream, os.path.basename(name),
+                            IMAGE_TYPES[os.path.splitext(name)[1].lower()],
+                            spool_dir=self.spool_dir, chunk_size=self.chunk_size)
+                except Exception as e:
+                    self._error(line, fields['sku'], f"image {name}: {e}", counter='images_rejected')
+                    continue
+                entries.append({
+                    'filename': os.path.basename(name),
+                    'source_name': name,
+                    'gridfs_id': gridfs_id,
+                    'local_path': None,
+                    'public_url': f'/image/{gridfs_id}',
+                    'status': 'processing',
+                })
+                pending.append((gridfs_id, spool_path))
+            if entries:
+                pushes.append(UpdateOne({'_id': product['_id']}, {'$push': {'images': {'$each': entries}}}))
+                self.report['images'] += len(entries)
+        if pushes:
+            self.db.products.bulk_write(pushes, ordered=False)
+        if self.pipeline is None:
+            for _, spool_path in pending:
+                os.remove(spool_path)
+            return
+        remaining = [len(pending)]
+
+        def done(gridfs_id, result, error):
+            try:
+                self.on_image_done(gridfs_id, result, error)
+            finally:
+                with self._lock:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                if last and self.on_batch_rendered is not None:
+                    self.on_batch_rendered()
+
+        for gridfs_id, spool_path in pending:
+            self.futures.append(self.pipeline.submit(
+                gridfs_id, spool_path, lambda result, error, gridfs_id=gridfs_id: done(gridfs_id, result, error)))
+
+
+def detect_format(filename):
+    return 'json' if filename.lower().endswith('.json') else 'csv'
+
+
+def main():
+    from concurrent.futures import wait
+    from pymongo import MongoClient
+    from cache import create_cache
+    from config import Config
+    from stats import bump_stats
+
+    parser = argparse.ArgumentParser(description='Bulk catalog import')
+    parser.add_argument('catalog', help='CSV or JSON file')
+    parser.add_argument('--images', help='directory or zip archive holding the images named by rows')
+    parser.add_argument('--format', choices=('csv', 'json'))
+    parser.add_argument('--create-categories', action='store_true', help='create categories that do not exist')
+    parser.add_argument('--batch-size', type=int, default=Config.IMPORT_BATCH_SIZE)
+    parser.add_argument('--workers', type=int, default=Config.IMAGE_WORKERS)
+    parser.add_argument('--errors', help='write rejected rows to this CSV file')
+    args = parser.parse_args()
+
+    client = MongoClient(Config.MONGODB_URI)
+    db = client.get_database()
+    # Shared (sqlite) caches drop cached listings and pages; in-process caches expire by TTL
+    cache = create_cache({key: getattr(Config, key) for key in dir(Config) if key.isupper()})
+    image_source = ImageSource(args.images)
+    pipeline = ImagePipeline(Config.UPLOAD_FOLDER, Config.IMAGE_DERIVATIVES,
+                             Config.IMAGE_PUBLIC_PREFIX, workers=args.workers)
+    try:
+        importer = CatalogImporter(db, pipeline, batch_size=args.batch_size,
+                                   spool_dir=Config.IMAGE_SPOOL_DIR, chunk_size=Config.GRIDFS_CHUNK_SIZE,
+                                   on_batch_rendered=lambda: cache.invalidate('products'))
+        try:
+            with open(args.catalog, 'rb') as stream:
+                report = importer.run(read_rows(stream, args.format or detect_format(args.catalog)),
+                                      image_source, create_categories=args.create_categories)
+        except (ValueError, UnicodeDecodeError) as e:
+            print(f"❌ Could not read {args.catalog}: {e}")
+            return 1
+        print(f"✅ {report['rows']} rows: {report['inserted']} inserted, {report['updated']} updated, "
+              f"{report['failed']} rejected in {report['seconds']}s ({report['rows_per_second']} rows/s)")
+        bump_stats(db, products=report['inserted'])
+        cache.invalidate(*(('products', 'categories') if args.create_categories else ('products',)))
+        if importer.futures:
+            print(f"🖼️  Rendering {len(importer.futures)} images with {args.workers} workers...")
+            rendering_started = time.perf_counter()
+            wait(importer.futures)
+            elapsed = time.perf_counter() - rendering_started
+            print(f"✅ {report['images_rendered']} images rendered, {report['images_failed']} failed "
+                  f"in {elapsed:.1f}s ({report['images_rendered'] / elapsed if elapsed else 0:.1f} images/s)")
+        for error in report['errors'][:20]:
+            print(f"❌ line {error['line']} sku {error['sku']}: {error['error']}")
+        if args.errors and report['errors']:
+            with open(args.errors, 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=['line', 'sku', 'error'])
+                writer.writeheader()
+                writer.writerows(report['errors'])
+            print(f"   Rejected rows written to {args.errors}")
+    finally:
+        pipeline.shutdown()
+        image_source.close()
+        client.close()
+    return 1 if report['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,295 @@
+"""
+In-process faceted index over the product catalog.
+
+Every category, colour and in-stock size has a posting bitmap (a Python int
+with one bit per document slot), so filtering is a handful of big-int ANDs and
+a facet count is one bit_count(). Prices are split into quantile buckets with
+cumulative prefix bitmaps: a price range is one XOR plus a scan of the two edge
+buckets. Two slot lists ordered by price and by created_at serve the keyset
+pages without sorting the whole result.
+
+Edited products get a fresh slot and their old slot is marked dead; the index
+compacts itself once a quarter of the slots are dead. $text search is not
+handled here, callers fall back to Mongo for it.
+"""
+
+import bisect
+import threading
+from datetime import datetime
+
+SIZES = ('S', 'M', 'L', 'XL')
+INDEX_PROJECTION = {'category_id': 1, 'colors': 1, 'stock': 1, 'price': 1, 'created_at': 1}
+PRICE_BUCKETS = 256
+# Results at most this large are sorted directly instead of walking a sort order
+SMALL_RESULT = 2048
+EPOCH = datetime(1970, 1, 1)
+
+
+def _bitmap(slots):
+    """Bitmap with the given slot numbers set"""
+    slots = list(slots)
+    if not slots:
+        return 0
+    buf = bytearray((max(slots) >> 3) + 1)
+    for slot in slots:
+        buf[slot >> 3] |= 1 << (slot & 7)
+    return int.from_bytes(buf, 'little')
+
+
+def _slots(bits):
+    """Slot numbers set in a bitmap, ascending"""
+    # str.find skips runs of unset bits at C speed
+    digits = bin(bits)[:1:-1]
+    slots = []
+    i = digits.find('1')
+    while i >= 0:
+        slots.append(i)
+        i = digits.find('1', i + 1)
+    return slots
+
+
+def _normalize(doc):
+    """Reduce a product document to the tuple the index stores per slot"""
+    stock = doc.get('stock') or {}
+    sizes = tuple(size for size in SIZES if (stock.get(size) or 0) > 0)
+    category = str(doc['category_id']) if doc.get('category_id') is not None else None
+    return (doc['_id'], category, tuple(doc.get('colors') or ()), sizes,
+            float(doc.get('price') or 0), doc.get('created_at') or EPOCH)
+
+
+class CatalogIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.ready = False
+        # Cache tag version of the catalog this index reflects
+        self.version = None
+        self.built_at = None
+        self._clear()
+
+    def _clear(self):
+        self._rows = []          # slot -> normalized product tuple
+        self._slot_of = {}       # ObjectId -> live slot
+        self._alive = 0
+        self._dead = 0
+        self._categories = {}
+        self._colors = {}
+        self._sizes = {}
+        self._by_price = []      # slots ordered by (price, _id)
+        self._by_created = []    # slots ordered by (created_at, _id)
+        self._price_cuts = []
+        self._bucket_prices = [[]]  # bucket -> sorted prices
+        self._bucket_slots = [[]]   # bucket -> slots aligned with _bucket_prices
+        self._price_prefix = [0, 0]  # prefix[i] = bitmap of buckets < i
+
+    def _price_key(self, slot):
+        row = self._rows[slot]
+        return (row[4], row[0])
+
+    def _created_key(self, slot):
+        row = self._rows[slot]
+        return (row[5], row[0])
+
+    def build(self, products, version=None):
+        """Replace the index contents with the given product documents"""
+        rows = [_normalize(doc) for doc in products]
+        self._load(rows)
+        self.version = version
+        self.built_at = datetime.utcnow()
+        self.ready = True
+
+    def _load(self, rows):
+        categories, colors, sizes = {}, {}, {}
+        for slot, row in enumerate(rows):
+            if row[1] is not None:
+                categories.setdefault(row[1], []).append(slot)
+            for color in row[2]:
+                colors.setdefault(color, []).append(slot)
+            for size in row[3]:
+                sizes.setdefault(size, []).append(slot)
+
+        by_price = sorted(range(len(rows)), key=lambda slot: (rows[slot][4], rows[slot][0]))
+        by_created = sorted(range(len(rows)), key=lambda slot: (rows[slot][5], rows[slot][0]))
+
+        # Quantile cut points so buckets start out evenly filled
+        step = max(1, len(rows) // PRICE_BUCKETS)
+        cuts = sorted({rows[by_price[i]][4] for i in range(step, len(by_price), step)})
+        bucket_prices = [[] for _ in range(len(cuts) + 1)]
+        bucket_slots = [[] for _ in range(len(cuts) + 1)]
+        for slot in by_price:
+            bucket = bisect.bisect_right(cuts, rows[slot][4])
+            bucket_prices[bucket].append(rows[slot][4])
+            bucket_slots[bucket].append(slot)
+        prefix = [0]
+        for slots in bucket_slots:
+            prefix.append(prefix[-1] | _bitmap(slots))
+
+        with self._lock:
+            self._clear()
+            self._rows = rows
+            self._slot_of = {row[0]: slot for slot, row in enumerate(rows)}
+            self._alive = (1 << len(rows)) - 1
+            self._categories = {key: _bitmap(slots) for key, slots in categories.items()}
+            self._colors = {key: _bitmap(slots) for key, slots in colors.items()}
+            self._sizes = {key: _bitmap(slots) for key, slots in sizes.items()}
+            self._by_price = by_price
+            self._by_created = by_created
+            self._price_cuts = cuts
+            self._bucket_prices = bucket_prices
+            self._bucket_slots = bucket_slots
+            self._price_prefix = prefix
+
+    def upsert(self, doc):
+        """Add a product, or replace the entry of one already indexed"""
+        row = _normalize(doc)
+        with self._lock:
+            self._kill(row[0])
+            slot = len(self._rows)
+            bit = 1 << slot
+            self._rows.append(row)
+            self._slot_of[row[0]] = slot
+            self._alive |= bit
+            if row[1] is not None:
+                self._categories[row[1]] = self._categories.get(row[1], 0) | bit
+            for color in row[2]:
+                self._colors[color] = self._colors.get(color, 0) | bit
+            for size in row[3]:
+                self._sizes[size] = self._sizes.get(size, 0) | bit
+            bisect.insort(self._by_price, slot, key=self._price_key)
+            bisect.insort(self._by_created, slot, key=self._created_key)
+            bucket = bisect.bisect_right(self._price_cuts, row[4])
+            i = bisect.bisect_right(self._bucket_prices[bucket], row[4])
+            self._bucket_prices[bucket].insert(i, row[4])
+            self._bucket_slots[bucket].insert(i, slot)
+            for i in range(bucket + 1, len(self._price_prefix)):
+                self._price_prefix[i] |= bit
+
+    def remove(self, product_id):
+        with self._lock:
+            self._kill(product_id)
+
+    def _kill(self, product_id):
+        slot = self._slot_of.pop(product_id, None)
+        if slot is None:
+            return
+        self._alive &= ~(1 << slot)
+        self._dead += 1
+        if self._dead * 4 > len(self._rows):
+            self._load([self._rows[s] for s in sorted(self._slot_of.values())])
+
+    def __len__(self):
+        return len(self._slot_of)
+
+    def _price_bits(self, min_price, max_price):
+        lo = float('-inf') if min_price is None else min_price
+        hi = float('inf') if max_price is None else max_price
+        lo_bucket = bisect.bisect_right(self._price_cuts, lo)
+        hi_bucket = bisect.bisect_right(self._price_cuts, hi)
+        bits = 0
+        if hi_bucket > lo_bucket + 1:
+            # Buckets strictly between the edges lie entirely inside the range
+            bits = self._price_prefix[hi_bucket] ^ self._price_prefix[lo_bucket + 1]
+        for bucket in {lo_bucket, hi_bucket}:
+            prices, slots = self._bucket_prices[bucket], self._bucket_slots[bucket]
+            start, end = bisect.bisect_left(prices, lo), bisect.bisect_right(prices, hi)
+            if (end - start) * 2 > len(slots):
+                # Cheaper to knock the excluded slots out of the whole bucket
+                whole = self._price_prefix[bucket + 1] ^ self._price_prefix[bucket]
+                bits |= whole ^ _bitmap(slots[:start] + slots[end:])
+            else:
+                bits |= _bitmap(slots[start:end])
+        return bits
+
+    def _constraints(self, category=None, color=None, size=None, min_price=None, max_price=None):
+        constraints = {}
+        if category:
+            constraints['category'] = self._categories.get(category, 0)
+        if color:
+            constraints['color'] = self._colors.get(color, 0)
+        if size:
+            constraints['size'] = self._sizes.get(size, 0)
+        if min_price is not None or max_price is not None:
+            constraints['price'] = self._price_bits(min_price, max_price)
+        return constraints
+
+    def _combine(self, constraints, exclude=None):
+        bits = self._alive
+        for dimension, posting in constraints.items():
+            if dimension != exclude:
+                bits &= posting
+        return bits
+
+    def match(self, **filters):
+        """Bitmap of live products matching the filters"""
+        with self._lock:
+            return self._combine(self._constraints(**filters))
+
+    def query(self, **filters):
+        """Matching bitmap plus facet counts, each facet computed without its own filter"""
+        with self._lock:
+            constraints = self._constraints(**filters)
+            facets = {}
+            for dimension, postings in (('category', self._categories),
+                                        ('color', self._colors),
+                                        ('size', self._sizes)):
+                base = self._combine(constraints, exclude=dimension)
+                facets[dimension] = {}
+                for value, posting in postings.items():
+                    n = (base & posting).bit_count()
+                    if n:
+                        facets[dimension][value] = n
+            return self._combine(constraints), facets
+
+    def search(self, sort, after, limit, **filters):
+        """(product ids of one page, facet counts) for the filters, read from one state of the index
+
+        Slots are renumbered by rebuilds and compactions, so a bitmap from
+        query() is only valid for page() under the same lock.
+        """
+        with self._lock:
+            bits, facets = self.query(**filters)
+            ids = self.page(bits, sort, after, limit,
+                            min_price=filters.get('min_price'), max_price=filters.get('max_price'))
+            return ids, facets
+
+    def page(self, bits, sort, after, limit, min_price=None, max_price=None):
+        """Product ids of up to limit matches after the keyset values, in the named sort order"""
+        with self._lock:
+            if sort in ('price_asc', 'price_desc'):
+                order, key = self._by_price, self._price_key
+            else:
+                order, key = self._by_created, self._created_key
+            descending = sort != 'price_asc'
+            after_key = None
+            if after is not None:
+                value = after[0]
+                if isinstance(value, datetime) and value.tzinfo is not None:
+                    # Cursors decode as aware UTC datetimes, the index stores Mongo's naive UTC
+                    value = value.replace(tzinfo=None) - value.utcoffset()
+                after_key = (value, after[1])
+
+            if bits.bit_count() <= SMALL_RESULT:
+                slots = sorted(_slots(bits), key=key, reverse=descending)
+                if after_key is not None:
+                    slots = [s for s in slots if (key(s) < after_key if descending else key(s) > after_key)]
+                return [self._rows[s][0] for s in slots[:limit]]
+
+            buf = bits.to_bytes((len(self._rows) + 7) >> 3, 'little')
+            price = lambda slot: self._rows[slot][4]
+            if descending:
+                start = len(order) - 1 if after_key is None else bisect.bisect_left(order, after_key, key=key) - 1
+                if sort == 'price_desc' and max_price is not None:
+                    start = min(start, bisect.bisect_right(order, max_price, key=price) - 1)
+                positions = range(start, -1, -1)
+            else:
+                start = 0 if after_key is None else bisect.bisect_right(order, after_key, key=key)
+                if min_price is not None:
+                    start = max(start, bisect.bisect_left(order, min_price, key=price))
+                positions = range(start, len(order))
+            ids = []
+            for pos in positions:
+                slot = order[pos]
+                if buf[slot >> 3] >> (slot & 7) & 1:
+                    ids.append(self._rows[slot][0])
+                    if len(ids) == limit:
+                        break
+            return ids
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -9,6 +10,33 @@ class Config:
     UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER') or 'static/images/products'
     MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', 16 * 1024 * 1024))  # 16MB
     ALLOWED_EXTENSIONS = os.environ.get('ALLOWED_EXTENSIONS', 'png,jpg,jpeg,gif,webp').split(',')
+    PRODUCTS_PER_PAGE = int(os.environ.get('PRODUCTS_PER_PAGE', 24))
+    ADMIN_ORDERS_PER_PAGE = int(os.environ.get('ADMIN_ORDERS_PER_PAGE', 50))
+    # Products written per bulk_write by the catalog import
+    IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 500))
+    # Documents fetched per cursor batch by the streaming exports
+    EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+    # In-process faceted catalog index for /products filters (rebuilt after CATALOG_INDEX_MAX_AGE seconds)
+    CATALOG_INDEX_ENABLED = os.environ.get('CATALOG_INDEX_ENABLED', 'true').lower() == 'true'
+    CATALOG_INDEX_MAX_AGE = int(os.environ.get('CATALOG_INDEX_MAX_AGE', 300))
+    # In-process prefix index behind /api/suggest, ranked by units sold over the last TYPEAHEAD_POPULARITY_DAYS
+    TYPEAHEAD_ENABLED = os.environ.get('TYPEAHEAD_ENABLED', 'true').lower() == 'true'
+    TYPEAHEAD_MAX_AGE = int(os.environ.get('TYPEAHEAD_MAX_AGE', 900))
+    TYPEAHEAD_POPULARITY_DAYS = int(os.environ.get('TYPEAHEAD_POPULARITY_DAYS', 90))
+
+    # Image derivatives rendered as JPEG and WebP by a process pool: name:longest-edge pairs
+    IMAGE_DERIVATIVES = {
+        name.strip(): int(edge)
+        for name, edge in (part.split(':') for part in
+                           os.environ.get('IMAGE_DERIVATIVES', 'thumbnail:160,listing:400,detail:800,zoom:1600').split(','))
+    }
+    IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', os.cpu_count() or 1))
+    IMAGE_PUBLIC_PREFIX = os.environ.get('IMAGE_PUBLIC_PREFIX', '/static/images/products')
+    IMAGE_SPOOL_DIR = os.environ.get('IMAGE_SPOOL_DIR') or None  # None: system temp dir
+    # Uploads are streamed into GridFS in chunks of this size
+    GRIDFS_CHUNK_SIZE = int(os.environ.get('GRIDFS_CHUNK_SIZE', 255 * 1024))
+    # Browser/proxy cache lifetime for /image responses; stored files are immutable
+    IMAGE_CACHE_MAX_AGE = int(os.environ.get('IMAGE_CACHE_MAX_AGE', 365 * 24 * 3600))
 
     # Ensure upload folder exists
     if not os.path.exists(UPLOAD_FOLDER):
@@ -21,3 +49,56 @@ class Config:
     SMTP_PASSWORD = os.environ.get('SMTP_PASSWORD', '')
     SMTP_USE_TLS = os.environ.get('SMTP_USE_TLS', 'true').lower() == 'true'
     SMTP_FROM = os.environ.get('SMTP_FROM', os.environ.get('SMTP_USER', ''))
+    # Compiled email templates kept per process; set a directory to also cache bytecode on disk
+    EMAIL_TEMPLATE_CACHE_SIZE = int(os.environ.get('EMAIL_TEMPLATE_CACHE_SIZE', 50))
+    EMAIL_TEMPLATE_BYTECODE_CACHE_DIR = os.environ.get('EMAIL_TEMPLATE_BYTECODE_CACHE_DIR', '')
+    # starttls | ssl | plain (plain is for local SMTP stand-ins)
+    SMTP_SECURITY = os.environ.get('SMTP_SECURITY') or ('starttls' if SMTP_USE_TLS else 'ssl')
+
+    # Email outbox delivery workers (python mailer.py worker)
+    SMTP_POOL_SIZE = int(os.environ.get('SMTP_POOL_SIZE', 4))
+    EMAIL_BATCH_SIZE = int(os.environ.get('EMAIL_BATCH_SIZE', 50))
+    EMAIL_MAX_ATTEMPTS = int(os.environ.get('EMAIL_MAX_ATTEMPTS', 6))
+    EMAIL_RETRY_BASE_SECONDS = int(os.environ.get('EMAIL_RETRY_BASE_SECONDS', 30))
+
+    # Prometheus metrics on /metrics (Authorization: Bearer METRICS_TOKEN, or an admin session).
+    # With several worker processes set METRICS_DIR to a directory they share on the host.
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+    METRICS_DIR = os.environ.get('METRICS_DIR', '')
+    METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 1))
+
+    # Per-request Mongo command tracing (Server-Timing header, /admin/mongo report)
+    MONGO_INSTRUMENTATION = os.environ.get('MONGO_INSTRUMENTATION', 'true').lower() == 'true'
+    # JSON overrides of the transactional/catalog/admin-reports client options; see mongo_profiles.py
+    MONGO_PROFILES = os.environ.get('MONGO_PROFILES', '')
+    SERVER_TIMING_HEADER = os.environ.get('SERVER_TIMING_HEADER', 'true').lower() == 'true'
+    # Identical query shapes repeated this often in one request are reported as N+1
+    MONGO_N_PLUS_ONE_THRESHOLD = int(os.environ.get('MONGO_N_PLUS_ONE_THRESHOLD', 3))
+
+    # Create missing indexes from indexes.py in a background thread when the app starts
+    INDEXES_ON_STARTUP = os.environ.get('INDEXES_ON_STARTUP', 'true').lower() == 'true'
+
+    # Calendar days of the sales analytics rollups are cut in this timezone
+    ANALYTICS_TIMEZONE = os.environ.get('ANALYTICS_TIMEZONE', 'Asia/Kolkata')
+    # Frequently bought together job (recommendations.py); its matrix and watermark live in the directory
+    RECOMMENDATIONS_DIR = os.environ.get('RECOMMENDATIONS_DIR', os.path.join(tempfile.gettempdir(), 'fashionstore-recommendations'))
+    RECOMMENDATIONS_TOP_K = int(os.environ.get('RECOMMENDATIONS_TOP_K', 12))
+    RECOMMENDATIONS_MIN_SUPPORT = int(os.environ.get('RECOMMENDATIONS_MIN_SUPPORT', 2))
+    # Seconds before the watermark a refresh re-reads, for orders saved after newer ones
+    RECOMMENDATIONS_OVERLAP = int(os.environ.get('RECOMMENDATIONS_OVERLAP', 600))
+
+    # Query result cache (memory | sqlite | none); sqlite is shared by all workers on the host
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memory')
+    CACHE_DEFAULT_TTL = int(os.environ.get('CACHE_DEFAULT_TTL', 300))
+    CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 1024))
+    # Invalidation tags kept per backend; the least recently invalidated are dropped past this
+    CACHE_MAX_TAGS = int(os.environ.get('CACHE_MAX_TAGS', 10000))
+    CACHE_SQLITE_PATH = os.environ.get('CACHE_SQLITE_PATH', os.path.join(tempfile.gettempdir(), 'fashionstore-cache.sqlite3'))
+    # Full pages (home, product detail) for anonymous visitors, stored in the CACHE_BACKEND.
+    # Pages are re-rendered in the background once older than the TTL, and evicted at once by admin writes.
+    PAGE_CACHE_ENABLED = os.environ.get('PAGE_CACHE_ENABLED', 'true').lower() == 'true'
+    PAGE_CACHE_TTL = int(os.environ.get('PAGE_CACHE_TTL', 60))
+    PAGE_CACHE_STALE_TTL = int(os.environ.get('PAGE_CACHE_STALE_TTL', 300))
+    # Per-process cache of logged-in users for Flask-Login; each request checks the user's auth_version first
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 1024))
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 60))
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Streaming CSV / NDJSON exports of orders, users and products.
+
+Documents are read through a server-side cursor in batches, turned into rows
+one at a time and written out in ~64KB chunks, optionally gzip-compressed on
+the fly, so memory use does not depend on the collection size. Exports run
+in _id order and the since/until filters are _id ranges built from the
+timestamp every ObjectId carries, so incremental pulls use the _id index on
+every collection.
+
+    python exports.py orders --format csv --since 2025-01-01 --gzip -o orders.csv.gz
+"""
+
+import argparse
+import csv
+import io
+import json
+import sys
+import zlib
+from datetime import datetime, timezone
+
+from bson import ObjectId
+
+FORMATS = ('csv', 'ndjson')
+CHUNK_SIZE = 64 * 1024
+SIZES = ('S', 'M', 'L', 'XL')
+
+
+def _iso(value):
+    if not isinstance(value, datetime):
+        return value
+    if value.tzinfo is None:
+        # Mongo returns naive UTC datetimes
+        value = value.replace(tzinfo=timezone.utc)
+    return value.isoformat()
+
+
+def _str(value):
+    return str(value) if value is not None else None
+
+
+def _order_row(doc):
+    address = doc.get('shipping_address') or {}
+    items = [{
+        'product_id': _str(item.get('product_id')),
+        'name': item.get('name'),
+        'size': item.get('size'),
+        'quantity': item.get('quantity'),
+        'price': item.get('price'),
+    } for item in doc.get('items') or []]
+    return {
+        '_id': str(doc['_id']),
+        'created_at': _iso(doc.get('created_at')),
+        'user_id': _str(doc.get('user_id')),
+        'status': doc.get('status'),
+        'total_amount': doc.get('total_amount'),
+        'payment_method': doc.get('payment_method'),
+        'item_count': sum(int(item.get('quantity') or 0) for item in items),
+        'customer_name': address.get('name'),
+        'city': address.get('city'),
+        'postal_code': address.get('postal_code'),
+        'items': items,
+    }
+
+
+def _user_row(doc):
+    return {
+        '_id': str(doc['_id']),
+        'created_at': _iso(doc.get('created_at')),
+        'username': doc.get('username'),
+        'email': doc.get('email'),
+        'role': doc.get('role'),
+    }
+
+
+def _product_row(doc):
+    stock = doc.get('stock') or {}
+    row = {
+        '_id': str(doc['_id']),
+        'created_at': _iso(doc.get('created_at')),
+        'name': doc.get('name'),
+        'price': doc.get('price'),
+        'category_id': _str(doc.get('category_id')),
+        'colors': doc.get('colors') or [],
+        'featured': bool(doc.get('featured')),
+    }
+    for size in SIZES:
+        row[f'stock_{size}'] = stock.get(size, 0)
+    return row
+
+
+# collection -> (projection, row builder, CSV columns)
+EXPORTS = {
+    'orders': (
+        {'created_at': 1, 'user_id': 1, 'status': 1, 'total_amount': 1, 'payment_method': 1,
+         'shipping_address.name': 1, 'shipping_address.city': 1, 'shipping_address.postal_code': 1,
+         'items.product_id': 1, 'items.name': 1, 'items.size': 1, 'items.quantity': 1, 'items.price': 1},
+        _order_row,
+        ['_id', 'created_at', 'user_id', 'status', 'total_amount', 'payment_method', 'item_count',
+         'customer_name', 'city', 'postal_code', 'items'],
+    ),
+    # Password hashes never leave the database
+    'users': (
+        {'created_at': 1, 'username': 1, 'email': 1, 'role': 1},
+        _user_row,
+        ['_id', 'created_at', 'username', 'email', 'role'],
+    ),
+    'products': (
+        {'created_at': 1, 'name': 1, 'price': 1, 'category_id': 1, 'colors': 1, 'featured': 1, 'stock': 1},
+        _product_row,
+        ['_id', 'created_at', 'name', 'price', 'category_id', 'colors', 'featured']
+        + [f'stock_{size}' for size in SIZES],
+    ),
+}
+
+
+def parse_timestamp(value):
+    """YYYY-MM-DD or ISO 8601 datetime, read as UTC when no offset is given"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def id_range(since=None, until=None):
+    """_id filter for documents created in [since, until)"""
+    bounds = {}
+    if since is not None:
+        bounds['$gte'] = ObjectId.from_datetime(since)
+    if until is not None:
+        bounds['$lt'] = ObjectId.from_datetime(until)
+    return {'_id': bounds} if bounds else {}
+
+
+def export_rows(db, collection, since=None, until=None, batch_size=1000):
+    projection, build_row, _ = EXPORTS[collection]
+    cursor = db[collection].find(id_range(since, until), projection, batch_size=batch_size).sort('_id', 1)
+    try:
+        for doc in cursor:
+            yield build_row(doc)
+    finally:
+        # Also runs when a client disconnects mid-download and the generator is closed
+        cursor.close()
+
+
+def csv_lines(rows, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow([
+            json.dumps(value) if isinstance(value, (list, dict)) else value
+            for value in (row.get(column) for column in columns)
+        ])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(row, separators=(',', ':'), default=str) + '\n'
+
+
+def _chunked(lines, size=CHUNK_SIZE):
+    """Join text lines into UTF-8 byte chunks of roughly size bytes"""
+    parts = []
+    length = 0
+    for line in lines:
+        data = line.encode('utf-8')
+        parts.append(data)
+        length += len(data)
+        if length >= size:
+            yield b''.join(parts)
+            parts = []
+            length = 0
+    if parts:
+        yield b''.join(parts)
+
+
+def _gzipped(chunks, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_export(db, collection, fmt='csv', since=None, until=None, gzip=False, batch_size=1000):
+    """Iterator of byte chunks holding the whole export"""
+    if collection not in EXPORTS:
+        raise ValueError(f"Unknown export {collection!r}")
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}")
+    rows = export_rows(db, collection, since, until, batch_size)
+    lines = csv_lines(rows, EXPORTS[collection][2]) if fmt == 'csv' else ndjson_lines(rows)
+    chunks = _chunked(lines)
+    return _gzipped(chunks) if gzip else chunks
+
+
+def export_filename(collection, fmt, gzip=False):
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    return f"{collection}-{stamp}.{fmt}{'.gz' if gzip else ''}"
+
+
+def main():
+    from pymongo import MongoClient
+    from config import Config
+
+    parser = argparse.ArgumentParser(description='Export orders, users or products')
+    parser.add_argument('collection', choices=sorted(EXPORTS))
+    parser.add_argument('--format', choices=FORMATS, default='csv')
+    parser.add_argument('--since', help='created at or after (YYYY-MM-DD or ISO datetime, UTC)')
+    parser.add_argument('--until', help='created before (YYYY-MM-DD or ISO datetime, UTC)')
+    parser.add_argument('--gzip', action='store_true')
+    parser.add_argument('--batch-size', type=int, default=Config.EXPORT_BATCH_SIZE)
+    parser.add_argument('-o', '--output', help='file to write (default: stdout)')
+    args = parser.parse_args()
+
+    client = MongoClient(Config.MONGODB_URI)
+    out = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    try:
+        for chunk in stream_export(client.get_database(), args.collection, args.format,
+                                   parse_timestamp(args.since), parse_timestamp(args.until),
+                                   gzip=args.gzip, batch_size=args.batch_size):
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+        client.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
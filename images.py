@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Product image derivative pipeline.
+
+Originals live in GridFS. A process pool decodes each original once and writes
+a configurable set of resized derivatives (thumbnail, listing, detail, zoom)
+as JPEG and WebP. Derivative filenames carry the GridFS id of their original
+and a hash of their content, so they never change in place, can be cached
+forever, and belong to one product image even when two products were given the
+same picture (deleting one product never removes the other's files).
+
+Regenerate the derivatives of the whole catalog with:
+    python images.py regenerate [--workers N]
+"""
+
+import argparse
+import hashlib
+import io
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+
+from bson import ObjectId
+from PIL import Image, ImageOps
+
+# GridFS default chunk size, kept under the 256KB that fits several chunks per batch
+GRIDFS_CHUNK_SIZE = 255 * 1024
+
+# (format key, Pillow format, extension, save options)
+OUTPUT_FORMATS = (
+    ('jpeg', 'JPEG', '.jpg', {'quality': 85, 'optimize': True, 'progressive': True}),
+    ('webp', 'WEBP', '.webp', {'quality': 80, 'method': 4}),
+)
+
+
+def _write_once(path, data):
+    # Content-hashed names never change, so an existing file is already correct
+    if os.path.exists(path):
+        return
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def render_derivatives(source_path, output_dir, sizes, public_prefix, file_id):
+    """Decode one original and write all of its derivatives; runs in a pool worker"""
+    started = time.perf_counter()
+    with Image.open(source_path) as original:
+        img = ImageOps.exif_transpose(original)
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+
+        derivatives = {}
+        # Largest first, each size resampled from the previous one instead of the full original
+        for name, edge in sorted(sizes.items(), key=lambda item: item[1], reverse=True):
+            if img.width > edge or img.height > edge:
+                img = img.copy()
+                img.thumbnail((edge, edge), Image.Resampling.LANCZOS)
+            entry = {'width': img.width, 'height': img.height}
+            for key, pil_format, extension, options in OUTPUT_FORMATS:
+                buffer = io.BytesIO()
+                img.save(buffer, pil_format, **options)
+                data = buffer.getvalue()
+                filename = f"{file_id}_{hashlib.sha256(data).hexdigest()[:20]}_{name}{extension}"
+                _write_once(os.path.join(output_dir, filename), data)
+                entry[key] = f"{public_prefix}/{filename}"
+                entry[f'{key}_path'] = os.path.join(output_dir, filename)
+            derivatives[name] = entry
+
+    return {'derivatives': derivatives, 'seconds': time.perf_counter() - started}
+
+
+def derivative_paths(image):
+    """Local files written for one product image entry"""
+    paths = [entry[f'{key}_path'] for entry in (image.get('derivatives') or {}).values()
+             for key, _, _, _ in OUTPUT_FORMATS if entry.get(f'{key}_path')]
+    if image.get('local_path'):
+        paths.append(image['local_path'])
+    return paths
+
+
+def apply_derivatives(db, gridfs_id, result, primary='detail'):
+    """Record finished derivatives on the product image entry; returns the product _id
+
+    Files of the entry's previous derivatives that the new ones no longer use are removed.
+    """
+    derivatives = result['derivatives']
+    main = derivatives.get(primary) or next(iter(derivatives.values()))
+    product = db.products.find_one({'images.gridfs_id': gridfs_id},
+                                   {'images': {'$elemMatch': {'gridfs_id': gridfs_id}}})
+    if product is None:
+        return None
+    old_paths = [path for image in product.get('images', []) for path in derivative_paths(image)]
+    db.products.update_one(
+        {'_id': product['_id'], 'images.gridfs_id': gridfs_id},
+        {'$set': {
+            'images.$.derivatives': derivatives,
+            'images.$.public_url': main['jpeg'],
+            'images.$.local_path': main['jpeg_path'],
+            'images.$.status': 'ready',
+        }},
+    )
+    kept = set(derivative_paths({'derivatives': derivatives, 'local_path': main['jpeg_path']}))
+    for path in old_paths:
+        if path not in kept and os.path.exists(path):
+            os.remove(path)
+    return product['_id']
+
+
+def _read_full(stream, size):
+    # Every chunk but the last must be exactly chunkSize bytes, so absorb short reads
+    data = stream.read(size)
+    while data and len(data) < size:
+        more = stream.read(size - len(data))
+        if not more:
+            break
+        data += more
+    return data
+
+
+def ingest_upload(db, stream, filename, content_type, spool_dir=None, chunk_size=GRIDFS_CHUNK_SIZE):
+    """Stream an upload into GridFS chunks and a spool file in one hashed pass.
+
+    Returns (gridfs_id, spool_path); at most one chunk is held in memory.
+    """
+    gridfs_id = ObjectId()
+    digest = hashlib.sha256()
+    length = 0
+    n = 0
+    fd, spool_path = tempfile.mkstemp(dir=spool_dir, suffix='.upload')
+    try:
+        with os.fdopen(fd, 'wb') as spool:
+            while True:
+                data = _read_full(stream, chunk_size)
+                if not data:
+                    break
+                db.fs.chunks.insert_one({'files_id': gridfs_id, 'n': n, 'data': data})
+                digest.update(data)
+                spool.write(data)
+                length += len(data)
+                n += 1
+        # The files document goes in last so readers never see a partial file
+        db.fs.files.insert_one({
+            '_id': gridfs_id,
+            'filename': filename,
+            'contentType': content_type,
+            'length': length,
+            'chunkSize': chunk_size,
+            'uploadDate': datetime.utcnow(),
+            'sha256': digest.hexdigest(),
+        })
+    except Exception:
+        db.fs.chunks.delete_many({'files_id': gridfs_id})
+        if os.path.exists(spool_path):
+            os.remove(spool_path)
+        raise
+    return gridfs_id, spool_path
+
+
+def spool_gridfs_file(db, gridfs_id, spool_dir=None):
+    """Copy a GridFS file into a temporary file chunk by chunk; returns its path"""
+    fd, path = tempfile.mkstemp(dir=spool_dir, suffix='.upload')
+    with os.fdopen(fd, 'wb') as f:
+        for chunk in db.fs.chunks.find({'files_id': gridfs_id}).sort('n', 1):
+            f.write(chunk['data'])
+    return path
+
+
+class ImagePipeline:
+    """Process pool that renders derivatives off the request thread"""
+
+    def __init__(self, output_dir, sizes, public_prefix, workers=None):
+        self.output_dir = output_dir
+        self.sizes = sizes
+        self.public_prefix = public_prefix.rstrip('/')
+        self.workers = workers or os.cpu_count() or 1
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            # A pool inherited through fork (e.g. by a gunicorn worker) is not usable
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+                self._pid = os.getpid()
+            return self._executor
+
+    def submit(self, file_id, source_path, on_done, remove_source=True):
+        """Render derivatives of GridFS file file_id, spooled at source_path, and call on_done(result, error)"""
+        future = self._get_executor().submit(
+            render_derivatives, source_path, self.output_dir, self.sizes, self.public_prefix, str(file_id))
+
+        def finished(done):
+            if remove_source and os.path.exists(source_path):
+                os.remove(source_path)
+            error = done.exception()
+            try:
+                on_done(None if error else done.result(), error)
+            except Exception as e:
+                print(f"Image derivative callback failed: {e}")
+
+        future.add_done_callback(finished)
+        return future
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+
+def regenerate(db, pipeline, spool_dir=None, max_in_flight=None):
+    """Re-render derivatives for every product image stored in GridFS"""
+    max_in_flight = max_in_flight or pipeline.workers * 4
+    in_flight = set()
+    stats = {'images': 0, 'failed': 0}
+    # Results are recorded on the pool's callback threads
+    stats_lock = threading.Lock()
+    started = time.perf_counter()
+
+    def on_done(gridfs_id):
+        def record(result, error):
+            if error:
+                with stats_lock:
+                    stats['failed'] += 1
+                print(f"❌ {gridfs_id}: {error}")
+                db.products.update_one({'images.gridfs_id': gridfs_id},
+                                       {'$set': {'images.$.status': 'failed'}})
+            else:
+                apply_derivatives(db, gridfs_id, result)
+                with stats_lock:
+                    stats['images'] += 1
+        return record
+
+    for product in db.products.find({'images.gridfs_id': {'$exists': True}}, {'images.gridfs_id': 1}):
+        for image in product.get('images', []):
+            gridfs_id = image.get('gridfs_id')
+            if gridfs_id is None:
+                continue
+            # Bound the spooled originals waiting on disk
+            while len(in_flight) >= max_in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            source_path = spool_gridfs_file(db, gridfs_id, spool_dir)
+            in_flight.add(pipeline.submit(gridfs_id, source_path, on_done(gridfs_id)))
+
+    wait(in_flight)
+    pipeline.shutdown()
+    elapsed = time.perf_counter() - started
+    rate = stats['images'] / elapsed if elapsed else 0
+    print(f"✅ Regenerated {stats['images']} images ({stats['failed']} failed) "
+          f"in {elapsed:.1f}s, {rate:.1f} images/s")
+    return stats
+
+
+def main():
+    from pymongo import MongoClient
+    from cache import create_cache
+    from config import Config
+
+    parser = argparse.ArgumentParser(description='Product image derivatives')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    regen = subcommands.add_parser('regenerate', help='re-render derivatives for the existing catalog')
+    regen.add_argument('--workers', type=int, default=Config.IMAGE_WORKERS)
+    args = parser.parse_args()
+
+    client = MongoClient(Config.MONGODB_URI)
+    try:
+        pipeline = ImagePipeline(Config.UPLOAD_FOLDER, Config.IMAGE_DERIVATIVES,
+                                 Config.IMAGE_PUBLIC_PREFIX, workers=args.workers)
+        regenerate(client.get_database(), pipeline, spool_dir=Config.IMAGE_SPOOL_DIR)
+        # Cached product pages still point at the previous derivative URLs
+        create_cache({key: getattr(Config, key) for key in dir(Config) if key.isupper()}).invalidate('products')
+    finally:
+        client.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Index manifest and query plan report.
+
+INDEXES lists every index the application's queries rely on, per collection.
+The app builds them in a background thread at startup (INDEXES_ON_STARTUP);
+they can also be built ahead of a deploy, and every route's query shape can be
+explained to catch collection scans:
+
+    python indexes.py ensure
+    python indexes.py explain
+"""
+
+import argparse
+import sys
+import time
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+from pymongo.errors import OperationFailure
+
+SIZES = ('S', 'M', 'L', 'XL')
+
+INDEXES = {
+    'products': [
+        # Default name kept so the index init_db() used to create is not rebuilt
+        IndexModel([('name', TEXT), ('description', TEXT)]),
+        # Listing sorts, with and without a category filter; also related products and category deletes
+        IndexModel([('created_at', DESCENDING), ('_id', DESCENDING)], name='created_at_id'),
+        IndexModel([('price', ASCENDING), ('_id', ASCENDING)], name='price_id'),
+        IndexModel([('category_id', ASCENDING), ('created_at', DESCENDING), ('_id', DESCENDING)],
+                   name='category_created_at_id'),
+        IndexModel([('category_id', ASCENDING), ('price', ASCENDING), ('_id', ASCENDING)],
+                   name='category_price_id'),
+        IndexModel([('featured', ASCENDING)], name='featured',
+                   partialFilterExpression={'featured': True}),
+        # Catalog imports upsert on sku; products created in the admin form have none
+        IndexModel([('sku', ASCENDING)], name='sku_unique', unique=True,
+                   partialFilterExpression={'sku': {'$exists': True}}),
+        # Image pipeline callbacks locate the product owning a GridFS file
+        IndexModel([('images.gridfs_id', ASCENDING)], name='images_gridfs_id', sparse=True),
+    ] + [
+        # In-stock size filters only need the products that have the size
+        IndexModel([(f'stock.{size}', ASCENDING)], name=f'stock_{size}',
+                   partialFilterExpression={f'stock.{size}': {'$gt': 0}})
+        for size in SIZES
+    ],
+    'orders': [
+        # Newest-first keyset pages, unfiltered or by customer or status (profile, admin order list)
+        IndexModel([('created_at', DESCENDING), ('_id', DESCENDING)], name='created_at_id'),
+        IndexModel([('user_id', ASCENDING), ('created_at', DESCENDING), ('_id', DESCENDING)],
+                   name='user_created_at_id'),
+        IndexModel([('status', ASCENDING), ('created_at', DESCENDING), ('_id', DESCENDING)],
+                   name='status_created_at_id'),
+    ],
+    'users': [
+        # Some legacy admin documents have no username, so uniqueness only covers set values
+        IndexModel([('username', ASCENDING)], name='username_unique', unique=True,
+                   partialFilterExpression={'username': {'$exists': True}}),
+        IndexModel([('email', ASCENDING)], name='email_unique', unique=True,
+                   partialFilterExpression={'email': {'$exists': True}}),
+        IndexModel([('role', ASCENDING)], name='role'),
+    ],
+    'fs.chunks': [
+        # Same definition GridFS drivers create
+        IndexModel([('files_id', ASCENDING), ('n', ASCENDING)], name='files_id_1_n_1', unique=True),
+    ],
+    'carts': [
+        # Anonymous carts have no user_id; each user has at most one cart
+        IndexModel([('user_id', ASCENDING)], name='user_id_unique', unique=True,
+                   partialFilterExpression={'user_id': {'$exists': True}}),
+        # Abandoned carts are removed 30 days after their last change
+        IndexModel([('updated_at', ASCENDING)], name='updated_at_ttl', expireAfterSeconds=30 * 24 * 3600),
+    ],
+    'email_outbox': [
+        IndexModel([('status', ASCENDING), ('next_attempt_at', ASCENDING)], name='status_next_attempt_at'),
+        IndexModel([('claim', ASCENDING)], name='claim', sparse=True),
+    ],
+}
+
+# Indexes superseded by a manifest entry; dropped once their replacements exist
+RETIRED_INDEXES = {
+    'orders': ['created_at', 'user_created_at'],
+}
+
+
+def drop_retired_indexes(db, retired=None, verbose=True):
+    for collection, names in (retired or RETIRED_INDEXES).items():
+        existing = set(db[collection].index_information())
+        for name in names:
+            if name in existing:
+                db[collection].drop_index(name)
+                if verbose:
+                    print(f"🗑️  {collection}.{name} dropped")
+
+
+def ensure_indexes(db, manifest=None, verbose=True):
+    """Create any missing manifest indexes; returns {collection: [error, ...]} for failures"""
+    failures = {}
+    for collection, models in (manifest or INDEXES).items():
+        for model in models:
+            name = model.document['name']
+            started = time.perf_counter()
+            try:
+                db[collection].create_indexes([model])
+            except OperationFailure as e:
+                # e.g. duplicates blocking a unique index, or a same-key index under another name
+                failures.setdefault(collection, []).append(f"{name}: {e}")
+                if verbose:
+                    print(f"❌ {collection}.{name}: {e}")
+                continue
+            if verbose:
+                print(f"✅ {collection}.{name} ({time.perf_counter() - started:.1f}s)")
+    if manifest is None and not failures:
+        drop_retired_indexes(db, verbose=verbose)
+    return failures
+
+
+def ensure_indexes_in_background(db):
+    import threading
+
+    def run():
+        try:
+            failures = ensure_indexes(db, verbose=False)
+        except Exception as e:
+            print(f"Index build failed: {e}")
+            return
+        for collection, errors in failures.items():
+            for error in errors:
+                print(f"Index build failed on {collection}: {error}")
+
+    thread = threading.Thread(target=run, name='ensure-indexes', daemon=True)
+    thread.start()
+    return thread
+
+
+# (route, collection, filter, sort, limit, scan expected) for every query shape the app issues
+QUERY_SHAPES = [
+    ('home', 'categories', {}, None, 0, True),
+    ('home', 'products', {'featured': True}, None, 8, False),
+    ('products', 'products', {}, [('created_at', -1), ('_id', -1)], 25, False),
+    ('products', 'products', {}, [('price', 1), ('_id', 1)], 25, False),
+    ('products', 'products', {'category_id': ObjectId()}, [('created_at', -1), ('_id', -1)], 25, False),
+    ('products', 'products', {'category_id': ObjectId()}, [('price', -1), ('_id', -1)], 25, False),
+    ('products', 'products', {'stock.M': {'$gt': 0}}, [('created_at', -1), ('_id', -1)], 25, False),
+    ('products', 'products', {'$text': {'$search': 'shirt'}}, None, 25, False),
+    ('product_detail', 'products', {'_id': ObjectId()}, None, 1, False),
+    ('product_detail', 'products', {'category_id': ObjectId(), '_id': {'$nin': [ObjectId()]}}, None, 4, False),
+    ('product_detail', 'recommendations', {'_id': ObjectId()}, None, 1, False),
+    ('register', 'users', {'$or': [{'username': 'u'}, {'email': 'u@example.com'}]}, None, 1, False),
+    ('login', 'users', {'$or': [{'username': 'u'}, {'email': 'u'}]}, None, 1, False),
+    ('cart', 'carts', {'_id': ObjectId()}, None, 1, False),
+    ('login', 'carts', {'user_id': ObjectId()}, None, 1, False),
+    ('profile', 'orders', {'user_id': ObjectId()}, [('created_at', -1)], 0, False),
+    ('order_confirmation', 'orders', {'_id': ObjectId(), 'user_id': ObjectId()}, None, 1, False),
+    ('admin_dashboard', 'orders', {}, [('created_at', -1)], 5, False),
+    ('admin_orders', 'orders', {}, [('created_at', -1), ('_id', -1)], 51, False),
+    ('admin_orders', 'orders', {'status': 'pending', 'created_at': {'$gte': datetime(2025, 1, 1)}},
+     [('created_at', -1), ('_id', -1)], 51, False),
+    ('admin_orders', 'orders', {'user_id': {'$in': [ObjectId()]}}, [('created_at', -1), ('_id', -1)], 51, False),
+    ('admin_users', 'users', {'role': 'user'}, None, 0, False),
+    ('admin_products', 'products', {}, None, 0, True),
+    ('admin_delete_category', 'products', {'category_id': ObjectId()}, None, 1, False),
+    ('stream_image', 'fs.files', {'_id': ObjectId()}, None, 1, False),
+    ('stream_image', 'fs.chunks', {'files_id': ObjectId(), 'n': {'$gte': 0, '$lte': 3}}, [('n', 1)], 0, False),
+    ('image pipeline', 'products', {'images.gridfs_id': ObjectId()}, None, 1, False),
+    ('mailer worker', 'email_outbox', {'status': 'pending', 'next_attempt_at': {'$lte': datetime(2025, 1, 1)}},
+     [('next_attempt_at', 1)], 50, False),
+    ('mailer worker', 'email_outbox', {'claim': 'x', 'status': 'sending'}, None, 0, False),
+    ('admin_analytics', 'sales_daily', {'_id': {'$gte': '2025-01-01', '$lte': '2025-12-31'}}, None, 0, False),
+]
+
+
+def _stages(plan):
+    """(stage, index name) pairs of a winning plan, outermost first"""
+    found = []
+    stack = [plan]
+    while stack:
+        node = stack.pop()
+        if not isinstance(node, dict):
+            continue
+        if 'queryPlan' in node:
+            # Slot-based engine wraps the classic plan tree
+            stack.append(node['queryPlan'])
+            continue
+        if 'stage' in node:
+            found.append((node['stage'], node.get('indexName')))
+        stack.extend(reversed(node.get('inputStages', [])))
+        if 'inputStage' in node:
+            stack.append(node['inputStage'])
+    return found
+
+
+def explain_report(db, shapes=None):
+    """Explain each query shape; returns one row per shape with its plan and scan flag"""
+    rows = []
+    for route, collection, filter_query, sort, limit, scan_expected in shapes or QUERY_SHAPES:
+        cursor = db[collection].find(filter_query)
+        if sort:
+            cursor = cursor.sort(sort)
+        if limit:
+            cursor = cursor.limit(limit)
+        try:
+            explain = cursor.explain()
+        except OperationFailure as e:
+            rows.append({'route': route, 'collection': collection, 'filter': str(filter_query),
+                         'error': str(e)})
+            continue
+        stages = _stages(explain.get('queryPlanner', {}).get('winningPlan', {}))
+        execution = explain.get('executionStats', {})
+        collscan = any(stage == 'COLLSCAN' for stage, _ in stages)
+        rows.append({
+            'route': route,
+            'collection': collection,
+            'filter': str(filter_query),
+            'sort': str(sort) if sort else None,
+            'stages': [stage for stage, _ in stages],
+            'indexes': sorted({index for _, index in stages if index}),
+            'docs_examined': execution.get('totalDocsExamined'),
+            'returned': execution.get('nReturned'),
+            'millis': execution.get('executionTimeMillis'),
+            'collscan': collscan,
+            'collscan_expected': collscan and scan_expected,
+            'in_memory_sort': any(stage == 'SORT' for stage, _ in stages),
+        })
+    return rows
+
+
+def print_report(rows):
+    problems = 0
+    for row in rows:
+        label = f"{row['route']}: {row['collection']} {row['filter']}"
+        if row.get('sort'):
+            label += f" sort {row['sort']}"
+        if 'error' in row:
+            print(f"❌ {label}\n   explain failed: {row['error']}")
+            problems += 1
+            continue
+        if row['collscan'] and not row['collscan_expected']:
+            marker = '❌ COLLSCAN'
+            problems += 1
+        elif row['collscan']:
+            marker = 'ℹ️  COLLSCAN (full listing)'
+        elif row['in_memory_sort']:
+            marker = '⚠️  in-memory SORT'
+        else:
+            marker = '✅'
+        print(f"{marker} {label}")
+        print(f"   {' <- '.join(row['stages'])} index={','.join(row['indexes']) or '-'} "
+              f"examined={row['docs_examined']} returned={row['returned']} ms={row['millis']}")
+    return problems
+
+
+def main():
+    from pymongo import MongoClient
+    from config import Config
+
+    parser = argparse.ArgumentParser(description='Index manifest')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    subcommands.add_parser('ensure', help='create missing indexes')
+    subcommands.add_parser('explain', help='explain every route query and flag collection scans')
+    args = parser.parse_args()
+
+    client = MongoClient(Config.MONGODB_URI)
+    db = client.get_database()
+    try:
+        if args.command == 'ensure':
+            return 1 if ensure_indexes(db) else 0
+        return 1 if print_report(explain_report(db)) else 0
+    finally:
+        client.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
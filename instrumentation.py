@@ -0,0 +1,175 @@
+"""
+Per-request MongoDB command instrumentation.
+
+A pymongo CommandListener records every command a request issues (name,
+collection, query shape, latency) into a trace bound to the request through a
+context variable. Each trace is summarised in a Server-Timing header and
+folded into per-route totals for the admin report. Queries of identical shape
+repeated within one request are reported as N+1 patterns.
+
+Commands run outside a request (background threads, CLIs) are not recorded.
+"""
+
+import threading
+import time
+from contextvars import ContextVar
+
+from pymongo import monitoring
+
+# Driver housekeeping that is not part of the application's query load
+IGNORED_COMMANDS = frozenset(('hello', 'ismaster', 'isMaster', 'ping', 'saslStart',
+                              'saslContinue', 'authenticate', 'endSessions'))
+
+_current_trace = ContextVar('mongo_trace', default=None)
+
+
+def _shape(value):
+    """Query structure with every literal replaced by '?'"""
+    if isinstance(value, dict):
+        return '{' + ', '.join(f'{key}: {_shape(value[key])}' for key in sorted(value)) + '}'
+    if isinstance(value, (list, tuple)) and value and isinstance(value[0], dict):
+        return '[' + ', '.join(_shape(item) for item in value) + ']'
+    return '?'
+
+
+def command_shape(name, command):
+    """Identify the query a command runs, ignoring the values it was run with"""
+    if name == 'find':
+        return f"find {_shape(command.get('filter', {}))} sort {_shape(command.get('sort', {}))}"
+    if name in ('update', 'delete'):
+        statements = command.get('updates') or command.get('deletes') or [{}]
+        return f"{name} {_shape(statements[0].get('q', {}))}"
+    if name == 'findAndModify':
+        return f"findAndModify {_shape(command.get('query', {}))}"
+    if name == 'aggregate':
+        stages = [next(iter(stage), '?') for stage in command.get('pipeline', [])]
+        first = command.get('pipeline', [{}])[0] if command.get('pipeline') else {}
+        return f"aggregate {_shape(first.get('$match', {}))} {'|'.join(stages)}"
+    if name in ('count', 'distinct'):
+        return f"{name} {_shape(command.get('query', {}))}"
+    return name
+
+
+class RequestTrace:
+    __slots__ = ('commands', 'pending', 'started')
+
+    def __init__(self):
+        self.commands = []   # (command name, collection, shape, milliseconds)
+        self.pending = {}    # driver request_id -> (command name, collection, shape)
+        self.started = time.perf_counter()
+
+    @property
+    def mongo_ms(self):
+        return sum(ms for _, _, _, ms in self.commands)
+
+    def repeated_shapes(self, threshold):
+        """[(collection, shape, count)] for query shapes issued at least threshold times"""
+        counts = {}
+        for name, collection, shape, _ in self.commands:
+            if name in ('find', 'aggregate', 'count', 'findAndModify', 'update', 'delete'):
+                counts[(collection, shape)] = counts.get((collection, shape), 0) + 1
+        return [(collection, shape, n) for (collection, shape), n in counts.items() if n >= threshold]
+
+
+class MongoCommandRecorder(monitoring.CommandListener):
+    """Register with MongoClient(event_listeners=[...]); traces are opened per request"""
+
+    def begin(self):
+        """Start recording commands for the current context; returns a token for end()"""
+        return _current_trace.set(RequestTrace())
+
+    def current(self):
+        return _current_trace.get()
+
+    def end(self, token):
+        _current_trace.reset(token)
+
+    def started(self, event):
+        trace = _current_trace.get()
+        if trace is None or event.command_name in IGNORED_COMMANDS:
+            return
+        name = event.command_name
+        collection = event.command.get(name)
+        if not isinstance(collection, str):
+            collection = event.command.get('collection') if name == 'getMore' else None
+        trace.pending[event.request_id] = (name, collection, command_shape(name, event.command))
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event)
+
+    def _finish(self, event):
+        trace = _current_trace.get()
+        if trace is None:
+            return
+        entry = trace.pending.pop(event.request_id, None)
+        if entry is not None:
+            trace.commands.append(entry + (event.duration_micros / 1000,))
+
+
+def server_timing(trace, total_seconds=None):
+    """Server-Timing header value for one request"""
+    parts = [f'mongo;desc="{len(trace.commands)} commands";dur={trace.mongo_ms:.1f}']
+    if total_seconds is not None:
+        parts.append(f'app;dur={total_seconds * 1000:.1f}')
+    return ', '.join(parts)
+
+
+class RouteReport:
+    """Per-route aggregates of request traces, kept per process"""
+
+    def __init__(self, n_plus_one_threshold=3):
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, trace, total_seconds):
+        repeated = trace.repeated_shapes(self.n_plus_one_threshold)
+        with self._lock:
+            route = self._routes.get(endpoint)
+            if route is None:
+                route = self._routes[endpoint] = {
+                    'requests': 0, 'commands': 0, 'max_commands': 0,
+                    'mongo_ms': 0.0, 'total_ms': 0.0,
+                    'by_command': {}, 'by_collection': {}, 'n_plus_one': {},
+                }
+            route['requests'] += 1
+            route['commands'] += len(trace.commands)
+            route['max_commands'] = max(route['max_commands'], len(trace.commands))
+            route['mongo_ms'] += trace.mongo_ms
+            route['total_ms'] += total_seconds * 1000
+            for name, collection, _, _ in trace.commands:
+                route['by_command'][name] = route['by_command'].get(name, 0) + 1
+                if collection:
+                    route['by_collection'][collection] = route['by_collection'].get(collection, 0) + 1
+            for collection, shape, n in repeated:
+                key = f'{collection}: {shape}'
+                seen = route['n_plus_one'].setdefault(key, {'requests': 0, 'max_repeats': 0})
+                seen['requests'] += 1
+                seen['max_repeats'] = max(seen['max_repeats'], n)
+        return repeated
+
+    def snapshot(self):
+        """Routes ordered by Mongo time, with per-request averages"""
+        with self._lock:
+            rows = []
+            for endpoint, route in self._routes.items():
+                requests = route['requests']
+                rows.append(dict(
+                    route,
+                    endpoint=endpoint,
+                    by_command=dict(route['by_command']),
+                    by_collection=dict(route['by_collection']),
+                    n_plus_one={key: dict(value) for key, value in route['n_plus_one'].items()},
+                    avg_commands=round(route['commands'] / requests, 2),
+                    avg_mongo_ms=round(route['mongo_ms'] / requests, 2),
+                    avg_total_ms=round(route['total_ms'] / requests, 2),
+                ))
+        rows.sort(key=lambda row: row['mongo_ms'], reverse=True)
+        return rows
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
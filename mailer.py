@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Durable email outbox with pooled SMTP delivery.
+
+Requests only insert rendered messages into the email_outbox collection.
+Worker processes claim pending messages in batches, deliver them over a pool
+of persistent authenticated SMTP connections and record the outcome, retrying
+temporary failures with exponential backoff.
+
+Run the delivery workers with:
+    python mailer.py worker [--processes N]
+
+For local testing point SMTP_HOST/SMTP_PORT at a stand-in such as
+`python -m aiosmtpd -n -l localhost:1025` and set SMTP_SECURITY=plain.
+"""
+
+import argparse
+import multiprocessing
+import os
+import queue
+import smtplib
+import socket
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+from pymongo import UpdateOne
+
+from metrics import Metrics
+
+OUTBOX = 'email_outbox'
+
+
+def email_enabled(config):
+    return bool(config.get('SMTP_HOST'))
+
+
+def enqueue_email(db, subject, to_email, html_body, text_body=None):
+    """Record a rendered email for the delivery workers; returns the outbox id"""
+    now = datetime.utcnow()
+    return db[OUTBOX].insert_one({
+        'to': to_email,
+        'subject': subject,
+        'html_body': html_body,
+        'text_body': text_body,
+        'status': 'pending',
+        'attempts': 0,
+        'next_attempt_at': now,
+        'created_at': now,
+    }).inserted_id
+
+
+def build_message(config, doc):
+    msg = EmailMessage()
+    msg['Subject'] = doc['subject']
+    msg['From'] = config.get('SMTP_FROM') or config.get('SMTP_USER')
+    msg['To'] = doc['to']
+    if doc.get('text_body'):
+        msg.set_content(doc['text_body'])
+        msg.add_alternative(doc['html_body'], subtype='html')
+    else:
+        msg.set_content(doc['html_body'], subtype='html')
+    return msg
+
+
+class SMTPConnectionPool:
+    """Persistent, authenticated SMTP connections shared by the sender threads"""
+
+    def __init__(self, config, size=4, idle_check_seconds=30):
+        self.config = config
+        self.size = size
+        self.idle_check_seconds = idle_check_seconds
+        self._idle = queue.LifoQueue()
+        self.connects = 0
+
+    def _connect(self):
+        config = self.config
+        security = config.get('SMTP_SECURITY', 'starttls')
+        timeout = config.get('SMTP_TIMEOUT', 30)
+        if security == 'ssl':
+            server = smtplib.SMTP_SSL(config['SMTP_HOST'], config['SMTP_PORT'], timeout=timeout)
+        else:
+            server = smtplib.SMTP(config['SMTP_HOST'], config['SMTP_PORT'], timeout=timeout)
+            if security == 'starttls':
+                server.starttls()
+        if config.get('SMTP_USER'):
+            server.login(config['SMTP_USER'], config['SMTP_PASSWORD'])
+        self.connects += 1
+        return server
+
+    def acquire(self):
+        try:
+            server, last_used = self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+        # Servers drop idle sessions; probe before reusing one that sat for a while
+        if time.monotonic() - last_used > self.idle_check_seconds:
+            try:
+                if server.noop()[0] != 250:
+                    raise smtplib.SMTPServerDisconnected('noop failed')
+            except (smtplib.SMTPException, OSError):
+                self.discard(server)
+                return self._connect()
+        return server
+
+    def release(self, server):
+        if self._idle.qsize() < self.size:
+            self._idle.put((server, time.monotonic()))
+        else:
+            self.discard(server)
+
+    def discard(self, server):
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
+
+    def send(self, msg):
+        server = self.acquire()
+        try:
+            try:
+                server.send_message(msg)
+            except (smtplib.SMTPServerDisconnected, OSError):
+                # The pooled session went away; retry once on a fresh connection
+                self.discard(server)
+                server = self._connect()
+                server.send_message(msg)
+        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPResponseException):
+            # The server rejected this message, the session itself is still usable
+            self.release(server)
+            raise
+        except Exception:
+            self.discard(server)
+            raise
+        self.release(server)
+
+    def close(self):
+        while not self._idle.empty():
+            self.discard(self._idle.get_nowait()[0])
+
+
+def _is_permanent(error):
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+
+class OutboxWorker:
+    def __init__(self, db, config, pool=None, metrics=None):
+        self.db = db
+        self.config = config
+        self.metrics = metrics or Metrics(config.get('METRICS_DIR'))
+        self.pool = pool or SMTPConnectionPool(config, size=config.get('SMTP_POOL_SIZE', 4))
+        self.batch_size = config.get('EMAIL_BATCH_SIZE', 50)
+        self.max_attempts = config.get('EMAIL_MAX_ATTEMPTS', 6)
+        self.retry_base = config.get('EMAIL_RETRY_BASE_SECONDS', 30)
+        self.lease_seconds = config.get('EMAIL_LEASE_SECONDS', 300)
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._senders = ThreadPoolExecutor(max_workers=self.pool.size)
+
+    def claim_batch(self):
+        """Lease up to batch_size due messages to this worker"""
+        now = datetime.utcnow()
+        # Messages leased by a worker that died go back to the queue
+        self.db[OUTBOX].update_many(
+            {'status': 'sending', 'locked_until': {'$lt': now}},
+            {'$set': {'status': 'pending'}}
+        )
+        ids = [doc['_id'] for doc in self.db[OUTBOX].find(
+            {'status': 'pending', 'next_attempt_at': {'$lte': now}}, {'_id': 1}
+        ).sort('next_attempt_at', 1).limit(self.batch_size)]
+        if not ids:
+            return []
+        claim = uuid.uuid4().hex
+        self.db[OUTBOX].update_many(
+            {'_id': {'$in': ids}, 'status': 'pending'},
+            {'$set': {'status': 'sending', 'claim': claim, 'worker': self.worker_id,
+                      'locked_until': now + timedelta(seconds=self.lease_seconds)}}
+        )
+        # Another worker may have won some of the ids
+        return list(self.db[OUTBOX].find({'claim': claim, 'status': 'sending'}))
+
+    def _deliver(self, doc):
+        started = time.perf_counter()
+        try:
+            self.pool.send(build_message(self.config, doc))
+            return doc, None, time.perf_counter() - started
+        except Exception as e:
+            return doc, e, time.perf_counter() - started
+
+    def process_batch(self):
+        """Send one claimed batch; returns the number of messages handled"""
+        batch = self.claim_batch()
+        if not batch:
+            return 0
+        now = datetime.utcnow()
+        updates = []
+        for doc, error, seconds in self._senders.map(self._deliver, batch):
+            self.metrics.observe('smtp_send_seconds', seconds)
+            if error is None:
+                self.metrics.inc('smtp_messages_total', outcome='sent')
+                updates.append(UpdateOne({'_id': doc['_id']}, {
+                    '$set': {'status': 'sent', 'sent_at': now, 'send_seconds': seconds},
+                    '$inc': {'attempts': 1},
+                    '$unset': {'claim': '', 'locked_until': ''},
+                }))
+                continue
+            attempts = doc.get('attempts', 0) + 1
+            if _is_permanent(error) or attempts >= self.max_attempts:
+                fields = {'status': 'failed'}
+            else:
+                delay = min(self.retry_base * 2 ** (attempts - 1), 6 * 3600)
+                fields = {'status': 'pending', 'next_attempt_at': now + timedelta(seconds=delay)}
+            self.metrics.inc('smtp_messages_total', outcome=fields['status'])
+            fields['last_error'] = str(error)[:500]
+            updates.append(UpdateOne({'_id': doc['_id']}, {
+                '$set': fields,
+                '$inc': {'attempts': 1},
+                '$unset': {'claim': '', 'locked_until': ''},
+            }))
+        self.db[OUTBOX].bulk_write(updates, ordered=False)
+        return len(batch)
+
+    def run(self, poll_interval=2, stop=None):
+        try:
+            while stop is None or not stop.is_set():
+                if self.process_batch() == 0:
+                    time.sleep(poll_interval)
+        finally:
+            self._senders.shutdown()
+            self.pool.close()
+
+
+def _load_config():
+    from config import Config
+    return {key: getattr(Config, key) for key in dir(Config) if key.isupper()}
+
+
+def run_worker_process(poll_interval):
+    from pymongo import MongoClient
+
+    config = _load_config()
+    client = MongoClient(config['MONGODB_URI'])
+    worker = OutboxWorker(client.get_database(), config)
+    print(f"📬 Outbox worker {worker.worker_id} started")
+    try:
+        worker.run(poll_interval=poll_interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Email outbox delivery')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    worker = subcommands.add_parser('worker', help='deliver queued emails')
+    worker.add_argument('--processes', type=int, default=1)
+    worker.add_argument('--poll-interval', type=float, default=2)
+    args = parser.parse_args()
+
+    if not email_enabled(_load_config()):
+        print("❌ SMTP_HOST is not configured")
+        return 1
+
+    processes = [multiprocessing.Process(target=run_worker_process, args=(args.poll_interval,))
+                 for _ in range(args.processes)]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.join()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
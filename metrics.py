@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Request metrics in Prometheus text format.
+
+Each process keeps counters, gauges and histograms in memory. When METRICS_DIR
+is set, every process (gunicorn workers, mail workers) also writes its values
+to its own file there at most once per flush interval, and /metrics merges all
+files: counters and histograms are summed, gauges are summed over processes
+that are still alive. Clear the directory when the app is redeployed:
+
+    python metrics.py show     # print the merged metrics
+    python metrics.py clear    # remove the per-process files
+"""
+
+import argparse
+import atexit
+import glob
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# name -> (type, help, histogram buckets)
+METRICS = {
+    'http_requests_total': ('counter', 'Requests handled, by endpoint, method and status', None),
+    'http_request_duration_seconds': ('histogram', 'Request latency by endpoint', LATENCY_BUCKETS),
+    'http_response_size_bytes': ('histogram', 'Response body size by endpoint', SIZE_BUCKETS),
+    'http_requests_in_flight': ('gauge', 'Requests currently being handled', None),
+    'mongo_commands_total': ('counter', 'Mongo commands issued by requests, by endpoint', None),
+    'mongo_command_seconds_total': ('counter', 'Time requests spent in Mongo commands, by endpoint', None),
+    'image_render_seconds': ('histogram', 'Pillow time to render the derivatives of one image', LATENCY_BUCKETS),
+    'image_renders_total': ('counter', 'Image derivative renders by outcome', None),
+    'smtp_send_seconds': ('histogram', 'SMTP time to deliver one message', LATENCY_BUCKETS),
+    'smtp_messages_total': ('counter', 'Outbox deliveries by outcome', None),
+}
+
+
+def _labels_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Metrics:
+    def __init__(self, directory=None, flush_interval=1.0, write=True):
+        self.directory = directory or None
+        self.flush_interval = flush_interval
+        # Readers such as the CLI merge the directory without adding a file of their own
+        self.write = write
+        self._lock = threading.Lock()
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        # pid plus a random suffix, so a recycled pid never overwrites an older process's totals
+        self._file = (os.path.join(self.directory, f'metrics_{self._pid}_{uuid.uuid4().hex[:8]}.json')
+                      if self.directory and self.write else None)
+        self._values = {}      # (name, labels) -> float for counters and gauges
+        self._histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+        self._dirty = False
+        if self._file:
+            # Requests only touch memory; a background thread writes the file when something changed
+            threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True).start()
+            atexit.register(self.flush)
+
+    def _check_fork(self):
+        # Values inherited through fork belong to the parent, which reports them itself
+        if self._pid != os.getpid():
+            self._reset()
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            self._check_fork()
+            key = (name, _labels_key(labels))
+            self._values[key] = self._values.get(key, 0) + value
+            self._dirty = True
+
+    def gauge_add(self, name, value, **labels):
+        self.inc(name, value, **labels)
+
+    def observe(self, name, value, **labels):
+        buckets = METRICS[name][2]
+        with self._lock:
+            self._check_fork()
+            key = (name, _labels_key(labels))
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram[i] += 1
+                    break
+            histogram[-2] += value
+            histogram[-1] += 1
+            self._dirty = True
+
+    def _state(self):
+        with self._lock:
+            self._dirty = False
+            return {
+                'pid': self._pid,
+                'values': [[name, list(labels), value] for (name, labels), value in self._values.items()],
+                'histograms': [[name, list(labels), counts] for (name, labels), counts in self._histograms.items()],
+            }
+
+    def _flush_loop(self):
+        pid = self._pid
+        while pid == os.getpid():
+            time.sleep(self.flush_interval)
+            if self._dirty:
+                try:
+                    self.flush()
+                except OSError as e:
+                    print(f"Metrics flush failed: {e}")
+
+    def flush(self):
+        if not self._file or self._pid != os.getpid():
+            return
+        state = self._state()
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self._file)
+
+    def collect(self):
+        """Merged (values, histograms) of every process writing to the directory, or just this one"""
+        if not self.directory:
+            states = [self._state()]
+        else:
+            self.flush()
+            states = []
+            for path in glob.glob(os.path.join(self.directory, 'metrics_*.json')):
+                try:
+                    with open(path) as f:
+                        states.append(json.load(f))
+                except (OSError, ValueError):
+                    continue  # removed or being replaced mid-read
+        values, histograms = {}, {}
+        for state in states:
+            alive = _pid_alive(state['pid'])
+            for name, labels, value in state['values']:
+                if METRICS.get(name, ('counter',))[0] == 'gauge' and not alive:
+                    continue
+                key = (name, tuple(tuple(pair) for pair in labels))
+                values[key] = values.get(key, 0) + value
+            for name, labels, counts in state['histograms']:
+                key = (name, tuple(tuple(pair) for pair in labels))
+                merged = histograms.setdefault(key, [0] * len(counts))
+                for i, count in enumerate(counts):
+                    merged[i] += count
+        return values, histograms
+
+    def render(self):
+        """Prometheus text exposition of the merged metrics"""
+        values, histograms = self.collect()
+        lines = []
+        for name, (kind, help_text, buckets) in METRICS.items():
+            series = [(labels, value) for (n, labels), value in values.items() if n == name]
+            hist = [(labels, counts) for (n, labels), counts in histograms.items() if n == name]
+            if not series and not hist:
+                continue
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in sorted(series):
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+            for labels, counts in sorted(hist):
+                cumulative = 0
+                for bound, count in zip(buckets, counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_format_labels(labels + (("le", _format_value(bound)),))} {cumulative}')
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {counts[-1]}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(counts[-2])}')
+                lines.append(f'{name}_count{_format_labels(labels)} {counts[-1]}')
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def main():
+    from config import Config
+
+    parser = argparse.ArgumentParser(description='Request metrics')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    subcommands.add_parser('show', help='print the merged metrics of all processes')
+    subcommands.add_parser('clear', help='remove the per-process metric files')
+    args = parser.parse_args()
+
+    if not Config.METRICS_DIR:
+        print("❌ METRICS_DIR is not configured")
+        return 1
+    if args.command == 'clear':
+        paths = glob.glob(os.path.join(Config.METRICS_DIR, 'metrics_*.json'))
+        for path in paths:
+            os.remove(path)
+        print(f"✅ Removed {len(paths)} metric files")
+        return 0
+    print(Metrics(Config.METRICS_DIR, write=False).render(), end='')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Read profiles: one MongoClient per kind of traffic.
+
+- transactional: orders, stock, carts, auth and every write. Primary reads,
+  majority writes.
+- catalog: storefront product reads, which tolerate bounded replication lag.
+  Sent to secondaries when one is fresh enough, otherwise to the primary.
+- admin-reports: order listings, exports and analytics. Long scans with their
+  own small pool and long timeouts, kept off the primary when possible.
+
+Each profile is a set of MongoClient options, so pools and timeouts are sized
+per profile. Override them with MONGO_PROFILES, a JSON object of option
+overrides per profile. An optional "uri" sends a profile to another
+deployment, such as an analytics node:
+
+    MONGO_PROFILES='{"catalog": {"maxPoolSize": 200}, "admin-reports": {"readPreference": "secondary"}}'
+
+On a single-host replica set (mongod --replSet rs0, then rs.initiate()) every
+profile reads from the primary, which is still enough to exercise the routing:
+
+    python mongo_profiles.py show                        # effective options and the server each profile reads from
+    python -m benchmarks.read_profiles --seconds 10      # mixed load, routed vs everything on the primary
+"""
+
+import argparse
+import json
+import sys
+
+from pymongo import MongoClient
+
+PROFILES = {
+    'transactional': {
+        'readPreference': 'primary',
+        'w': 'majority',
+        'maxPoolSize': 100,
+        'serverSelectionTimeoutMS': 5000,
+        'connectTimeoutMS': 5000,
+        'socketTimeoutMS': 10000,
+        'waitQueueTimeoutMS': 2000,
+    },
+    'catalog': {
+        'readPreference': 'secondaryPreferred',
+        # The smallest staleness bound the server accepts
+        'maxStalenessSeconds': 90,
+        'w': 'majority',
+        'maxPoolSize': 50,
+        'serverSelectionTimeoutMS': 2000,
+        'connectTimeoutMS': 2000,
+        'socketTimeoutMS': 5000,
+        'waitQueueTimeoutMS': 1000,
+    },
+    'admin-reports': {
+        'readPreference': 'secondaryPreferred',
+        'maxStalenessSeconds': 300,
+        'w': 'majority',
+        'maxPoolSize': 10,
+        'serverSelectionTimeoutMS': 5000,
+        'connectTimeoutMS': 5000,
+        # Exports stream for minutes; this bounds each getMore, not the whole export
+        'socketTimeoutMS': 120000,
+        'waitQueueTimeoutMS': 10000,
+    },
+}
+
+
+def load_profiles(overrides=''):
+    """Default profiles with MONGO_PROFILES overrides (a JSON object) applied"""
+    profiles = {name: dict(options) for name, options in PROFILES.items()}
+    if not overrides:
+        return profiles
+    parsed = json.loads(overrides)
+    for name, options in parsed.items():
+        if name not in profiles:
+            raise ValueError(f"Unknown Mongo profile {name!r} in MONGO_PROFILES")
+        profiles[name].update(options)
+        if profiles[name].get('readPreference') == 'primary':
+            # maxStalenessSeconds is rejected together with primary reads
+            profiles[name].pop('maxStalenessSeconds', None)
+    return profiles
+
+
+def create_clients(uri, profiles, event_listeners=()):
+    """{profile: MongoClient}; clients connect lazily"""
+    clients = {}
+    for name, options in profiles.items():
+        options = dict(options)
+        clients[name] = MongoClient(options.pop('uri', uri), event_listeners=list(event_listeners), **options)
+    return clients
+
+
+def serving_host(client):
+    """Host a read through this client is routed to"""
+    reply = client.get_database().command('hello', read_preference=client.read_preference)
+    return reply.get('me') or ','.join(f'{host}:{port}' for host, port in client.nodes) or 'standalone'
+
+
+def main():
+    from config import Config
+
+    parser = argparse.ArgumentParser(description='Mongo read profiles')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    subcommands.add_parser('show', help='print each profile and the server it reads from')
+    parser.parse_args()
+
+    clients = create_clients(Config.MONGODB_URI, load_profiles(Config.MONGO_PROFILES))
+    try:
+        for name, client in clients.items():
+            options = client.options
+            print(f"ℹ️  {name}: {client.read_preference.document} w={client.write_concern.document.get('w', 1)} "
+                  f"pool={options.pool_options.max_pool_size} socketTimeout={options.pool_options.socket_timeout}s")
+            print(f"   reads from {serving_host(client)}")
+        return 0
+    finally:
+        for client in clients.values():
+            client.close()
+
+if __name__ == '__main__':
+    sys.exit(main())
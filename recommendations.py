@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+"Frequently bought together" recommendations.
+
+An offline job reads the items of every non-cancelled order into a sparse
+order x product matrix X and computes the co-occurrence matrix C = X^T X with
+scipy, so the work runs in compiled code instead of looping over pairs. Each
+pair is scored by cosine similarity, c_ij / sqrt(c_ii * c_jj), which keeps
+best sellers from topping every list. The top-k neighbours of each product
+are written to the recommendations collection, one document per product,
+which product_detail() reads in a single lookup.
+
+C and a watermark are kept in RECOMMENDATIONS_DIR. A refresh reads the orders
+created since the watermark, adds their co-occurrences to C and rewrites the
+products whose scores changed. Order timestamps and _ids come from the app
+servers, so an order can be saved after a newer one. To catch those, a refresh
+re-reads RECOMMENDATIONS_OVERLAP seconds before the watermark and skips the
+orders already counted in that window, which are kept with it. Orders saved
+later than that, or cancelled after a refresh, are corrected by the next
+full build.
+
+    python recommendations.py build      # from every order
+    python recommendations.py refresh    # orders since the last run (builds if there is no state)
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+import numpy as np
+from bson import ObjectId
+from pymongo import ReplaceOne
+from scipy import sparse
+
+RECOMMENDATIONS = 'recommendations'
+NON_SALE_STATUSES = ('cancelled',)
+MATRIX_FILE = 'cooccurrence.npz'
+STATE_FILE = 'state.json'
+
+
+def read_baskets(db, since=None, skip=(), overlap=timedelta(0), batch_size=5000):
+    """(order rows, product columns, recent orders, orders read) of non-cancelled orders created since since
+
+    Columns are product ids as hex strings; each order's products are listed once.
+    Orders whose _id is in skip are left out. Recent orders are the (_id,
+    created_at) pairs read within overlap of the newest one, oldest first.
+    """
+    query = {'status': {'$nin': list(NON_SALE_STATUSES)}}
+    if since is not None:
+        query['created_at'] = {'$gte': since}
+    rows, columns = [], []
+    recent = deque()
+    orders = 0
+    cursor = db.orders.find(query, {'items.product_id': 1, 'created_at': 1},
+                            batch_size=batch_size).sort([('created_at', 1), ('_id', 1)])
+    for order in cursor:
+        if order['_id'] in skip:
+            continue
+        created_at = order.get('created_at')
+        if created_at is not None:
+            recent.append((order['_id'], created_at))
+            while recent[0][1] < created_at - overlap:
+                recent.popleft()
+        products = {str(item['product_id']) for item in order.get('items') or [] if item.get('product_id')}
+        rows.extend([orders] * len(products))
+        columns.extend(products)
+        orders += 1
+    return rows, columns, list(recent), orders
+
+
+def basket_matrix(rows, columns, product_ids):
+    """Binary order x product CSR matrix; new products are appended to product_ids"""
+    positions = {product_id: i for i, product_id in enumerate(product_ids)}
+    names, inverse = np.unique(np.asarray(columns, dtype=str), return_inverse=True)
+    for name in names:
+        if name not in positions:
+            positions[name] = len(product_ids)
+            product_ids.append(str(name))
+    cols = np.asarray([positions[name] for name in names], dtype=np.int64)[inverse.ravel()]
+    n_orders = rows[-1] + 1 if rows else 0
+    data = np.ones(len(columns), dtype=np.float32)
+    return sparse.csr_matrix((data, (np.asarray(rows, dtype=np.int64), cols)),
+                             shape=(n_orders, len(product_ids)))
+
+
+def cooccurrence(baskets):
+    """C = X^T X; the diagonal holds each product's order count"""
+    return (baskets.T @ baskets).tocsr()
+
+
+def _resize(matrix, size):
+    matrix = matrix.tocoo()
+    return sparse.csr_matrix((matrix.data, (matrix.row, matrix.col)), shape=(size, size))
+
+
+def top_neighbours(matrix, rows, top_k=12, min_support=2):
+    """{row: [(column, score, count), ...]} best first, for the given rows of C"""
+    counts = matrix.diagonal()
+    sub = matrix[rows].tocoo()
+    keep = (sub.col != np.asarray(rows)[sub.row]) & (sub.data >= min_support)
+    row, col, together = np.asarray(rows)[sub.row[keep]], sub.col[keep], sub.data[keep]
+    scores = together / np.sqrt(counts[row] * counts[col])
+    # Sort by row, then score descending, and keep the first top_k of each row
+    order = np.lexsort((-scores, row))
+    row, col, scores, together = row[order], col[order], scores[order], together[order]
+    starts = np.searchsorted(row, row, side='left')
+    rank = np.arange(len(row)) - starts
+    keep = rank < top_k
+    found = {}
+    for r, c, score, count in zip(row[keep], col[keep], scores[keep], together[keep]):
+        found.setdefault(int(r), []).append((int(c), round(float(score), 6), int(count)))
+    return found
+
+
+def write_recommendations(db, product_ids, rows, neighbours, batch_size=1000):
+    now = datetime.utcnow()
+    ops = []
+    for row in rows:
+        picks = neighbours.get(row, [])
+        ops.append(ReplaceOne({'_id': ObjectId(product_ids[row])}, {
+            'products': [ObjectId(product_ids[col]) for col, _, _ in picks],
+            'scores': [score for _, score, _ in picks],
+            'counts': [count for _, _, count in picks],
+            'updated_at': now,
+        }, upsert=True))
+        if len(ops) >= batch_size:
+            db[RECOMMENDATIONS].bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        db[RECOMMENDATIONS].bulk_write(ops, ordered=False)
+    return now
+
+
+def _load_state(directory):
+    try:
+        with open(os.path.join(directory, STATE_FILE)) as f:
+            state = json.load(f)
+        matrix = sparse.load_npz(os.path.join(directory, MATRIX_FILE)).tocsr()
+    except (OSError, ValueError):
+        return None, None
+    return state, matrix
+
+
+def _save_state(directory, state, matrix):
+    os.makedirs(directory, exist_ok=True)
+    # Written under temporary names first so a crash never leaves a half-written pair
+    sparse.save_npz(os.path.join(directory, MATRIX_FILE + '.tmp.npz'), matrix)
+    with open(os.path.join(directory, STATE_FILE + '.tmp'), 'w') as f:
+        json.dump(state, f)
+    os.replace(os.path.join(directory, MATRIX_FILE + '.tmp.npz'), os.path.join(directory, MATRIX_FILE))
+    os.replace(os.path.join(directory, STATE_FILE + '.tmp'), os.path.join(directory, STATE_FILE))
+
+
+def _watermark(recent, overlap):
+    """State entries for the newest order counted and the orders a refresh must not count twice"""
+    if not recent:
+        return {'last_created_at': None, 'recent_orders': []}
+    newest = max(created_at for _, created_at in recent)
+    return {'last_created_at': newest.isoformat(),
+            'recent_orders': [[str(order_id), created_at.isoformat()] for order_id, created_at in recent
+                              if created_at >= newest - overlap]}
+
+
+def build(db, directory, top_k=12, min_support=2, overlap=600):
+    """Recompute recommendations from every order"""
+    started = time.perf_counter()
+    rows, columns, recent, orders = read_baskets(db, overlap=timedelta(seconds=overlap))
+    product_ids = []
+    matrix = cooccurrence(basket_matrix(rows, columns, product_ids))
+    all_rows = list(range(len(product_ids)))
+    written_at = write_recommendations(db, product_ids, all_rows,
+                                       top_neighbours(matrix, all_rows, top_k, min_support) if all_rows else {})
+    # Products with no orders left (e.g. all cancelled) lose their list
+    db[RECOMMENDATIONS].delete_many({'updated_at': {'$lt': written_at}})
+    _save_state(directory, {**_watermark(recent, timedelta(seconds=overlap)), 'product_ids': product_ids,
+                            'top_k': top_k, 'min_support': min_support, 'overlap': overlap}, matrix)
+    return {'orders': orders, 'order_lines': len(columns), 'products': len(product_ids),
+            'pairs': int(matrix.nnz - np.count_nonzero(matrix.diagonal())) // 2,
+            'written': len(all_rows), 'seconds': round(time.perf_counter() - started, 2)}
+
+
+def refresh(db, directory, top_k=12, min_support=2, overlap=600):
+    """Fold orders placed since the last run into C and rewrite the products they affect"""
+    state, matrix = _load_state(directory)
+    # State from before the created_at watermark (last_order_id) is rebuilt too
+    if state is None or not state.get('last_created_at') or state.get('top_k') != top_k \
+            or state.get('min_support') != min_support or state.get('overlap') != overlap:
+        return build(db, directory, top_k, min_support, overlap)
+    started = time.perf_counter()
+    window = [(ObjectId(order_id), datetime.fromisoformat(created_at))
+              for order_id, created_at in state['recent_orders']]
+    since = datetime.fromisoformat(state['last_created_at']) - timedelta(seconds=overlap)
+    rows, columns, recent, orders = read_baskets(db, since, {order_id for order_id, _ in window},
+                                                 timedelta(seconds=overlap))
+    product_ids = state['product_ids']
+    known = len(product_ids)
+    delta = cooccurrence(basket_matrix(rows, columns, product_ids))
+    if len(product_ids) > known:
+        matrix = _resize(matrix, len(product_ids))
+    matrix = (matrix + delta).tocsr()
+    # A product's score changes with its own counts and with those of its neighbours
+    touched = np.unique(delta.nonzero()[0])
+    affected = np.unique(np.concatenate([touched, matrix[touched].indices])) if len(touched) else touched
+    affected = [int(row) for row in affected]
+    if affected:
+        write_recommendations(db, product_ids, affected, top_neighbours(matrix, affected, top_k, min_support))
+    state.update(_watermark(window + recent, timedelta(seconds=overlap)), product_ids=product_ids)
+    _save_state(directory, state, matrix)
+    return {'orders': orders, 'order_lines': len(columns), 'products': len(product_ids),
+            'pairs': int(matrix.nnz - np.count_nonzero(matrix.diagonal())) // 2,
+            'written': len(affected), 'seconds': round(time.perf_counter() - started, 2)}
+
+
+def main():
+    from pymongo import MongoClient
+    from config import Config
+
+    parser = argparse.ArgumentParser(description='Frequently bought together recommendations')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    for name, help_text in (('build', 'recompute from every order'),
+                            ('refresh', 'add orders placed since the last run')):
+        command = subcommands.add_parser(name, help=help_text)
+        command.add_argument('--top-k', type=int, default=Config.RECOMMENDATIONS_TOP_K)
+        command.add_argument('--min-support', type=int, default=Config.RECOMMENDATIONS_MIN_SUPPORT,
+                             help='orders a pair must share to be recommended')
+        command.add_argument('--overlap', type=int, default=Config.RECOMMENDATIONS_OVERLAP,
+                             help='seconds before the watermark a refresh re-reads for late orders')
+    args = parser.parse_args()
+
+    client = MongoClient(Config.MONGODB_URI)
+    try:
+        job = build if args.command == 'build' else refresh
+        report = job(client.get_database(), Config.RECOMMENDATIONS_DIR, args.top_k, args.min_support,
+                     args.overlap)
+    finally:
+        client.close()
+    print(f"✅ {report['orders']} orders ({report['order_lines']} lines), {report['products']} products, "
+          f"{report['pairs']} pairs; {report['written']} lists written in {report['seconds']}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -20,7 +20,9 @@ def ensure_admin(
                     "email": email,
                     "role": "admin",
                     "password_hash": password_hash,
-                }
+                },
+                # Running apps compare this stamp with their cached copy on the next request
+                "$inc": {"auth_version": 1},
             },
             upsert=True,
         )
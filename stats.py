@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Incrementally maintained store counters for the admin dashboard.
+
+Routes $inc a single stats document as users register, products are created
+or deleted and orders are placed or change status, so the dashboard reads one
+document instead of scanning collections. A reconciliation job recomputes the
+numbers from the collections to correct any drift:
+
+    python stats.py reconcile [--every SECONDS]
+"""
+
+import argparse
+import sys
+import time
+from datetime import datetime
+
+STATS = 'store_stats'
+DASHBOARD_ID = 'dashboard'
+# Orders in these statuses do not count towards revenue
+NON_REVENUE_STATUSES = ('cancelled',)
+
+
+def bump_stats(db, **increments):
+    """Apply increments such as products=1 or 'orders_by_status.pending'=-1"""
+    increments = {field: value for field, value in increments.items() if value}
+    if increments:
+        db[STATS].update_one({'_id': DASHBOARD_ID}, {'$inc': increments}, upsert=True)
+
+
+def record_order_placed(db, order):
+    bump_stats(db, **{
+        'orders': 1,
+        f"orders_by_status.{order['status']}": 1,
+        'revenue': _revenue(order['status'], order.get('total_amount', 0)),
+    })
+
+
+def record_order_status_change(db, order, new_status):
+    """order is the document as it was before the status update"""
+    old_status = order.get('status')
+    if old_status == new_status:
+        return
+    total = order.get('total_amount', 0)
+    bump_stats(db, **{
+        f'orders_by_status.{old_status}': -1,
+        f'orders_by_status.{new_status}': 1,
+        'revenue': _revenue(new_status, total) - _revenue(old_status, total),
+    })
+
+
+def _revenue(status, total):
+    return 0 if status in NON_REVENUE_STATUSES else float(total or 0)
+
+
+def reconcile_stats(db):
+    """Recompute every counter from the collections and overwrite the stats document"""
+    by_status = {}
+    revenue = 0.0
+    orders = 0
+    for row in db.orders.aggregate([
+        {'$group': {'_id': '$status', 'count': {'$sum': 1}, 'revenue': {'$sum': '$total_amount'}}}
+    ]):
+        by_status[row['_id']] = row['count']
+        orders += row['count']
+        if row['_id'] not in NON_REVENUE_STATUSES:
+            revenue += row['revenue'] or 0
+    stats = {
+        'products': db.products.count_documents({}),
+        'users': db.users.count_documents({'role': 'user'}),
+        'orders': orders,
+        'revenue': revenue,
+        'orders_by_status': by_status,
+        'reconciled_at': datetime.utcnow(),
+    }
+    db[STATS].replace_one({'_id': DASHBOARD_ID}, stats, upsert=True)
+    stats['_id'] = DASHBOARD_ID
+    return stats
+
+
+def get_dashboard_stats(db):
+    stats = db[STATS].find_one({'_id': DASHBOARD_ID})
+    if stats is None or 'reconciled_at' not in stats:
+        # First read after deploy: seed the counters from the collections once
+        stats = reconcile_stats(db)
+    return stats
+
+
+def main():
+    from pymongo import MongoClient
+    from config import Config
+
+    parser = argparse.ArgumentParser(description='Dashboard counters')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    reconcile = subcommands.add_parser('reconcile', help='recompute counters from the collections')
+    reconcile.add_argument('--every', type=int, default=0, help='repeat every N seconds')
+    args = parser.parse_args()
+
+    client = MongoClient(Config.MONGODB_URI)
+    db = client.get_database()
+    try:
+        while True:
+            before = db[STATS].find_one({'_id': DASHBOARD_ID}) or {}
+            after = reconcile_stats(db)
+            drift = {key: after[key] - before.get(key, 0)
+                     for key in ('products', 'users', 'orders', 'revenue')
+                     if after[key] != before.get(key, 0)}
+            print(f"✅ Stats reconciled{', corrected ' + str(drift) if drift else ''}")
+            if not args.every:
+                break
+            time.sleep(args.every)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
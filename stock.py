@@ -0,0 +1,253 @@
+"""
+Atomic stock reservation.
+
+All lines of an order are decremented in one ordered bulk_write whose filters
+only match while `stock.<size>` still covers the quantity, so concurrent
+checkouts can never drive stock negative.
+
+Each update is sent with upsert=True. When a guard fails the server tries to
+insert a new document with the product's existing _id, which is rejected as a
+duplicate key. That turns "not enough stock" into a write error carrying the
+line's index, and the ordered bulk stops there. Every line before it was
+applied and is released again, so a reservation is all or nothing in a single
+round trip on the happy path. A product deleted mid-checkout is upserted as a
+stub instead; those stubs are removed and treated as failures too.
+
+Admin stock adjustments (set / inc / dec rows, e.g. a warehouse spreadsheet)
+use the same guards in one unordered bulk_write, so every row is applied or
+rejected on its own and gets its own result:
+
+    python stock.py adjust delivery.csv     # columns: product_id or sku, size, action, value
+"""
+
+import argparse
+import csv
+import io
+import sys
+from collections import OrderedDict
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+SIZES = ('S', 'M', 'L', 'XL')
+ACTIONS = ('set', 'inc', 'dec')
+DUPLICATE_KEY = 11000
+
+
+class StockReservationError(Exception):
+    """A line could not be reserved; nothing from the reservation remains applied"""
+
+    def __init__(self, product_id, size, quantity):
+        super().__init__(f"Insufficient stock for {product_id} size {size}")
+        self.product_id = product_id
+        self.size = size
+        self.quantity = quantity
+
+
+def merge_lines(lines):
+    """Combine (product_id, size, quantity) lines that hit the same stock field"""
+    merged = OrderedDict()
+    for product_id, size, quantity in lines:
+        if size not in SIZES or quantity <= 0:
+            raise StockReservationError(product_id, size, quantity)
+        merged[(product_id, size)] = merged.get((product_id, size), 0) + quantity
+    return [(product_id, size, quantity) for (product_id, size), quantity in merged.items()]
+
+
+def release_stock(db, lines):
+    """Give reserved quantities back"""
+    if lines:
+        db.products.bulk_write([
+            UpdateOne({'_id': product_id}, {'$inc': {f'stock.{size}': quantity}})
+            for product_id, size, quantity in lines
+        ], ordered=False)
+
+
+def reserve_stock(db, lines):
+    """Decrement stock for every line or for none of them; returns the merged lines"""
+    lines = merge_lines(lines)
+    if not lines:
+        return lines
+    ops = [
+        UpdateOne({'_id': product_id, f'stock.{size}': {'$gte': quantity}},
+                  {'$inc': {f'stock.{size}': -quantity}},
+                  upsert=True)
+        for product_id, size, quantity in lines
+    ]
+    error = None
+    try:
+        result = db.products.bulk_write(ops, ordered=True)
+        applied = len(lines)
+        stubs = dict(result.upserted_ids)
+    except BulkWriteError as e:
+        write_error = e.details['writeErrors'][0]
+        applied = write_error['index']
+        stubs = {upsert['index']: upsert['_id'] for upsert in e.details.get('upserted', [])}
+        if write_error.get('code') != DUPLICATE_KEY:
+            error = e
+
+    failed_at = applied
+    if stubs:
+        # Products that vanished mid-checkout were inserted as bare stock stubs
+        db.products.delete_many({'_id': {'$in': list(stubs.values())}, 'name': {'$exists': False}})
+        failed_at = min(failed_at, min(stubs))
+
+    if failed_at == len(lines):
+        return lines
+
+    release_stock(db, [line for i, line in enumerate(lines[:applied]) if i not in stubs])
+    if error is not None:
+        raise error
+    raise StockReservationError(*lines[failed_at])
+
+
+def _adjustment(row):
+    """(product_id or None, sku or None, size, action, value) of a raw row, or raises ValueError"""
+    size = str(row.get('size') or '').strip().upper()
+    action = str(row.get('action') or 'set').strip().lower()
+    if size not in SIZES:
+        raise ValueError(f"invalid size {row.get('size')!r}")
+    if action not in ACTIONS:
+        raise ValueError(f"invalid action {row.get('action')!r}")
+    try:
+        value = int(str(row.get('value')).strip())
+    except ValueError:
+        raise ValueError(f"invalid value {row.get('value')!r}")
+    if value < 0:
+        raise ValueError('value cannot be negative')
+    product_id = row.get('product_id')
+    sku = str(row.get('sku') or '').strip() or None
+    if product_id:
+        try:
+            product_id = ObjectId(str(product_id).strip())
+        except InvalidId:
+            raise ValueError(f"invalid product_id {product_id!r}")
+    elif not sku:
+        raise ValueError('product_id or sku is required')
+    return product_id or None, sku, size, action, value
+
+
+def _adjust_op(product_id, size, action, value):
+    field = f'stock.{size}'
+    if action == 'set':
+        return UpdateOne({'_id': product_id}, {'$set': {field: value}}, upsert=True)
+    if action == 'inc':
+        return UpdateOne({'_id': product_id}, {'$inc': {field: value}}, upsert=True)
+    # Only matches while the stock covers the decrement; otherwise the upsert fails as a duplicate key
+    return UpdateOne({'_id': product_id, field: {'$gte': value}}, {'$inc': {field: -value}}, upsert=True)
+
+
+def adjust_stock(db, rows):
+    """Apply stock adjustment rows in one bulk_write; returns one result dict per row, in order
+
+    Each row has product_id or sku, size, action (set | inc | dec) and value. A
+    result's status is applied, insufficient (a dec larger than the stock),
+    not_found, duplicate (the size already appears in an earlier row, since
+    unordered rows have no defined order), invalid or error. Applied results
+    carry the size's stock right after the write.
+    """
+    results = []
+    parsed = []
+    for number, row in enumerate(rows):
+        result = {'row': number, 'product_id': row.get('product_id'), 'sku': row.get('sku'),
+                  'size': row.get('size'), 'action': row.get('action'), 'value': row.get('value')}
+        results.append(result)
+        try:
+            parsed.append((result,) + _adjustment(row))
+        except ValueError as e:
+            result.update(status='invalid', error=str(e))
+
+    skus = {sku for _, product_id, sku, _, _, _ in parsed if product_id is None}
+    ids_by_sku = {}
+    if skus:
+        ids_by_sku = {product['sku']: product['_id']
+                      for product in db.products.find({'sku': {'$in': list(skus)}}, {'sku': 1})}
+
+    pending = []  # (result, product_id, size, action, value) in bulk_write order
+    seen = set()
+    for result, product_id, sku, size, action, value in parsed:
+        product_id = product_id or ids_by_sku.get(sku)
+        if product_id is None:
+            result.update(status='not_found', error=f"no product with sku {sku!r}")
+            continue
+        if (product_id, size) in seen:
+            result.update(status='duplicate', error=f"size {size} of this product is already adjusted by another row")
+            continue
+        seen.add((product_id, size))
+        result.update(product_id=str(product_id), size=size, action=action, value=value)
+        pending.append((result, product_id, size, action, value))
+    if not pending:
+        return results
+
+    errors = {}
+    try:
+        bulk = db.products.bulk_write([_adjust_op(*entry[1:]) for entry in pending], ordered=False)
+        stubs = dict(bulk.upserted_ids)
+    except BulkWriteError as e:
+        errors = {error['index']: error for error in e.details['writeErrors']}
+        stubs = {upsert['index']: upsert['_id'] for upsert in e.details.get('upserted', [])}
+    if stubs:
+        # Rows naming a deleted product inserted bare stock stubs
+        db.products.delete_many({'_id': {'$in': list(stubs.values())}, 'name': {'$exists': False}})
+
+    applied = []
+    for index, (result, product_id, size, action, value) in enumerate(pending):
+        if index in stubs:
+            result.update(status='not_found', error='product not found')
+        elif index in errors and errors[index].get('code') == DUPLICATE_KEY:
+            result.update(status='insufficient', error=f"not enough stock to remove {value}")
+        elif index in errors:
+            result.update(status='error', error=errors[index].get('errmsg'))
+        else:
+            result['status'] = 'applied'
+            applied.append((result, product_id, size))
+    if applied:
+        stock = {product['_id']: product.get('stock') or {}
+                 for product in db.products.find({'_id': {'$in': list({p for _, p, _ in applied})}}, {'stock': 1})}
+        for result, product_id, size in applied:
+            result['stock'] = stock.get(product_id, {}).get(size)
+    return results
+
+
+def applied_product_ids(results):
+    return {ObjectId(result['product_id']) for result in results if result.get('status') == 'applied'}
+
+
+def read_adjustments(stream):
+    """Rows of a binary CSV stream with product_id or sku, size, action and value columns"""
+    return list(csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')))
+
+
+def main():
+    from pymongo import MongoClient
+    from cache import create_cache
+    from config import Config
+
+    parser = argparse.ArgumentParser(description='Stock adjustments')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    adjust = subcommands.add_parser('adjust', help='apply set/inc/dec rows from a CSV file')
+    adjust.add_argument('file', help='CSV with product_id or sku, size, action and value columns')
+    args = parser.parse_args()
+
+    with open(args.file, 'rb') as stream:
+        rows = read_adjustments(stream)
+    client = MongoClient(Config.MONGODB_URI)
+    try:
+        results = adjust_stock(client.get_database(), rows)
+    finally:
+        client.close()
+    failed = [result for result in results if result['status'] != 'applied']
+    for result in failed:
+        product = result.get('sku') or result.get('product_id')
+        # Row numbers count the header as line 1, like a spreadsheet
+        print(f"❌ line {result['row'] + 2} {product} {result.get('size')}: {result['status']} - {result['error']}")
+    print(f"✅ {len(results) - len(failed)} of {len(results)} rows applied")
+    if len(failed) < len(results):
+        create_cache({key: getattr(Config, key) for key in dir(Config) if key.isupper()}).invalidate('products')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
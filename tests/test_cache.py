@@ -0,0 +1,49 @@
+import pytest
+
+from cache import MemoryBackend, NullBackend, QueryCache, SQLiteBackend
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'none'])
+def backend(request, tmp_path):
+    if request.param == 'sqlite':
+        return SQLiteBackend(str(tmp_path / 'cache.sqlite3'), max_tags=3)
+    if request.param == 'none':
+        return NullBackend(max_tags=3)
+    return MemoryBackend(max_tags=3)
+
+
+def kept_tags(backend):
+    if isinstance(backend, SQLiteBackend):
+        return backend._conn().execute('SELECT COUNT(*) FROM cache_tags').fetchone()[0]
+    return len(backend._tags)
+
+
+def test_tags_beyond_the_bound_are_dropped(backend):
+    for n in range(50):
+        backend.bump_tags([f'user:{n}'])
+    backend.bump_tags(['products'])
+
+    assert kept_tags(backend) == 3
+
+
+def test_a_dropped_tag_never_returns_to_an_old_version(backend):
+    backend.bump_tags(['products', 'products'])
+    before = backend.tag_versions(['products', 'categories'])
+    for n in range(10):
+        backend.bump_tags([f'user:{n}'])
+
+    after = backend.tag_versions(['products', 'categories'])
+    assert after[0] >= before[0]
+    backend.bump_tags(['products'])
+    assert backend.tag_versions(['products'])[0] > after[0]
+
+
+def test_entries_stored_before_an_invalidation_stay_invalid_once_the_tag_is_dropped(tmp_path):
+    for backend in (MemoryBackend(max_tags=2), SQLiteBackend(str(tmp_path / 'cache.sqlite3'), max_tags=2)):
+        cache = QueryCache(backend)
+        assert cache.get_or_set('page', lambda: 'old', tags=['product:1']) == 'old'
+        cache.invalidate('product:1')
+        cache.invalidate('product:2')
+        cache.invalidate('product:3')
+
+        assert cache.get_or_set('page', lambda: 'new', tags=['product:1']) == 'new'
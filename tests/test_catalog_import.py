@@ -0,0 +1,52 @@
+import io
+
+import mongomock
+import pytest
+
+from catalog_import import CatalogImporter, ImageSource, load_categories, read_rows
+
+
+def test_created_categories_are_deduplicated_case_insensitively():
+    db = mongomock.MongoClient().ecommerce
+    db.categories.insert_one({'name': 'Dresses', 'description': ''})
+    categories = load_categories(db, ['Shirts', 'shirts', ' SHIRTS ', 'dresses', ''], create=True)
+
+    assert sorted(categories) == ['dresses', 'shirts']
+    created = list(db.categories.find({'name': {'$ne': 'Dresses'}}))
+    assert [category['name'] for category in created] == ['Shirts']
+    assert created[0]['_id'] == categories['shirts']
+    assert created[0]['created_at'] is not None
+
+
+def import_json(db, text, create_categories=False):
+    return CatalogImporter(db).run(read_rows(io.BytesIO(text.encode()), 'json'), ImageSource(),
+                                   create_categories=create_categories)
+
+
+def test_non_object_rows_are_rejected():
+    db = mongomock.MongoClient().ecommerce
+    report = import_json(db, '["oops", 3, {"sku": "A1", "name": "Tee", "category": "Shirts", "price": 10}]',
+                         create_categories=True)
+
+    assert report['failed'] == 2
+    assert report['inserted'] == 1
+    assert [error['error'] for error in report['errors']] == ['row must be an object, got str',
+                                                               'row must be an object, got int']
+
+
+@pytest.mark.parametrize('row', [
+    '{"sku": "A1", "name": "Tee", "category": "Shirts", "price": "nan"}',
+    '{"sku": "A1", "name": "Tee", "category": "Shirts", "price": Infinity}',
+    '{"sku": "A1", "name": "Tee", "category": "Shirts", "price": 10, "stock": {"M": "inf"}}',
+])
+def test_non_finite_numbers_are_rejected(row):
+    db = mongomock.MongoClient().ecommerce
+    report = import_json(db, f'[{row}]', create_categories=True)
+
+    assert report['failed'] == 1
+    assert db.products.count_documents({}) == 0
+
+
+def test_json_catalog_must_be_a_list():
+    with pytest.raises(ValueError):
+        import_json(mongomock.MongoClient().ecommerce, '"oops"')
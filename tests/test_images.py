@@ -0,0 +1,42 @@
+import os
+
+import mongomock
+from bson import ObjectId
+from PIL import Image
+
+from images import apply_derivatives, derivative_paths, render_derivatives
+
+
+def render(tmp_path, gridfs_id, color):
+    source = tmp_path / f'{color}.png'
+    Image.new('RGB', (400, 300), color).save(source)
+    return render_derivatives(str(source), str(tmp_path), {'thumbnail': 100, 'detail': 300}, '/static', gridfs_id)
+
+
+def test_new_derivatives_remove_the_files_they_replace(tmp_path):
+    db = mongomock.MongoClient().ecommerce
+    gridfs_id, other_id = ObjectId(), ObjectId()
+    first = render(tmp_path, gridfs_id, 'red')
+    other = render(tmp_path, other_id, 'red')
+    product_id = db.products.insert_one({'images': [{'gridfs_id': gridfs_id}, {'gridfs_id': other_id}]}).inserted_id
+    apply_derivatives(db, gridfs_id, first)
+    apply_derivatives(db, other_id, other)
+    old_paths = derivative_paths(db.products.find_one()['images'][0])
+
+    second = render(tmp_path, gridfs_id, 'blue')
+    assert apply_derivatives(db, gridfs_id, second) == product_id
+
+    images = db.products.find_one()['images']
+    assert all(os.path.exists(path) for image in images for path in derivative_paths(image))
+    assert not any(os.path.exists(path) for path in set(old_paths) - set(derivative_paths(images[0])))
+
+
+def test_rerendering_the_same_picture_keeps_its_files(tmp_path):
+    db = mongomock.MongoClient().ecommerce
+    gridfs_id = ObjectId()
+    db.products.insert_one({'images': [{'gridfs_id': gridfs_id}]})
+    apply_derivatives(db, gridfs_id, render(tmp_path, gridfs_id, 'red'))
+    apply_derivatives(db, gridfs_id, render(tmp_path, gridfs_id, 'red'))
+
+    paths = derivative_paths(db.products.find_one()['images'][0])
+    assert paths and all(os.path.exists(path) for path in paths)
@@ -0,0 +1,60 @@
+import os
+
+import mongomock
+import pytest
+
+os.environ.setdefault('MONGODB_URI', 'mongodb://127.0.0.1:1/ecommerce')
+os.environ['INDEXES_ON_STARTUP'] = 'false'
+
+import app as shop  # noqa: E402
+
+DATA = bytes(range(256)) * 40
+
+
+@pytest.fixture
+def image(monkeypatch):
+    db = mongomock.MongoClient().ecommerce
+    monkeypatch.setattr(shop, 'db', db)
+    file_id = db.fs.files.insert_one({'length': len(DATA), 'chunkSize': 4096, 'contentType': 'image/jpeg',
+                                      'sha256': 'abc'}).inserted_id
+    for n in range(0, len(DATA), 4096):
+        db.fs.chunks.insert_one({'files_id': file_id, 'n': n // 4096, 'data': DATA[n:n + 4096]})
+    return f'/image/{file_id}'
+
+
+def test_single_range_is_partial(image):
+    with shop.app.test_client().get(image, headers={'Range': 'bytes=4000-4199'}) as response:
+        assert response.status_code == 206
+        assert response.headers['Content-Range'] == f'bytes 4000-4199/{len(DATA)}'
+        assert response.data == DATA[4000:4200]
+
+
+def test_multiple_ranges_get_the_whole_file(image):
+    with shop.app.test_client().get(image, headers={'Range': 'bytes=0-9,100-199'}) as response:
+        assert response.status_code == 200
+        assert response.data == DATA
+
+
+def test_unsatisfiable_single_range_is_416(image):
+    with shop.app.test_client().get(image, headers={'Range': f'bytes={len(DATA)}-'}) as response:
+        assert response.status_code == 416
+        assert response.headers['Content-Range'] == f'bytes */{len(DATA)}'
+
+
+def test_commands_issued_while_streaming_are_recorded(image, monkeypatch):
+    # mongomock emits no command events, so the chunk reads are recorded by hand
+    def chunks(file_id, chunk_size, start, stop):
+        trace = shop.mongo_recorder.current()
+        for n in range(3):
+            trace.commands.append(('find', 'fs.chunks', '{files_id, n}', 1.0))
+            yield DATA[n * 10:n * 10 + 10]
+
+    monkeypatch.setattr(shop, 'iter_gridfs_range', chunks)
+    monkeypatch.setitem(shop.app.config, 'MONGO_INSTRUMENTATION', True)
+    shop.mongo_report.reset()
+    with shop.app.test_client().get(image) as response:
+        assert response.data == DATA[:30]
+
+    route, = [row for row in shop.mongo_report.snapshot() if row['endpoint'] == 'stream_image']
+    assert route['commands'] >= 3
+    assert shop.mongo_recorder.current() is None
@@ -0,0 +1,55 @@
+import os
+
+import mongomock
+import pytest
+
+os.environ.setdefault('MONGODB_URI', 'mongodb://127.0.0.1:1/ecommerce')
+os.environ['INDEXES_ON_STARTUP'] = 'false'
+
+import app as shop  # noqa: E402
+import reset_admin  # noqa: E402
+from cache import MemoryBackend  # noqa: E402
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = mongomock.MongoClient('mongodb://localhost/ecommerce')
+    monkeypatch.setattr(shop, 'db', client.get_database())
+    # reset_admin.py connects on its own, like a separate process would
+    monkeypatch.setattr(reset_admin, 'MongoClient', lambda uri: client)
+    monkeypatch.setattr(client, 'close', lambda: None)
+    monkeypatch.setattr(shop, 'user_cache', MemoryBackend(16))
+    return client
+
+
+def test_role_changed_out_of_process_applies_on_next_load(client):
+    user_id = shop.db.users.insert_one({'username': 'admin', 'email': 'admin@example.com',
+                                        'role': 'user', 'auth_version': 0}).inserted_id
+    session_id = f'{user_id}:0'
+    assert shop.load_user(session_id).role == 'user'
+
+    reset_admin.ensure_admin(username='admin', email='admin@example.com', new_password='secret1')
+    assert shop.load_user(session_id).role == 'admin'
+
+    shop.db.users.update_one({'_id': user_id}, {'$set': {'role': 'user'}, '$inc': {'auth_version': 1}})
+    assert shop.load_user(session_id).role == 'user'
+
+
+def test_cached_user_is_reused_while_the_stamp_matches(client, monkeypatch):
+    user_id = shop.db.users.insert_one({'username': 'shopper', 'email': 'shopper@example.com',
+                                        'role': 'user'}).inserted_id
+    shop.load_user(f'{user_id}:0')
+    projections = []
+    find_one = shop.db.users.find_one
+    monkeypatch.setattr(shop.db.users, 'find_one',
+                        lambda query, projection: projections.append(projection) or find_one(query, projection))
+    assert shop.load_user(f'{user_id}:0').username == 'shopper'
+    assert projections == [{'_id': 0, 'auth_version': 1}]
+
+
+def test_deleted_user_is_dropped_from_the_cache(client):
+    user_id = shop.db.users.insert_one({'username': 'gone', 'role': 'user'}).inserted_id
+    shop.load_user(f'{user_id}:0')
+    shop.db.users.delete_one({'_id': user_id})
+    assert shop.load_user(f'{user_id}:0') is None
+    assert shop.user_cache.get(str(user_id)) is None
@@ -0,0 +1,213 @@
+"""
+In-process prefix index for search-box suggestions.
+
+Every product and category name is normalised (lowercase, accents and
+punctuation stripped) and indexed under each of its word suffixes, so "cot sh"
+and "shirt" both find "Blue Cotton Shirt". Terms live in one sorted array and
+a prefix is the bisect range [prefix, prefix + U+FFFF). Suggestions are ranked
+by popularity (units sold over the last TYPEAHEAD_POPULARITY_DAYS, summed per
+category for categories). Short prefixes match thousands of terms, so the
+top results of every prefix matching more than HEAVY_PREFIX terms are
+precomputed and updated in place when entries change; other prefixes rank
+their few terms directly.
+
+Admin writes are applied to the index incrementally; other processes' writes
+trigger a background rebuild.
+"""
+
+import bisect
+import heapq
+import re
+import threading
+import unicodedata
+from datetime import datetime, timedelta
+
+MAX_SUGGESTIONS = 20
+HEAVY_PREFIX = 256
+# Heavy prefixes keep spare entries so removing a suggestion rarely forces a rescan
+HEAVY_KEEP = 2 * MAX_SUGGESTIONS
+PRODUCT_FIELDS = {'name': 1}
+_NON_WORD = re.compile(r'[^0-9a-z]+')
+
+
+def normalize(text):
+    """Lowercase ASCII words separated by single spaces"""
+    text = unicodedata.normalize('NFKD', str(text or '')).encode('ascii', 'ignore').decode('ascii')
+    return _NON_WORD.sub(' ', text.lower()).strip()
+
+
+def _terms(label):
+    words = normalize(label).split()
+    return {' '.join(words[i:]) for i in range(len(words))}
+
+
+def load_popularity(db, days=90):
+    """{product id: units sold} over the last days, from the daily sales rollups"""
+    since = (datetime.utcnow() - timedelta(days=days)).strftime('%Y-%m-%d')
+    units = {}
+    for day in db.sales_daily.find({'_id': {'$gte': since}}, {'products': 1}):
+        for product_id, figures in (day.get('products') or {}).items():
+            units[product_id] = units.get(product_id, 0) + (figures.get('units') or 0)
+    return units
+
+
+class TypeaheadIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.ready = False
+        # Cache tag versions (products, categories) of the catalog this index reflects
+        self.version = None
+        self.built_at = None
+        self._clear()
+
+    def _clear(self):
+        self._entries = {}     # (kind, id) -> (label, popularity, terms)
+        self._terms = []       # sorted terms
+        self._refs = []        # (kind, id) of each term, parallel to _terms
+        self._heavy = {}       # prefix -> up to MAX_SUGGESTIONS refs, most popular first
+        self._popularity = {}  # product id -> units sold, kept for incremental updates
+        self._category_of = {} # product id -> category id
+
+    def build(self, products, categories, popularity=None, version=None):
+        """Replace the index contents; products need name and category_id"""
+        popularity = popularity or {}
+        entries, category_of, category_units = {}, {}, {}
+        for product in products:
+            product_id = str(product['_id'])
+            units = popularity.get(product_id, 0)
+            category_id = str(product['category_id']) if product.get('category_id') is not None else None
+            category_of[product_id] = category_id
+            category_units[category_id] = category_units.get(category_id, 0) + units
+            entries[('product', product_id)] = (product.get('name') or '', units, _terms(product.get('name')))
+        for category in categories:
+            category_id = str(category['_id'])
+            entries[('category', category_id)] = (category.get('name') or '', category_units.get(category_id, 0),
+                                                  _terms(category.get('name')))
+        pairs = sorted((term, ref) for ref, (_, _, terms) in entries.items() for term in terms)
+        with self._lock:
+            self._clear()
+            self._entries = entries
+            self._terms = [term for term, _ in pairs]
+            self._refs = [ref for _, ref in pairs]
+            self._popularity = dict(popularity)
+            self._category_of = category_of
+            self._warm('', 0, len(self._terms))
+            self.version = version
+            self.built_at = datetime.utcnow()
+            self.ready = True
+
+    def _range(self, prefix):
+        return bisect.bisect_left(self._terms, prefix), bisect.bisect_left(self._terms, prefix + '\uffff')
+
+    def _rank(self, refs, limit):
+        return heapq.nlargest(limit, set(refs), key=lambda ref: (self._entries[ref][1], ref))
+
+    def _warm(self, prefix, lo, hi):
+        """Top refs of terms[lo:hi] (those starting with prefix), keeping the lists of heavy prefixes
+
+        A heavy prefix's list is merged from its children's lists, so building
+        all of them reads each term about once.
+        """
+        if hi - lo <= HEAVY_PREFIX:
+            return self._rank(self._refs[lo:hi], MAX_SUGGESTIONS)
+        depth = len(prefix)
+        candidates = []
+        i = lo
+        while i < hi:
+            if len(self._terms[i]) == depth:
+                candidates.append(self._refs[i])
+                i += 1
+                continue
+            child = self._terms[i][:depth + 1]
+            j = bisect.bisect_left(self._terms, child + '\uffff', i, hi)
+            candidates.extend(self._warm(child, i, j))
+            i = j
+        top = self._rank(candidates, HEAVY_KEEP)
+        self._heavy[prefix] = top
+        return top
+
+    def _top(self, prefix):
+        """Most popular refs for prefix, best first"""
+        top = self._heavy.get(prefix)
+        if top is not None:
+            return top
+        lo, hi = self._range(prefix)
+        if hi - lo > HEAVY_PREFIX:
+            top = self._heavy[prefix] = self._rank(self._refs[lo:hi], HEAVY_KEEP)
+            return top
+        return self._rank(self._refs[lo:hi], MAX_SUGGESTIONS)
+
+    def suggest(self, query, limit=8):
+        """[{'type', 'id', 'label'}] for names with a word starting with query, most popular first"""
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        limit = max(1, min(limit, MAX_SUGGESTIONS))
+        with self._lock:
+            refs = self._top(prefix)[:limit]
+            return [{'type': kind, 'id': entry_id, 'label': self._entries[(kind, entry_id)][0]}
+                    for kind, entry_id in refs]
+
+    def _remove(self, ref):
+        entry = self._entries.pop(ref, None)
+        if entry is None:
+            return
+        for term in entry[2]:
+            lo, hi = bisect.bisect_left(self._terms, term), bisect.bisect_right(self._terms, term)
+            for i in range(lo, hi):
+                if self._refs[i] == ref:
+                    del self._terms[i]
+                    del self._refs[i]
+                    break
+            for length in range(1, len(term) + 1):
+                top = self._heavy.get(term[:length])
+                if top is not None and ref in top:
+                    top.remove(ref)
+                    # Running out of spares means unlisted entries may now belong; rescan on next use
+                    if len(top) < MAX_SUGGESTIONS:
+                        del self._heavy[term[:length]]
+
+    def _add(self, ref, label, popularity):
+        terms = _terms(label)
+        self._entries[ref] = (label, popularity, terms)
+        key = (popularity, ref)
+        for term in terms:
+            i = bisect.bisect_right(self._terms, term)
+            self._terms.insert(i, term)
+            self._refs.insert(i, ref)
+            for length in range(1, len(term) + 1):
+                top = self._heavy.get(term[:length])
+                # A heavy list is the top of all entries, so only entries beating its last one join it
+                if top is None or ref in top or key <= (self._entries[top[-1]][1], top[-1]):
+                    continue
+                top.append(ref)
+                top.sort(key=lambda r: (self._entries[r][1], r), reverse=True)
+                del top[HEAVY_KEEP:]
+
+    def upsert_product(self, product):
+        product_id = str(product['_id'])
+        category_id = str(product['category_id']) if product.get('category_id') is not None else None
+        with self._lock:
+            self._remove(('product', product_id))
+            self._add(('product', product_id), product.get('name') or '', self._popularity.get(product_id, 0))
+            self._category_of[product_id] = category_id
+
+    def remove_product(self, product_id):
+        with self._lock:
+            self._remove(('product', str(product_id)))
+            self._category_of.pop(str(product_id), None)
+
+    def upsert_category(self, category):
+        category_id = str(category['_id'])
+        with self._lock:
+            units = sum(self._popularity.get(product_id, 0)
+                        for product_id, owner in self._category_of.items() if owner == category_id)
+            self._remove(('category', category_id))
+            self._add(('category', category_id), category.get('name') or '', units)
+
+    def remove_category(self, category_id):
+        with self._lock:
+            self._remove(('category', str(category_id)))
+
+    def __len__(self):
+        return len(self._entries)